@@ -4,6 +4,9 @@ import argparse
 import numpy as np
 import pandas as pd
 
+from flow.core.kernel.simulation.emission import load_emission, find_emission_files
+from flow.core.shock_scheduler import load_shock_log, shock_log_path
+
 """
 Notes: 
 There seems to be:
@@ -44,7 +47,57 @@ class EvalMetrics():
         else:
             self.reference_id = 'classic_00' #TODO: Verify this. Verified for LACC, BCM, FS, PI
 
-    def efficiency(self, ):
+        # The emission file being evaluated, parsed once and shared by efficiency, safety and stability while it is the current file (see evaluate)
+        # Only one file is kept at a time, so that memory does not grow with the number of files evaluated
+        self.emissions = {}
+
+    def load(self, file):
+        """
+        Load an emission file (csv, npz or columnar), only parsing it again if another file was loaded since
+        """
+        if file not in self.emissions:
+            # Drop the previous file before parsing the next one
+            self.emissions.clear()
+            self.emissions[file] = load_emission(file)
+        return self.emissions[file]
+
+    def shocks(self, file):
+        """
+        The shocks applied during the rollout of an emission file, read from the shock log stored next to it (None if there is none)
+        Returns the ids of the shocked vehicles, and one row per shocked vehicle: shock index, start step, stop step (exclusive, -1 if in progress at the end), value
+        """
+        return load_shock_log(shock_log_path(file))
+
+    def print_shocks(self, file):
+        """
+        Summary of the shock log of an emission file
+        """
+        shock_log = self.shocks(file)
+        if shock_log is None:
+            return
+        shock_ids, shocks = shock_log
+        stopped = shocks[:, 2] >= 0
+        shocked_steps = int(np.sum(shocks[stopped, 2] - shocks[stopped, 1]))
+        print(f"Shocks applied: {len(np.unique(shocks[:, 0]))}, to {len(set(shock_ids))} vehicles, for {shocked_steps} vehicle-steps\n")
+
+    def evaluate(self, ):
+        """
+        Efficiency, safety and stability metrics of every file
+        Each file is parsed once and evaluated for all three families before the next file is loaded
+        Returns the results of efficiency, safety and stability (see each), one value per file in each list
+        """
+        efficiency = [[] for _ in range(2)]
+        safety = [[] for _ in range(2)]
+        stability = [[]]
+
+        for file in self.kwargs['files']:
+            for collectors, values in [(efficiency, self.efficiency([file])), (safety, self.safety([file])), (stability, [self.stability([file])])]:
+                for collector, file_values in zip(collectors, values):
+                    collector.extend(file_values)
+
+        return tuple(efficiency), tuple(safety), stability[0]
+
+    def efficiency(self, files):
         """
         Throughput and Fuel consumption
         """
@@ -53,9 +106,10 @@ class EvalMetrics():
         mpgs_avg_mother = []
         throughput_mother = []
 
-        for file in self.kwargs['files']:
+        for file in files:
             print(f"file: {file}")
-            self.df = pd.read_csv(file)
+            self.df = self.load(file)
+            self.print_shocks(file)
 
             #print(f"DF head: \n{self.df.head()}")
             # Time increments in args.sim_step increments
@@ -188,7 +242,7 @@ class EvalMetrics():
 
         return mpgs_avg_mother, throughput_mother
     
-    def safety(self, ):
+    def safety(self, files):
         """
         Time to Collision and Deceleration rate to avoid a crash
         For both, worst case taken. Also for both, only control vehicles considered
@@ -270,8 +324,8 @@ class EvalMetrics():
         #     drac_mother.append(worst_drac)
 
         # ChatGPT optimized version 
-        for file in self.kwargs['files']:
-            self.df = pd.read_csv(file)
+        for file in files:
+            self.df = self.load(file)
             self.vehicle_ids = self.df['id'].unique()
             print("####################")
 
@@ -322,7 +376,7 @@ class EvalMetrics():
 
         return ttc_mother, drac_mother
 
-    def stability(self, ):
+    def stability(self, files):
         """
         Only Controller acceleration variation here
         WAR has its own process to measure
@@ -330,9 +384,9 @@ class EvalMetrics():
         
         cav_mother = [] # across rollouts 
 
-        for file in self.kwargs['files']:
+        for file in files:
             #print(f"file: {file}")
-            self.df = pd.read_csv(file)
+            self.df = self.load(file)
 
             self.vehicle_ids = self.df['id'].unique()
             #print(f"Vehicle ids: {self.vehicle_ids}")
@@ -378,6 +432,24 @@ class EvalMetrics():
             cav_mother.append(worst_cav)
 
         return cav_mother
+
+
+def evaluate_file(file, method, start_time, end_time, sim_step=0.1):
+    """
+    All metrics of a single emission file (used by the parallel runner, see eval_runner.py)
+    start_time and end_time are in steps
+    """
+    args = argparse.Namespace(method=method, start_time=start_time, end_time=end_time, sim_step=sim_step)
+    metrics = EvalMetrics(args, files=[file])
+
+    (mpgs_mother, throughput_mother), (ttc_mother, drac_mother), cav_mother = metrics.evaluate()
+
+    return {'ttc': ttc_mother[0],
+            'drac': drac_mother[0],
+            'mpg': mpgs_mother[0],
+            'throughput': throughput_mother[0],
+            'cav': cav_mother[0],
+    }
         
 
 if __name__ == '__main__':
@@ -398,17 +470,14 @@ if __name__ == '__main__':
     if args.method is None or args.method not in ['bcm', 'idm', 'fs', 'pi', 'lacc', 'vinitsky', 'ours']:
         raise ValueError("Please specify the method to evaluate metrics for\n Method can be [bcm, idm, fs, pi, lacc, wu, ours]")
     
-    files = [f"{args.emissions_file_path}/{args.method}/{item}" for item in os.listdir(f"{args.emissions_file_path}/{args.method}") \
-        if item.endswith('.csv')]
+    files = find_emission_files(f"{args.emissions_file_path}/{args.method}")
 
     kwargs = {'files': files,}
 
     metrics = EvalMetrics(args, **kwargs)
     print(f"Calculating metrics for {args.num_rollouts} rollouts on files: \n{files}\n")
 
-    mpgs_mother, throughput_mother = metrics.efficiency()
-    ttc_mother, drac_mother = metrics.safety()
-    cav_mother = metrics.stability()
+    (mpgs_mother, throughput_mother), (ttc_mother, drac_mother), cav_mother = metrics.evaluate()
 
     print("####################")
     print("####################")
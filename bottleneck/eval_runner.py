@@ -0,0 +1,51 @@
+"""
+Evaluate the emission files of several methods in parallel.
+
+Each rollout file is evaluated once for all metrics (TTC, DRAC, MPG, throughput, CAV) in a pool of
+worker processes, and the results are reduced into per-method mean and std tables.
+Results are cached next to the emission files, so re-running only evaluates new or changed rollouts.
+
+Example:
+    python eval_runner.py --emissions_file_path ./test_time_rollout --methods idm fs bcm ours --num_workers 16
+"""
+import os
+import argparse
+
+import pandas as pd
+
+from flow.core.evaluation import run_evaluation, summarize
+from eval_metrics import evaluate_file
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluating metrics for several methods in parallel')
+    parser.add_argument('--emissions_file_path', type=str, default='./test_time_rollout',
+                    help='Path to emissions file, with one sub-directory per method')
+    parser.add_argument('--methods', type=str, nargs='+', default=['bcm', 'idm', 'fs', 'pi', 'lacc', 'vinitsky', 'ours'])
+    parser.add_argument('--start_time', type=int, default= 4400)
+    parser.add_argument('--end_time', type=int, default= 8000)
+    parser.add_argument('--sim_step', type=float, default=0.1)
+
+    parser.add_argument('--num_workers', type=int, default=None, help='Defaults to the number of cpus')
+    parser.add_argument('--cache', type=str, default=None, help='Defaults to <emissions_file_path>/eval_cache.json')
+    parser.add_argument('--no_cache', action='store_true', default=False)
+    parser.add_argument('--save_csv', type=str, default=None, help='Save the per-rollout results to this csv file')
+
+    args = parser.parse_args()
+
+    files_by_method = {method: f"{args.emissions_file_path}/{method}" for method in args.methods
+                       if os.path.isdir(f"{args.emissions_file_path}/{method}")}
+
+    params = {'start_time': args.start_time,
+              'end_time': args.end_time,
+              'sim_step': args.sim_step,
+    }
+
+    cache_path = None if args.no_cache else (args.cache or os.path.join(args.emissions_file_path, 'eval_cache.json'))
+    results = run_evaluation(files_by_method, evaluate_file, params, num_workers=args.num_workers, cache_path=cache_path)
+
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(f"Metrics of each rollout:\n{results}\n")
+        print(f"Across rollouts:\n{summarize(results).round(2)}\n")
+
+    if args.save_csv is not None:
+        results.to_csv(args.save_csv)
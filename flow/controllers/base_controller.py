@@ -3,6 +3,8 @@
 from abc import ABCMeta, abstractmethod
 import numpy as np
 
+from flow.controllers.car_following_kernels import get_kernel
+
 
 class BaseController(metaclass=ABCMeta):
     """Base class for flow-controlled acceleration behavior.
@@ -44,6 +46,12 @@ class BaseController(metaclass=ABCMeta):
         variance of the gaussian from which to sample a noisy acceleration
     """
 
+    # name of the vectorized kernel of the controller (see
+    # flow.controllers.car_following_kernels), and the attribute of the
+    # controller holding every parameter of the kernel
+    kernel = None
+    kernel_params = {}
+
     def __init__(self,
                  veh_id,
                  car_following_params,
@@ -75,6 +83,8 @@ class BaseController(metaclass=ABCMeta):
             'feasible_accel': lambda _, accel: self.get_feasible_action(accel),
             'obey_speed_limit': self.get_obey_speed_limit_action
         }
+        # names of the failsafes, used by the batched dispatch
+        self.fail_safe = list(failsafe_list) if failsafe_list else []
         self.failsafes = []
         if failsafe_list:
             for check in failsafe_list:
@@ -96,6 +106,53 @@ class BaseController(metaclass=ABCMeta):
         """Return the acceleration of the controller."""
         pass
 
+    @classmethod
+    def get_accel_batch(cls, controllers, env, batch):
+        """Return the accelerations of a group of vehicles at once.
+
+        Controllers that implement this method (alongside get_accel), or that
+        specify a kernel, are dispatched in batches when the `batch_controllers` attribute of
+        EnvParams is set, see flow.controllers.batched. Noise and failsafes
+        are applied by the dispatcher.
+
+        Parameters
+        ----------
+        controllers : list of BaseController
+            the controllers of the vehicles, all of this class
+        env : flow.envs.Env
+            state of the environment at the current time step
+        batch : flow.controllers.batched.ControllerBatch
+            the ids, speeds, leader speeds and headways of the vehicles
+
+        Returns
+        -------
+        array_like
+            the acceleration of every vehicle, NaN to let sumo control it
+        """
+        if cls.kernel is None:
+            raise NotImplementedError
+
+        params = {name: batch.params(attr)
+                  for name, attr in cls.kernel_params.items()}
+        params["max_accel"] = batch.params("max_accel")
+        params["sim_step"] = batch.sim_step
+        return get_kernel(cls.kernel)(
+            batch.speed, batch.v_lead, batch.headway, params)
+
+    @property
+    def supports_batch(self):
+        """Whether the controller can be dispatched in batches.
+
+        This is the case if get_accel_batch (or a kernel) is implemented by
+        the same class as get_accel, so that subclasses overriding get_accel
+        alone are still dispatched one vehicle at a time.
+        """
+        for klass in type(self).__mro__:
+            if "get_accel" in vars(klass):
+                return "get_accel_batch" in vars(klass) or \
+                    vars(klass).get("kernel") is not None
+        return False
+
     def get_action(self, env):
         """Convert the get_accel() acceleration into an action.
 
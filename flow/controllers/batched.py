@@ -0,0 +1,258 @@
+"""Contains the batched dispatch of acceleration controllers.
+
+Instead of calling `get_action` of every controlled vehicle one at a time,
+vehicles are grouped by controller class and failsafes, and every group
+computes the accelerations of all its vehicles in a single vectorized call
+over arrays of speeds, leader speeds and headways (see
+BaseController.get_accel_batch). Noise and failsafes are applied to the whole
+group at once as well.
+
+Controllers that do not implement get_accel_batch are dispatched one vehicle
+at a time, through get_action.
+"""
+import numpy as np
+
+
+class ControllerBatch(object):
+    """The state of a group of vehicles with the same type of controller.
+
+    Attributes
+    ----------
+    veh_ids : list of str
+        ids of the vehicles
+    controllers : list of flow.controllers.BaseController
+        the acceleration controller of every vehicle
+    speed : numpy.ndarray
+        speed of every vehicle
+    lead_speed : numpy.ndarray
+        speed of the leader of every vehicle (-1001 without a leader)
+    headway : numpy.ndarray
+        headway of every vehicle
+    leaders : list of str
+        id of the leader of every vehicle (None or "" without a leader)
+    has_leader : numpy.ndarray
+        whether every vehicle has a leader
+    v_lead : numpy.ndarray
+        speed of the leader of every vehicle (NaN without a leader), as
+        expected by the kernels in flow.controllers.car_following_kernels
+    sim_step : float
+        simulation step size
+    """
+
+    def __init__(self, env, veh_ids, controllers):
+        """Collect the state of a group of vehicles."""
+        kv = env.k.vehicle
+        self.veh_ids = veh_ids
+        self.controllers = controllers
+        self.speed = np.asarray(kv.get_speed_array(veh_ids), dtype=float)
+        self.lead_speed = np.asarray(
+            kv.get_leader_speed_array(veh_ids), dtype=float)
+        self.headway = np.asarray(kv.get_headway_array(veh_ids), dtype=float)
+        self.leaders = kv.get_leader(veh_ids)
+        self.has_leader = np.array([lead_id is not None and lead_id != ''
+                                    for lead_id in self.leaders], dtype=bool)
+        self.v_lead = np.where(self.has_leader, self.lead_speed, np.nan)
+        self.sim_step = env.sim_step
+
+    def params(self, name):
+        """Return an attribute of all controllers as an array."""
+        return np.array([getattr(c, name) for c in self.controllers],
+                        dtype=float)
+
+
+def _warn(batch, mask, message):
+    """Print a failsafe warning for vehicles, if they display warnings."""
+    for i in np.flatnonzero(mask):
+        if batch.controllers[i].display_warnings:
+            print(
+                "=====================================\n"
+                + message.format(batch.veh_ids[i]) + "\n"
+                "=====================================")
+
+
+def safe_action_instantaneous(env, batch, accel):
+    """Vectorized version of BaseController.get_safe_action_instantaneous."""
+    # if there is only one vehicle in the network, all actions are safe
+    if env.k.vehicle.num_vehicles == 1:
+        return accel
+
+    v, h, dt = batch.speed, batch.headway, batch.sim_step
+    next_vel = v + accel * dt
+    lead_exists = np.array([lead_id is not None for lead_id in batch.leaders],
+                           dtype=bool)
+    crash = lead_exists & (next_vel > 0) & \
+        (h < dt * next_vel + v * 1e-3 + 0.5 * v * dt)
+
+    _warn(batch, crash, "Vehicle {} is about to crash. Instantaneous "
+                        "acceleration clipping applied.")
+    return np.where(crash, -v / dt, accel)
+
+
+def safe_velocity_action(env, batch, accel):
+    """Vectorized version of BaseController.get_safe_velocity_action."""
+    # if there is only one vehicle in the network, all actions are safe
+    if env.k.vehicle.num_vehicles == 1:
+        return accel
+
+    v, dt = batch.speed, batch.sim_step
+    v_safe = 2 * batch.headway / dt + (batch.lead_speed - v) \
+        - v * (2 * batch.params("delay"))
+    _warn(batch, v > v_safe, "Speed of vehicle {} is greater than safe "
+                             "speed. Safe velocity clipping applied.")
+
+    unsafe = v + accel * dt > v_safe
+    return np.where(unsafe,
+                    np.where(v_safe > 0, (v_safe - v) / dt, -v / dt),
+                    accel)
+
+
+def feasible_action(env, batch, accel):
+    """Vectorized version of BaseController.get_feasible_action."""
+    max_accel = batch.params("max_accel")
+    max_deaccel = batch.params("max_deaccel")
+
+    _warn(batch, accel > max_accel,
+          "Acceleration of vehicle {} is greater than the max acceleration. "
+          "Feasible acceleration clipping applied.")
+    accel = np.minimum(accel, max_accel)
+
+    _warn(batch, accel < -max_deaccel,
+          "Deceleration of vehicle {} is greater than the max deceleration. "
+          "Feasible acceleration clipping applied.")
+    return np.maximum(accel, -max_deaccel)
+
+
+def obey_speed_limit_action(env, batch, accel):
+    """Vectorized version of BaseController.get_obey_speed_limit_action."""
+    v, dt = batch.speed, batch.sim_step
+    speed_limit = np.array([
+        env.k.network.speed_limit(edge)
+        for edge in env.k.vehicle.get_edge(batch.veh_ids)], dtype=float)
+
+    above = v + accel * dt > speed_limit
+    _warn(batch, above & (speed_limit > 0),
+          "Speed of vehicle {} is greater than speed limit. Obey speed limit "
+          "clipping applied.")
+    return np.where(above,
+                    np.where(speed_limit > 0, (speed_limit - v) / dt, -v / dt),
+                    accel)
+
+
+# vectorized failsafes, by name (see BaseController)
+BATCH_FAILSAFES = {
+    'instantaneous': safe_action_instantaneous,
+    'safe_velocity': safe_velocity_action,
+    'feasible_accel': feasible_action,
+    'obey_speed_limit': obey_speed_limit_action,
+}
+
+
+def _store_accels(kv, veh_ids, accel, noise, failsafe):
+    """Store the accelerations of a group of vehicles in the kernel."""
+    for veh_id, value in zip(veh_ids, accel):
+        kv.update_accel(veh_id, None if np.isnan(value) else float(value),
+                        noise=noise, failsafe=failsafe)
+
+
+def get_batch_actions(env, batch):
+    """Return the actions of a group of vehicles with the same controller.
+
+    This is the vectorized version of BaseController.get_action.
+
+    Parameters
+    ----------
+    env : flow.envs.Env
+        state of the environment at the current time step
+    batch : ControllerBatch
+        the vehicles, whose controllers are of the same class and use the same
+        failsafes
+
+    Returns
+    -------
+    numpy.ndarray
+        the action of every vehicle, NaN if sumo should control it
+    """
+    kv = env.k.vehicle
+    controller = batch.controllers[0]
+
+    accel = np.asarray(
+        type(controller).get_accel_batch(batch.controllers, env, batch),
+        dtype=float)
+
+    # store the acceleration without noise and run fail safe if requested
+    _store_accels(kv, batch.veh_ids, accel, noise=False, failsafe=False)
+    accel_no_noise_with_failsafe = accel
+    for name in controller.fail_safe:
+        accel_no_noise_with_failsafe = BATCH_FAILSAFES[name](
+            env, batch, accel_no_noise_with_failsafe)
+    _store_accels(kv, batch.veh_ids, accel_no_noise_with_failsafe,
+                  noise=False, failsafe=True)
+
+    # add noise to the accelerations, if requested
+    noise = batch.params("accel_noise")
+    noisy = noise > 0
+    if np.any(noisy):
+        accel = accel.copy()
+        accel[noisy] += np.sqrt(env.sim_step) * np.random.normal(
+            0, noise[noisy])
+    _store_accels(kv, batch.veh_ids, accel, noise=True, failsafe=False)
+
+    # run the fail-safes, if requested
+    for name in controller.fail_safe:
+        accel = BATCH_FAILSAFES[name](env, batch, accel)
+    _store_accels(kv, batch.veh_ids, accel, noise=True, failsafe=True)
+
+    return accel
+
+
+def get_batched_actions(env, veh_ids):
+    """Return the actions of the acceleration controllers of vehicles.
+
+    Vehicles whose controllers support batching (see
+    BaseController.get_accel_batch) are grouped by controller class and
+    failsafes, and the actions of every group are computed in a single
+    vectorized call. The other vehicles are dispatched one at a time.
+
+    Parameters
+    ----------
+    env : flow.envs.Env
+        state of the environment at the current time step
+    veh_ids : list of str
+        ids of the controlled vehicles
+
+    Returns
+    -------
+    list of float or None
+        the action of every vehicle, in order. None if sumo should control
+        the vehicle at the current time step
+    """
+    kv = env.k.vehicle
+    actions = [None] * len(veh_ids)
+
+    groups = {}
+    for i, veh_id in enumerate(veh_ids):
+        controller = kv.get_acc_controller(veh_id)
+        if not controller.supports_batch:
+            actions[i] = controller.get_action(env)
+            continue
+
+        # vehicles that just entered the network, or that are in a junction,
+        # are controlled by sumo (see BaseController.get_action)
+        edge = kv.get_edge(veh_id)
+        if len(edge) == 0 or edge[0] == ":":
+            for noise in (False, True):
+                for failsafe in (False, True):
+                    kv.update_accel(veh_id, None, noise=noise,
+                                    failsafe=failsafe)
+            continue
+
+        key = (type(controller), tuple(controller.fail_safe))
+        groups.setdefault(key, []).append((i, veh_id, controller))
+
+    for members in groups.values():
+        indices, group_ids, controllers = zip(*members)
+        batch = ControllerBatch(env, list(group_ids), list(controllers))
+        for i, value in zip(indices, get_batch_actions(env, batch)):
+            actions[i] = None if np.isnan(value) else float(value)
+
+    return actions
@@ -0,0 +1,252 @@
+"""Contains vectorized kernels of the car-following models.
+
+Every kernel is a pure function ``accel(v, v_lead, headway, params) -> a``
+which computes the accelerations of a whole fleet of vehicles at once, where
+v, v_lead and headway are arrays with one value per vehicle, and params is a
+dict of model parameters, each a scalar or an array with one value per
+vehicle. Vehicles without a leader have a NaN leader speed. Accelerations are
+NaN for vehicles the model does not define an acceleration for.
+
+The kernels match the ``get_accel`` methods of the controllers in
+flow/controllers/car_following_models.py, which use them to compute the
+accelerations of all their vehicles in a single call (see
+BaseController.get_accel_batch). They do not depend on a simulator, and can
+be used directly, e.g. for simulator-free stability sweeps. The Krauss model,
+the default car-following model of sumo, is provided as well for vehicles
+that are not controlled by Flow.
+
+Kernels are registered by name in CAR_FOLLOWING_KERNELS, see register_kernel
+and get_kernel.
+"""
+import numpy as np
+
+# kernels of the car-following models, by name
+CAR_FOLLOWING_KERNELS = {}
+
+
+def register_kernel(name, kernel):
+    """Register the kernel of a car-following model.
+
+    Parameters
+    ----------
+    name : str
+        name of the model, e.g. "idm"
+    kernel : callable
+        function ``kernel(v, v_lead, headway, params) -> a``
+    """
+    CAR_FOLLOWING_KERNELS[name] = kernel
+
+
+def get_kernel(name):
+    """Return the kernel of a car-following model.
+
+    Parameters
+    ----------
+    name : str
+        name of the model, one of CAR_FOLLOWING_KERNELS
+
+    Returns
+    -------
+    callable
+        the kernel
+
+    Raises
+    ------
+    KeyError
+        if no kernel is registered under this name
+    """
+    if name not in CAR_FOLLOWING_KERNELS:
+        raise KeyError("No car-following kernel named {}. Registered kernels "
+                       "are {}.".format(name, list(CAR_FOLLOWING_KERNELS)))
+    return CAR_FOLLOWING_KERNELS[name]
+
+
+def _has_leader(v_lead):
+    """Return whether every vehicle has a leader."""
+    return ~np.isnan(v_lead)
+
+
+def idm_accel(v, v_lead, headway, params):
+    """Intelligent Driver Model, see IDMController.
+
+    params: v0, T, a, b, delta, s0
+    """
+    a, b = params["a"], params["b"]
+
+    # in order to deal with ZeroDivisionError
+    h = np.where(np.abs(headway) < 1e-3, 1e-3, headway)
+
+    # no car ahead: s_star is zero
+    s_star = np.where(
+        _has_leader(v_lead),
+        params["s0"] + np.maximum(
+            0, v * params["T"] + v * (v - v_lead) / (2 * np.sqrt(a * b))),
+        0)
+
+    return a * (1 - (v / params["v0"])**params["delta"] - (s_star / h)**2)
+
+
+def cfm_accel(v, v_lead, headway, params):
+    """CFM model, see CFMController.
+
+    params: k_d, k_v, k_c, d_des, v_des, max_accel
+    """
+    accel = params["k_d"] * (headway - params["d_des"]) + \
+        params["k_v"] * (v_lead - v) + params["k_c"] * (params["v_des"] - v)
+    # no car ahead
+    return np.where(_has_leader(v_lead), accel, params["max_accel"])
+
+
+def bcm_accel(v, v_lead, headway, params):
+    """Bilateral car-following model, see BCMController.
+
+    params: k_d, k_v, k_c, v_des, max_accel, as well as the speed of the
+    follower "v_trail" and its headway "footway"
+    """
+    accel = params["k_d"] * (headway - params["footway"]) + \
+        params["k_v"] * ((v_lead - v) - (v - params["v_trail"])) + \
+        params["k_c"] * (params["v_des"] - v)
+    # no car ahead
+    return np.where(_has_leader(v_lead), accel, params["max_accel"])
+
+
+def lac_accel(v, v_lead, headway, params):
+    """Linear adaptive cruise control, see LACController.
+
+    The model is stateful: the returned acceleration is the new value of the
+    parameter "a" of every vehicle.
+
+    params: k_1, k_2, h, tau, a, sim_step
+    """
+    # Bibek, after discussing with Mr. Chou, decided to use this
+    L = 0
+
+    ex = headway - L - params["h"] * v
+    ev = v_lead - v
+
+    u = params["k_1"] * ex + params["k_2"] * ev
+    a_dot = -(params["a"] / params["tau"]) + (u / params["tau"])
+
+    return a_dot * params["sim_step"] + params["a"]
+
+
+def ovm_accel(v, v_lead, headway, params):
+    """Optimal Vehicle Model, see OVMController.
+
+    params: alpha, beta, h_st, h_go, v_max, max_accel
+    """
+    h_st, h_go, v_max = params["h_st"], params["h_go"], params["v_max"]
+
+    # V function here - input: h, output : Vh
+    v_h = np.where(
+        headway <= h_st, 0,
+        np.where(headway < h_go,
+                 v_max / 2 * (1 - np.cos(np.pi * (headway - h_st) /
+                                         (h_go - h_st))),
+                 v_max))
+
+    accel = params["alpha"] * (v_h - v) + params["beta"] * (v_lead - v)
+    # no car ahead
+    return np.where(_has_leader(v_lead), accel, params["max_accel"])
+
+
+def linear_ovm_accel(v, v_lead, headway, params):
+    """Linear OVM, see LinearOVM.
+
+    params: v_max, adaptation, h_st
+    """
+    h_st, v_max = params["h_st"], params["v_max"]
+
+    # V function here - input: h, output : Vh
+    alpha = 1.689  # the average value from Nakayama paper
+    v_h = np.where(
+        headway < h_st, 0,
+        np.where(headway <= h_st + v_max / alpha,
+                 alpha * (headway - h_st),
+                 v_max))
+
+    return (v_h - v) / params["adaptation"]
+
+
+def gipps_accel(v, v_lead, headway, params):
+    """Gipps' model, see GippsController.
+
+    params: v0, acc, b, b_l, s0, tau, sim_step
+    """
+    v0, b, tau = params["v0"], params["b"], params["tau"]
+
+    # get velocity dynamics
+    v_acc = v + (2.5 * params["acc"] * tau * (1 - (v / v0)) *
+                 np.sqrt(0.025 + (v / v0)))
+    v_safe = (tau * b) + np.sqrt(((tau**2) * (b**2)) - (
+        b * ((2 * (headway - params["s0"])) - (tau * v) -
+             ((v_lead**2) / params["b_l"]))))
+    # no car ahead: no safe speed
+    v_safe = np.where(_has_leader(v_lead), v_safe, np.inf)
+
+    # fmin ignores the NaN safe speed of a negative discriminant, like the
+    # builtin min of GippsController.get_accel
+    v_next = np.fmin(np.fmin(v_acc, v_safe), v0)
+
+    return (v_next - v) / params["sim_step"]
+
+
+def bando_ftl_accel(v, v_lead, headway, params):
+    """Bando follow-the-leader model, see BandoFTLController.
+
+    params: alpha, beta, h_st, v_max, want_max_accel, max_accel
+    """
+    v_h = params["v_max"] * ((np.tanh(headway / params["h_st"] - 2) +
+                              np.tanh(2)) / (1 + np.tanh(2)))
+    s_dot = v_lead - v
+    accel = params["alpha"] * (v_h - v) + params["beta"] * s_dot / (headway**2)
+
+    # no car ahead
+    want_max_accel = np.asarray(params["want_max_accel"], dtype=bool)
+    return np.where(~_has_leader(v_lead) & want_max_accel,
+                    params["max_accel"], accel)
+
+
+def krauss_safe_speed(v_lead, headway, params):
+    """Return the safe speed of the Krauss model.
+
+    This is the highest speed from which a vehicle can still stop behind its
+    leader, were the leader to brake as hard as possible. Vehicles without a
+    leader have an infinite safe speed.
+
+    params: b, tau, s0
+    """
+    b, tau = params["b"], params["tau"]
+    gap = np.maximum(headway - params["s0"], 0)
+    v_safe = -tau * b + np.sqrt(
+        (tau * b)**2 + np.nan_to_num(v_lead)**2 + 2 * b * gap)
+    return np.where(_has_leader(v_lead), v_safe, np.inf)
+
+
+def krauss_accel(v, v_lead, headway, params):
+    """Krauss model, the default car-following model of sumo.
+
+    The speed of every vehicle is reduced by a random amount (dawdling),
+    proportional to sigma and to the uniformly distributed "rand" parameter.
+
+    params: accel, b, tau, s0, sigma, v_max, sim_step, as well as the random
+    numbers "rand" in [0, 1)
+    """
+    dt = params["sim_step"]
+    v_next = np.minimum(np.minimum(v + params["accel"] * dt,
+                                   krauss_safe_speed(v_lead, headway, params)),
+                        params["v_max"])
+    v_next = np.maximum(
+        0, v_next - params["sigma"] * params["accel"] * dt * params["rand"])
+    return (v_next - v) / dt
+
+
+register_kernel("idm", idm_accel)
+register_kernel("cfm", cfm_accel)
+register_kernel("bcm", bcm_accel)
+register_kernel("lac", lac_accel)
+register_kernel("ovm", ovm_accel)
+register_kernel("linear_ovm", linear_ovm_accel)
+register_kernel("gipps", gipps_accel)
+register_kernel("bando_ftl", bando_ftl_accel)
+register_kernel("krauss", krauss_accel)
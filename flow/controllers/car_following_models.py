@@ -7,11 +7,17 @@ in Flow to match various prominent car-following models that can be calibrated.
 Each controller includes the function ``get_accel(self, env) -> acc`` which,
 using the current state of the world and existing parameters, uses the control
 model to return a vehicle acceleration.
+
+The same models are available as vectorized kernels, which compute the
+accelerations of many vehicles at once (see car_following_kernels.py). Each
+controller names its kernel and the attributes holding the parameters of the
+kernel, which are used when controllers are dispatched in batches.
 """
 import math
 import numpy as np
 
 from flow.controllers.base_controller import BaseController
+from flow.controllers.car_following_kernels import get_kernel
 
 
 class CFMController(BaseController):
@@ -46,6 +52,10 @@ class CFMController(BaseController):
         to no failsafe (None)
     """
 
+    kernel = "cfm"
+    kernel_params = {"k_d": "k_d", "k_v": "k_v", "k_c": "k_c", "d_des": "d_des",
+                     "v_des": "v_des"}
+
     def __init__(self,
                  veh_id,
                  car_following_params,
@@ -125,6 +135,9 @@ class BCMController(BaseController):
         to no failsafe (None)
     """
 
+    kernel = "bcm"
+    kernel_params = {"k_d": "k_d", "k_v": "k_v", "k_c": "k_c", "v_des": "v_des"}
+
     def __init__(self,
                  veh_id,
                  car_following_params,
@@ -182,6 +195,23 @@ class BCMController(BaseController):
             self.k_v * ((lead_vel - this_vel) - (this_vel - trail_vel)) + \
             self.k_c * (self.v_des - this_vel)
 
+    @classmethod
+    def get_accel_batch(cls, controllers, env, batch):
+        """See parent class.
+
+        The speeds and headways of the followers are collected as well.
+        """
+        trail_ids = env.k.vehicle.get_follower(batch.veh_ids)
+        params = {name: batch.params(attr)
+                  for name, attr in cls.kernel_params.items()}
+        params["max_accel"] = batch.params("max_accel")
+        params["v_trail"] = np.array(
+            env.k.vehicle.get_speed(trail_ids), dtype=float)
+        params["footway"] = np.array(
+            env.k.vehicle.get_headway(trail_ids), dtype=float)
+        return get_kernel(cls.kernel)(
+            batch.speed, batch.v_lead, batch.headway, params)
+
 
 class LACController(BaseController):
     """Linear Adaptive Cruise Control.
@@ -209,6 +239,9 @@ class LACController(BaseController):
         to no failsafe (None)
     """
 
+    kernel = "lac"
+    kernel_params = {"k_1": "k_1", "k_2": "k_2", "h": "h", "tau": "tau", "a": "a"}
+
     def __init__(self,
                  veh_id,
                  car_following_params,
@@ -260,6 +293,23 @@ class LACController(BaseController):
 
         return self.a
 
+    @classmethod
+    def get_accel_batch(cls, controllers, env, batch):
+        """See parent class.
+
+        The new acceleration of every vehicle is stored in its controller.
+        Like in get_accel, the leader speed of vehicles without a leader is
+        -1001 (see ControllerBatch.lead_speed), so that "a" never turns NaN.
+        """
+        params = {name: batch.params(attr)
+                  for name, attr in cls.kernel_params.items()}
+        params["sim_step"] = batch.sim_step
+        accel = get_kernel(cls.kernel)(
+            batch.speed, batch.lead_speed, batch.headway, params)
+        for controller, a in zip(controllers, accel):
+            controller.a = a
+        return accel
+
 
 class OVMController(BaseController):
     """Optimal Vehicle Model controller.
@@ -295,6 +345,10 @@ class OVMController(BaseController):
         to no failsafe (None)
     """
 
+    kernel = "ovm"
+    kernel_params = {"alpha": "alpha", "beta": "beta", "h_st": "h_st",
+                     "h_go": "h_go", "v_max": "v_max"}
+
     def __init__(self,
                  veh_id,
                  car_following_params,
@@ -375,6 +429,9 @@ class LinearOVM(BaseController):
         to no failsafe (None)
     """
 
+    kernel = "linear_ovm"
+    kernel_params = {"v_max": "v_max", "adaptation": "adaptation", "h_st": "h_st"}
+
     def __init__(self,
                  veh_id,
                  car_following_params,
@@ -456,6 +513,10 @@ class IDMController(BaseController):
         to no failsafe (None)
     """
 
+    kernel = "idm"
+    kernel_params = {"v0": "v0", "T": "T", "a": "a", "b": "b", "delta": "delta",
+                     "s0": "s0"}
+
     def __init__(self,
                  veh_id,
                  v0=30,
@@ -560,6 +621,10 @@ class GippsController(BaseController):
         to no failsafe (None)
     """
 
+    kernel = "gipps"
+    kernel_params = {"v0": "v_desired", "acc": "acc", "b": "b", "b_l": "b_l",
+                     "s0": "s0", "tau": "tau"}
+
     def __init__(self,
                  veh_id,
                  car_following_params=None,
@@ -643,6 +708,10 @@ class BandoFTLController(BaseController):
         to no failsafe (None)
     """
 
+    kernel = "bando_ftl"
+    kernel_params = {"alpha": "alpha", "beta": "beta", "h_st": "h_st",
+                     "v_max": "v_max", "want_max_accel": "want_max_accel"}
+
     def __init__(self,
                  veh_id,
                  car_following_params,
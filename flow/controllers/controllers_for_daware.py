@@ -9,10 +9,15 @@ This Modified IDM Controller contains:
 import math 
 import numpy as np
 from flow.controllers.base_controller import BaseController
+from flow.controllers.car_following_models import IDMController
+from flow.utils.policy_registry import get_policy
 
 import torch
 import torch.nn as nn
 
+# CSC models loaded in this process, by url. Shared by all controllers
+_CSC_MODELS = {}
+
 class ModifiedIDMController(BaseController):
     def __init__(self,
                  veh_id,
@@ -61,6 +66,15 @@ class ModifiedIDMController(BaseController):
         else: 
             return self.get_idm_accel(env)
 
+    @classmethod
+    def get_accel_batch(cls, controllers, env, batch):
+        """
+        IDM accelerations of all vehicles at once, replaced by the shock acceleration for vehicles being shocked
+        """
+        idm_accel = IDMController.get_accel_batch(controllers, env, batch)
+        shock = np.array([c.shock_vehicle and c.shock_time for c in controllers], dtype=bool)
+        return np.where(shock, batch.params("shock_acceleration"), idm_accel)
+
     def set_shock_accel(self, accel):
         self.shock_acceleration = accel
         #print(f"\nFrom the controller: {self.veh_id, self.shock_acceleration}\n")
@@ -144,8 +158,11 @@ class TrainedAgentController(BaseController):
         self.num_cpus = num_cpus
         
         self.csc_model = self.load_csc_model()
-        # get the leader agent ready 
+        # get the leader agent ready, shared with all other vehicles that use the same policy
         self.leader_agent = self.setup_trained_leader()
+        # CSC output and vehicles in the local zone at the last step, set by get_trained_observations
+        self.csc_output = None
+        self.sorted_veh_ids = []
 
         # Efficiency specific
         self.efficiency = efficiency
@@ -153,50 +170,26 @@ class TrainedAgentController(BaseController):
 
     def setup_trained_leader(self, ):
         """
-        
+        The trained policy is loaded once per process and shared by all vehicles that use it
+        See flow/utils/policy_registry.py
         """
-        import ray
-        try:
-            from ray.rllib.agents.agent import get_agent_class
-        except ImportError:
-            from ray.rllib.agents.registry import get_agent_class
-        from flow.utils.registry import make_create_env
-        from flow.utils.rllib import get_flow_params, get_rllib_config
-        from ray.tune.registry import register_env
-
-        result_dir_name = self.directory + self.policy_name
-        ray.init(num_cpus=self.num_cpus, ignore_reinit_error=True)
-
-        result_dir = result_dir_name if result_dir_name[-1] != '/' else result_dir_name[:-1]
-        checkpoint = result_dir + '/checkpoint_' + self.checkpoint_num
-        checkpoint = checkpoint + '/checkpoint-' + self.checkpoint_num
-
-        config = get_rllib_config(result_dir)
-        config['num_workers'] = 0
-
-        flow_params = get_flow_params(config)
-        sim_params = flow_params['sim']
-        setattr(sim_params, 'num_clients', 1)
-
-        config_run = config['env_config']['run'] if 'run' in config['env_config'] else None
-        agent_cls = get_agent_class(config_run)
-
-        create_env, env_name = make_create_env(params=flow_params, version=0)
-        register_env(env_name, create_env)
-
-        agent = agent_cls(env=env_name, config=config)
-        agent.restore(checkpoint)
-        print(f"\n\nLeader agent restored\n{agent.get_policy()}")
-        return agent
+        return get_policy(self.directory, self.policy_name, self.checkpoint_num, self.num_cpus)
     
     def get_csc_output(self, current_obs):
         """
         Get the output of Traffic State Estimator Neural Network
         """
-        current_obs = torch.from_numpy(current_obs).flatten()
+        return self.get_csc_outputs(np.asarray(current_obs, dtype=np.float32)[None])[0:1]
+
+    def get_csc_outputs(self, current_obs):
+        """
+        Get the output of Traffic State Estimator Neural Network for many vehicles at once
+        current_obs: (num_vehicles x 10 x 2) float32 array, returns one label per vehicle
+        """
+        current_obs = torch.from_numpy(current_obs).reshape(len(current_obs), -1)
 
         with torch.no_grad():
-            outputs = self.csc_model(current_obs.unsqueeze(0))
+            outputs = self.csc_model(current_obs)
 
         _, predicted_label = torch.max(outputs, 1)
         predicted_label = predicted_label.numpy()
@@ -226,12 +219,16 @@ class TrainedAgentController(BaseController):
         input_size = 10*2
         num_classes = 6
         url = "https://huggingface.co/matrix-multiply/Congestion_Stage_Classifier/resolve/main/ring_best_csc_model.pt"
+        # Loaded once per process
+        if url in _CSC_MODELS:
+            return _CSC_MODELS[url]
         saved_best_net = csc_Net(input_size, num_classes)
 
         state_dict = torch.hub.load_state_dict_from_url(url)
         saved_best_net.load_state_dict(state_dict)
         saved_best_net.eval()
 
+        _CSC_MODELS[url] = saved_best_net
         return saved_best_net
     
     def get_idm_accel(self, env):
@@ -258,13 +255,11 @@ class TrainedAgentController(BaseController):
         #print("IDM")
         return self.a * (1 - (v / self.v0)**self.delta - (s_star / h)**2)
     
-    def get_trained_accel(self, env):
+    def get_csc_input(self, env):
         """
-        env: determines what functions below work how, for example, length() is valid for ring.
-        Use the environment to get all the necessary things
+        Observation for CSC input: relative positions and velocities of the vehicles in the local zone
+        Returns the (10 x 2) observation and the sorted vehicle ids
         """
-        
-        # Get the observation for CSC input
         rl_pos = env.k.vehicle.get_x_by_id(self.veh_id)
         current_length = env.k.network.length() # WORKS FOR RING
 
@@ -282,11 +277,13 @@ class TrainedAgentController(BaseController):
            observation_csc[i] = [norm_pos, norm_vel]
 
         observation_csc = np.array(observation_csc, dtype = np.float32)
+        return observation_csc, sorted_veh_ids
 
-        # Pass it and get CSC output
-        csc_output = self.get_csc_output(observation_csc)
-        csc_output_encoded = np.zeros(6) 
-        csc_output_encoded[csc_output] = 1 
+    def get_regular_observation(self, env):
+        """
+        Speed, relative speed and distance to the leader
+        """
+        current_length = env.k.network.length() # WORKS FOR RING
 
         # Leader of the current agent 
         lead_id = env.k.vehicle.get_leader(self.veh_id)
@@ -302,11 +299,45 @@ class TrainedAgentController(BaseController):
                             env.k.vehicle.get_x_by_id(self.veh_id)) % current_length
                             / max_length
                             ])
-        
-        full_observation = np.append(observation_regular, csc_output_encoded)
+        return observation_regular
+
+    def get_trained_observations(self, env):
+        """
+        Observations of all vehicles that share the policy of this vehicle (and are past their warmup), by vehicle id
+        The CSC outputs of all of them are computed in a single forward pass
+        Each controller keeps its CSC output and sorted vehicle ids for the efficiency estimate
+        """
+        controllers = [self]
+        for veh_id in env.k.vehicle.get_ids():
+            controller = env.k.vehicle.get_acc_controller(veh_id)
+            if controller is not self and isinstance(controller, TrainedAgentController) \
+                    and controller.leader_agent is self.leader_agent and env.step_counter >= controller.WARMUP_STEPS:
+                controllers.append(controller)
+
+        csc_inputs = [controller.get_csc_input(env) for controller in controllers]
+        csc_outputs = self.get_csc_outputs(np.stack([observation_csc for observation_csc, _ in csc_inputs]))
 
+        observations = {}
+        for i, controller in enumerate(controllers):
+            controller.csc_output = csc_outputs[i:i + 1]
+            controller.sorted_veh_ids = csc_inputs[i][1]
+
+            csc_output_encoded = np.zeros(6) 
+            csc_output_encoded[controller.csc_output] = 1 
+
+            observations[controller.veh_id] = np.append(controller.get_regular_observation(env), csc_output_encoded)
+        return observations
+
+    def get_trained_accel(self, env):
+        """
+        env: determines what functions below work how, for example, length() is valid for ring.
+        Use the environment to get all the necessary things
+        The actions of all vehicles that share the policy are computed in a single batch per step (of this env, policies are shared by all envs of a process)
+        """
         # Finally compute the action
-        acceleration = self.leader_agent.compute_action(full_observation)
+        acceleration = self.leader_agent.compute_batch((id(env), env.step_counter), lambda: self.get_trained_observations(env), self.veh_id)
+        csc_output = self.csc_output
+        sorted_veh_ids = self.sorted_veh_ids
         #print(f"Acceleration: {acceleration}, Efficiency: {self.efficiency} \n")
 
         # Efficiency specific (Only present at test time)
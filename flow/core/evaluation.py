@@ -0,0 +1,196 @@
+"""Contains a parallel, cached runner for evaluating emission files.
+
+Every rollout of every method is evaluated independently, so emission files
+are distributed over a pool of worker processes, each of which computes all
+the metrics of one file at a time. Results are stored in a cache file, keyed
+by the path, modification time and content hash of each emission file, as
+well as the evaluation parameters, so that unchanged files are not evaluated
+again in later runs.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from flow.core.kernel.simulation.emission import find_emission_files
+
+
+def file_signature(path):
+    """Return the size and modification time of an emission file.
+
+    For emission directories (the "columnar" format), the total size and
+    latest modification time of the files they contain are returned.
+    """
+    if os.path.isdir(path):
+        stats = [os.stat(os.path.join(path, item))
+                 for item in sorted(os.listdir(path))]
+        return (sum(st.st_size for st in stats),
+                max([st.st_mtime_ns for st in stats] or [0]))
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def file_hash(path, block_size=1 << 20):
+    """Return the sha1 hash of the contents of an emission file or directory."""
+    sha = hashlib.sha1()
+    paths = [os.path.join(path, item) for item in sorted(os.listdir(path))] \
+        if os.path.isdir(path) else [path]
+    for item in paths:
+        with open(item, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+class EvaluationCache(object):
+    """Cache of evaluation results, stored as a json file.
+
+    An entry is reused if the size and modification time of the file are
+    unchanged. If they did change, the entry is still reused if the contents
+    of the file have the same hash, e.g. after a file was copied.
+    """
+
+    def __init__(self, path):
+        """Load the cache from path, if it exists."""
+        self.path = path
+        self.entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(file, params):
+        """Return the key of a file evaluated with a set of parameters."""
+        params = json.dumps(params, sort_keys=True, default=str)
+        return "{}|{}".format(os.path.abspath(file),
+                              hashlib.sha1(params.encode()).hexdigest())
+
+    def get(self, file, params):
+        """Return the cached results of a file, or None."""
+        entry = self.entries.get(self.key(file, params))
+        if entry is None:
+            return None
+        size, mtime = file_signature(file)
+        if entry["size"] == size and entry["mtime"] == mtime:
+            return entry["results"]
+        if entry["size"] == size and entry["hash"] == file_hash(file):
+            entry["mtime"] = mtime
+            return entry["results"]
+        return None
+
+    def set(self, file, params, results):
+        """Store the results of a file."""
+        size, mtime = file_signature(file)
+        self.entries[self.key(file, params)] = {
+            "size": size, "mtime": mtime, "hash": file_hash(file),
+            "results": results}
+
+    def save(self):
+        """Write the cache to disk."""
+        if self.path is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def _evaluate(evaluate_fn, file, params):
+    """Evaluate a single file (run in a worker process)."""
+    results = evaluate_fn(file, **params)
+    # make the results json serializable
+    return {key: float(value) for key, value in results.items()}
+
+
+def run_evaluation(files_by_method,
+                   evaluate_fn,
+                   params=None,
+                   num_workers=None,
+                   cache_path=None):
+    """Evaluate the emission files of several methods in parallel.
+
+    Parameters
+    ----------
+    files_by_method : dict <str, list of str or str>
+        emission files of each method, or a directory containing them
+    evaluate_fn : callable
+        function called as ``evaluate_fn(file, method=method, **params)``,
+        which returns a dict of metrics for a single emission file. Must be
+        defined at the module level so that it can be sent to the workers.
+    params : dict, optional
+        additional parameters passed to evaluate_fn
+    num_workers : int, optional
+        number of worker processes. Defaults to the number of cpus. If 1, the
+        files are evaluated in the current process.
+    cache_path : str, optional
+        path to the json file used to cache the results. No cache is used if
+        not specified.
+
+    Returns
+    -------
+    pandas.DataFrame
+        the metrics of every file, indexed by method and file
+    """
+    import pandas as pd
+
+    params = params or {}
+    cache = EvaluationCache(cache_path)
+
+    jobs = []
+    for method, files in files_by_method.items():
+        if isinstance(files, str):
+            files = find_emission_files(files)
+        for file in files:
+            jobs.append((method, file, dict(params, method=method)))
+
+    results = {}
+    pending = []
+    for method, file, job_params in jobs:
+        cached = cache.get(file, job_params)
+        if cached is not None:
+            results[(method, file)] = cached
+        else:
+            pending.append((method, file, job_params))
+
+    if num_workers == 1:
+        for method, file, job_params in pending:
+            results[(method, file)] = _evaluate(evaluate_fn, file, job_params)
+    elif len(pending) > 0:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {
+                (method, file): executor.submit(
+                    _evaluate, evaluate_fn, file, job_params)
+                for method, file, job_params in pending}
+            for key, future in futures.items():
+                results[key] = future.result()
+
+    for method, file, job_params in pending:
+        cache.set(file, job_params, results[(method, file)])
+    cache.save()
+
+    index = [(method, file) for method, file, _ in jobs]
+    return pd.DataFrame(
+        [results[key] for key in index],
+        index=pd.MultiIndex.from_tuples(index, names=["method", "file"]))
+
+
+def summarize(results):
+    """Return the mean and standard deviation of every metric per method.
+
+    Parameters
+    ----------
+    results : pandas.DataFrame
+        the output of run_evaluation
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per method, with (metric, "mean") and (metric, "std")
+        columns. The standard deviation is the population one, matching
+        np.std in the evaluation scripts.
+    """
+    import pandas as pd
+
+    grouped = results.groupby(level="method", sort=False)
+    return pd.concat({"mean": grouped.mean(), "std": grouped.std(ddof=0)},
+                     axis=1).swaplevel(axis=1).sort_index(axis=1)
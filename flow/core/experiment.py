@@ -1,5 +1,6 @@
 """Contains an experiment class for running simulations."""
 from flow.utils.registry import make_create_env
+from flow.core.shock_scheduler import shock_log_path
 from datetime import datetime
 import logging
 import time
@@ -170,8 +171,13 @@ class Experiment:
 
             # Save emission data at the end of every rollout. This is skipped
             # by the internal method if no emission path was specified.
-            if self.env.simulator == "traci":
-                self.env.k.simulation.save_emission(run_id=i)
+            if self.env.simulator in ("traci", "numpy"):
+                emission_file = self.env.k.simulation.save_emission(run_id=i)
+
+                # Save the log of the shocks applied next to it, if any.
+                shock_scheduler = getattr(self.env, "shock_scheduler", None)
+                if emission_file is not None and shock_scheduler is not None:
+                    shock_scheduler.save_log(shock_log_path(emission_file))
 
         # Print the averages/std for all variables in the info_dict.
         for key in info_dict.keys():
@@ -1,8 +1,10 @@
 """Script containing the Flow kernel object for interacting with simulators."""
 
 import warnings
-from flow.core.kernel.simulation import TraCISimulation, AimsunKernelSimulation
-from flow.core.kernel.network import TraCIKernelNetwork, AimsunKernelNetwork
+from flow.core.kernel.simulation import TraCISimulation, \
+    AimsunKernelSimulation, NumpyRingSimulation
+from flow.core.kernel.network import TraCIKernelNetwork, \
+    AimsunKernelNetwork, NumpyRingNetwork
 from flow.core.kernel.vehicle import TraCIVehicle, AimsunKernelVehicle
 from flow.core.kernel.traffic_light import TraCITrafficLight, \
     AimsunKernelTrafficLight
@@ -43,6 +45,11 @@ class Kernel(object):
 
     These subclasses can be modified and recycled to support various different
     traffic simulators, e.g. SUMO, AIMSUN, TruckSim, etc...
+
+    Single-lane rings can also be simulated without sumo, with the "numpy"
+    simulator (see flow/core/kernel/simulation/numpy_ring.py). Its simulation
+    kernel provides an in-process implementation of the TraCI API, so that
+    the TraCI vehicle and traffic light kernels are used with it as well.
     """
 
     def __init__(self, simulator, sim_params):
@@ -51,7 +58,7 @@ class Kernel(object):
         Parameters
         ----------
         simulator : str
-            simulator type, must be one of {"traci"}
+            simulator type, must be one of {"traci", "aimsun", "numpy"}
         sim_params : flow.core.params.SimParams
             simulation-specific parameters
 
@@ -72,6 +79,11 @@ class Kernel(object):
             self.network = AimsunKernelNetwork(self, sim_params)
             self.vehicle = AimsunKernelVehicle(self, sim_params)
             self.traffic_light = AimsunKernelTrafficLight(self)
+        elif simulator == 'numpy':
+            self.simulation = NumpyRingSimulation(self)
+            self.network = NumpyRingNetwork(self, sim_params)
+            self.vehicle = TraCIVehicle(self, sim_params)
+            self.traffic_light = TraCITrafficLight(self)
         else:
             raise FatalFlowError('Simulator type "{}" is not valid.'.
                                  format(simulator))
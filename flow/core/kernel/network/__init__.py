@@ -3,5 +3,7 @@
 from flow.core.kernel.network.base import BaseKernelNetwork
 from flow.core.kernel.network.traci import TraCIKernelNetwork
 from flow.core.kernel.network.aimsun import AimsunKernelNetwork
+from flow.core.kernel.network.numpy_ring import NumpyRingNetwork
 
-__all__ = ["BaseKernelNetwork", "TraCIKernelNetwork", "AimsunKernelNetwork"]
+__all__ = ["BaseKernelNetwork", "TraCIKernelNetwork", "AimsunKernelNetwork",
+           "NumpyRingNetwork"]
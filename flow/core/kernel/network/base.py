@@ -187,6 +187,26 @@ class BaseKernelNetwork(object):
         """
         raise NotImplementedError
 
+    def get_x_array(self, edges, positions):
+        """Return the absolute positions of a set of vehicles.
+
+        Parameters
+        ----------
+        edges : list of str
+            name of the edge of every vehicle
+        positions : array_like
+            relative position of every vehicle on its edge
+
+        Returns
+        -------
+        numpy.ndarray
+            position of every vehicle with respect to some global reference
+            (see get_x)
+        """
+        return np.array([self.get_x(edge, pos)
+                         for edge, pos in zip(edges, positions)],
+                        dtype=np.float64)
+
     def next_edge(self, edge, lane):
         """Return the next edge/lane pair from the given edge/lane.
 
@@ -0,0 +1,153 @@
+"""Script containing the index of the edge starts of a network.
+
+The absolute position of a vehicle is the start of its edge plus its position
+on the edge, and the edge at an absolute position is the last edge starting
+before it. The index compiles the edge starts of a network once, so that:
+
+* the edge at a position is found with a binary search over the sorted edge
+  starts (see EdgeStartIndex.get_edge),
+* the start of every edge is resolved once, including internal edges that are
+  only generalized for by the start of their junction (see
+  EdgeStartIndex.resolve), and
+* the absolute positions of many vehicles are computed with a single
+  vectorized operation over integer edge codes (see
+  EdgeStartIndex.get_x_array).
+"""
+from bisect import bisect_right
+
+import numpy as np
+
+# absolute position of vehicles without an edge, or on unknown internal edges
+MISSING = -1001
+
+
+class EdgeStartIndex(object):
+    """Compiled edge starts of a network.
+
+    Attributes
+    ----------
+    codes : dict
+        Key = id of every resolved edge
+        Element = integer code of the edge in offsets and scales
+    offsets : numpy.ndarray
+        start of every resolved edge, by code
+    scales : numpy.ndarray
+        1 for edges the position of vehicles is added to the start of, 0 for
+        edges whose vehicles are all given the start (e.g. missing edges)
+    """
+
+    def __init__(self, total_edgestarts, internal_edgestarts_dict, edges=()):
+        """Compile the edge starts of a network.
+
+        Parameters
+        ----------
+        total_edgestarts : list of (str, float)
+            the start of every edge and internal edge, sorted by start
+        internal_edgestarts_dict : dict
+            the start of every internal edge
+        edges : iterable of str, optional
+            ids of other edges and junctions of the network, resolved in
+            advance
+        """
+        self._edges = [edge for edge, _ in total_edgestarts]
+        self._starts = [start for _, start in total_edgestarts]
+        self._edgestarts_dict = dict(total_edgestarts)
+        self._internal_edgestarts_dict = internal_edgestarts_dict
+
+        self.codes = {}
+        self._offsets = []
+        self._scales = []
+        self._add("", MISSING, 0)
+        for edge in list(self._edges) + list(edges):
+            self.resolve(edge)
+        self._compile()
+
+    def _add(self, edge, offset, scale):
+        """Assign a code to an edge."""
+        self.codes[edge] = len(self._offsets)
+        self._offsets.append(offset)
+        self._scales.append(scale)
+
+    def _compile(self):
+        """Compile the starts of the resolved edges into arrays."""
+        self.offsets = np.array(self._offsets, dtype=np.float64)
+        self.scales = np.array(self._scales, dtype=np.float64)
+
+    def resolve(self, edge):
+        """Return the code of an edge, resolving its start if needed.
+
+        Raises
+        ------
+        KeyError
+            if the edge is neither an internal edge nor an edge of the network
+        """
+        code = self.codes.get(edge)
+        if code is not None:
+            return code
+
+        if edge[0] == ':':
+            if edge in self._internal_edgestarts_dict:
+                self._add(edge, self._internal_edgestarts_dict[edge], 1)
+            else:
+                # in case several internal links are being generalized for
+                # by a single element (for backwards compatibility)
+                edge_name = edge.rsplit('_', 1)[0]
+                self._add(edge, self._edgestarts_dict.get(edge_name, MISSING),
+                          0)
+        else:
+            self._add(edge, self._edgestarts_dict[edge], 1)
+
+        # recompiled lazily, see get_x_array
+        self.offsets = None
+        return self.codes[edge]
+
+    def get_edge(self, x):
+        """Return the edge at an absolute position, and the position on it.
+
+        Returns None if the position is before the start of the network.
+        """
+        index = bisect_right(self._starts, x) - 1
+        if index < 0:
+            return None
+        return self._edges[index], x - self._starts[index]
+
+    def get_x(self, edge, position):
+        """Return the absolute position of a vehicle.
+
+        Raises
+        ------
+        KeyError
+            if the edge is neither an internal edge nor an edge of the network
+        """
+        code = self.codes[edge] if edge in self.codes else self.resolve(edge)
+        return self._offsets[code] + self._scales[code] * position
+
+    def get_x_array(self, edges, positions):
+        """Return the absolute positions of a set of vehicles.
+
+        Parameters
+        ----------
+        edges : list of str
+            edge of every vehicle. Vehicles without an edge are given -1001
+        positions : array_like
+            position of every vehicle on its edge
+
+        Returns
+        -------
+        numpy.ndarray
+            the absolute positions
+
+        Raises
+        ------
+        KeyError
+            if an edge is neither an internal edge nor an edge of the network
+        """
+        codes = self.codes
+        resolve = self.resolve
+        indices = np.fromiter(
+            (codes[edge] if edge in codes else resolve(edge)
+             for edge in edges), dtype=np.int64, count=len(edges))
+        if self.offsets is None:
+            self._compile()
+        return self.offsets[indices] + \
+            self.scales[indices] * np.asarray(positions, dtype=np.float64)
@@ -0,0 +1,231 @@
+"""Script containing the NumPy ring network kernel class."""
+import math
+
+from flow.core.kernel.network import BaseKernelNetwork
+from flow.core.kernel.network.edge_index import EdgeStartIndex
+from flow.utils.exceptions import FatalFlowError
+
+
+class NumpyRingNetwork(BaseKernelNetwork):
+    """Network kernel for single-lane rings simulated with NumPy.
+
+    No network files are generated: the edges of the network are read from
+    the network object, and must form a single loop of single-lane edges.
+    Unlike in sumo, edges are not connected by junctions, so every edge starts
+    where the previous one ends and the length of the ring is the sum of the
+    lengths of its edges.
+
+    See flow.core.kernel.simulation.numpy_ring.
+    """
+
+    def generate_network(self, network):
+        """See parent class.
+
+        Raises
+        ------
+        flow.utils.exceptions.FatalFlowError
+            if the edges of the network do not form a single-lane ring
+        """
+        self.network = network
+        self.orig_name = network.orig_name
+        self.name = network.name
+
+        if network.edges is None:
+            raise FatalFlowError(
+                'The "numpy" simulator requires a network specified by its '
+                'nodes and edges.')
+
+        types = {typ['id']: typ for typ in network.types or []}
+        nodes = {node['id']: node for node in network.nodes or []}
+        self._edges = {}
+        for edge in network.edges:
+            typ = types.get(edge.get('type'), {})
+            if 'length' in edge:
+                length = float(edge['length'])
+            else:
+                start, end = nodes[edge['from']], nodes[edge['to']]
+                length = math.hypot(float(end['x']) - float(start['x']),
+                                    float(end['y']) - float(start['y']))
+            self._edges[edge['id']] = {
+                'length': length,
+                'lanes': int(edge.get('numLanes', typ.get('numLanes', 1))),
+                'speed': float(edge.get('speed', typ.get('speed', 30))),
+                'from': edge['from'],
+                'to': edge['to'],
+            }
+
+        if any(edge['lanes'] != 1 for edge in self._edges.values()):
+            raise FatalFlowError(
+                'The "numpy" simulator only supports single-lane rings.')
+
+        # list of edges, in the order of the ring, and junctions (none)
+        self._edge_list = self._ring_order()
+        self._junction_list = []
+
+        # maximum achievable speed on any edge in the network
+        self.__max_speed = max(
+            self.speed_limit(edge) for edge in self.get_edge_list())
+
+        # every edge starts where the previous one ended
+        self.edgestarts = []
+        length = 0
+        for edge_id in self._edge_list:
+            self.edgestarts.append((edge_id, length))
+            length += self._edges[edge_id]['length']
+        self.__length = length
+
+        self.internal_edgestarts = []
+        self.internal_edgestarts_dict = {}
+        self.total_edgestarts = list(self.edgestarts)
+        self.total_edgestarts_dict = dict(self.total_edgestarts)
+        self._edge_index = EdgeStartIndex(self.total_edgestarts, {})
+
+        if self.network.routes is None:
+            print("No routes specified, defaulting to single edge routes.")
+            self.network.routes = {edge: [edge] for edge in self._edge_list}
+
+        # as done by the TraCI network kernel, routes with a single choice
+        # are converted into a list of routes with one element
+        for route_id in self.network.routes.keys():
+            if isinstance(self.network.routes[route_id][0], str):
+                self.network.routes[route_id] = \
+                    [(self.network.routes[route_id], 1)]
+
+        # specify routes vehicles can take
+        self.rts = self.network.routes
+
+    def _ring_order(self):
+        """Return the edges in the order of the ring.
+
+        The first edge is the one starting first in the edge starts of the
+        network, if specified.
+        """
+        if self.network.edge_starts:
+            first = min(self.network.edge_starts, key=lambda e: e[1])[0]
+        else:
+            first = next(iter(self._edges))
+
+        by_start = {edge['from']: edge_id
+                    for edge_id, edge in self._edges.items()}
+        order = [first]
+        while len(order) <= len(self._edges):
+            next_edge = by_start.get(self._edges[order[-1]]['to'])
+            if next_edge == first:
+                break
+            if next_edge is None or next_edge in order:
+                order = None
+                break
+            order.append(next_edge)
+
+        if order is None or len(order) != len(self._edges):
+            raise FatalFlowError(
+                'The "numpy" simulator only supports networks whose edges '
+                'form a single ring.')
+        return order
+
+    def update(self, reset):
+        """Perform no action of value (networks are static)."""
+        pass
+
+    def close(self):
+        """See parent class (no files are generated)."""
+        pass
+
+    def get_edge(self, x):
+        """See parent class."""
+        return self._edge_index.get_edge(x % self.__length)
+
+    def get_x(self, edge, position):
+        """See parent class."""
+        # if there was a collision which caused the vehicle to disappear,
+        # return an x value of -1001
+        return self._edge_index.get_x(edge, position)
+
+    def get_x_array(self, edges, positions):
+        """See parent class."""
+        return self._edge_index.get_x_array(edges, positions)
+
+    def get_2d_position(self, x):
+        """Return the 2D position and angle of a position on the ring.
+
+        The ring is a circle centered on the origin, starting at its bottom
+        and traveled counterclockwise, as in flow.networks.RingNetwork.
+
+        Parameters
+        ----------
+        x : float
+            absolute position on the ring
+
+        Returns
+        -------
+        tuple of float
+            the 2D position
+        float
+            the angle of the direction of travel, in degrees clockwise from
+            the north (as in sumo)
+        """
+        radius = self.__length / (2 * math.pi)
+        theta = 2 * math.pi * x / self.__length - math.pi / 2
+        position = (radius * math.cos(theta), radius * math.sin(theta))
+        angle = (90 - 360 * x / self.__length) % 360
+        return position, angle
+
+    def edge_length(self, edge_id):
+        """See parent class."""
+        try:
+            return self._edges[edge_id]['length']
+        except KeyError:
+            print('Error in edge length with key', edge_id)
+            return -1001
+
+    def length(self):
+        """See parent class."""
+        return self.__length
+
+    def non_internal_length(self):
+        """See parent class."""
+        return self.__length
+
+    def speed_limit(self, edge_id):
+        """See parent class."""
+        try:
+            return self._edges[edge_id]['speed']
+        except KeyError:
+            print('Error in speed limit with key', edge_id)
+            return -1001
+
+    def num_lanes(self, edge_id):
+        """See parent class."""
+        try:
+            return self._edges[edge_id]['lanes']
+        except KeyError:
+            print('Error in num lanes with key', edge_id)
+            return -1001
+
+    def max_speed(self):
+        """See parent class."""
+        return self.__max_speed
+
+    def get_edge_list(self):
+        """See parent class."""
+        return self._edge_list
+
+    def get_junction_list(self):
+        """See parent class."""
+        return self._junction_list
+
+    def next_edge(self, edge, lane):
+        """See parent class."""
+        try:
+            i = self._edge_list.index(edge)
+        except ValueError:
+            return []
+        return [(self._edge_list[(i + 1) % len(self._edge_list)], 0)]
+
+    def prev_edge(self, edge, lane):
+        """See parent class."""
+        try:
+            i = self._edge_list.index(edge)
+        except ValueError:
+            return []
+        return [(self._edge_list[i - 1], 0)]
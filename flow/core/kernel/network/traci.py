@@ -2,6 +2,8 @@
 import tempfile
 
 from flow.core.kernel.network import BaseKernelNetwork
+from flow.core.kernel.network.edge_index import EdgeStartIndex
+from flow.core.network_cache import NetworkCache, network_key
 from flow.core.util import makexml, printxml, ensure_dir
 import time
 import os
@@ -82,6 +84,7 @@ class TraCIKernelNetwork(BaseKernelNetwork):
         self.__non_internal_length = None  # total length of non-internal edges
         self.rts = None
         self.cfg = None
+        self._edge_index = None
 
     def generate_network(self, network):
         """See parent class.
@@ -190,6 +193,11 @@ class TraCIKernelNetwork(BaseKernelNetwork):
 
         self.total_edgestarts_dict = dict(self.total_edgestarts)
 
+        # compiled edge starts, used by get_edge and get_x
+        self._edge_index = EdgeStartIndex(
+            self.total_edgestarts, self.internal_edgestarts_dict,
+            self._edges.keys())
+
         self.__length = sum(
             self._edges[edge_id]['length'] for edge_id in self._edges
         )
@@ -245,27 +253,22 @@ class TraCIKernelNetwork(BaseKernelNetwork):
 
     def get_edge(self, x):
         """See parent class."""
-        for (edge, start_pos) in reversed(self.total_edgestarts):
-            if x >= start_pos:
-                return edge, x - start_pos
+        return self._edge_index.get_edge(x)
 
     def get_x(self, edge, position):
-        """See parent class."""
-        # if there was a collision which caused the vehicle to disappear,
-        # return an x value of -1001
-        if len(edge) == 0:
-            return -1001
+        """See parent class.
 
-        if edge[0] == ':':
-            try:
-                return self.internal_edgestarts_dict[edge] + position
-            except KeyError:
-                # in case several internal links are being generalized for
-                # by a single element (for backwards compatibility)
-                edge_name = edge.rsplit('_', 1)[0]
-                return self.total_edgestarts_dict.get(edge_name, -1001)
-        else:
-            return self.total_edgestarts_dict[edge] + position
+        If there was a collision which caused the vehicle to disappear, an x
+        value of -1001 is returned. Internal edges without a start of their
+        own are given the start of the element generalizing for them, if any
+        (for backwards compatibility), and -1001 otherwise. See
+        flow.core.kernel.network.edge_index.EdgeStartIndex.
+        """
+        return self._edge_index.get_x(edge, position)
+
+    def get_x_array(self, edges, positions):
+        """See parent class."""
+        return self._edge_index.get_x_array(edges, positions)
 
     def edge_length(self, edge_id):
         """See parent class."""
@@ -505,6 +508,28 @@ class TraCIKernelNetwork(BaseKernelNetwork):
         x.append(t)
         printxml(x, self.net_path + self.cfgfn)
 
+        # reuse the compiled network if the same files were compiled before
+        cache_path = getattr(self.sim_params, "network_cache", None)
+        if cache_path is not None:
+            files = [self.nodfn, self.edgfn, self.cfgfn]
+            if types is not None:
+                files.append(self.typfn)
+            if connections is not None:
+                files.append(self.confn)
+            key = network_key([self.net_path + fn for fn in files],
+                              self.network.name)
+            return NetworkCache(cache_path).get(
+                key, self.cfg_path + self.netfn,
+                lambda: self._compile_net(net_params))
+
+        return self._compile_net(net_params)
+
+    def _compile_net(self, net_params):
+        """Compile the network files with netconvert and import the result.
+
+        See generate_net for the format of the returned edges and
+        connections.
+        """
         subprocess.call(
             [
                 'netconvert -c ' + self.net_path + self.cfgfn +
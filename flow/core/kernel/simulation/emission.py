@@ -0,0 +1,347 @@
+"""Script containing the streaming emission writer.
+
+Emission data is written to disk in chunks while a simulation runs, instead
+of being kept in memory until the end of the run. Rows are buffered for a
+fixed number of simulation steps (the flush interval), after which they are
+appended to a partial file next to the final emission file. The partial file
+is moved to its final name once the rollout is over.
+
+Three formats are supported:
+
+* "csv": a csv file with one row per vehicle and time step, matching the
+  emission files that were previously produced at the end of a run.
+* "npz": a NumPy archive with one typed array per column. Every chunk is
+  stored in a separate file while the simulation runs, and the chunks are
+  streamed into the final archive one column at a time, so the full data set
+  is never held in memory.
+* "columnar": a directory with one .npy file per column, which can be memory
+  mapped when loaded. String columns (vehicle and edge ids) are stored as
+  categorical int32 codes, with the categories in a separate
+  "<column>.categories.npy" file. Empty values have the code -1.
+
+Emission files of any format can be loaded as a pandas DataFrame with
+load_emission.
+"""
+import csv
+import glob
+import os
+import shutil
+import zipfile
+
+import numpy as np
+
+# name and type of every column in the emission files, in order. The first
+# two columns are filled by the simulation kernel, and the others are
+# collected from the vehicle kernel at every step.
+EMISSION_COLUMNS = [
+    ("time", float),
+    ("id", str),
+    ("x", float),
+    ("edge", str),
+    ("speed", float),
+    ("space_headway", float),
+    ("leader_id", str),
+    ("target_accel_with_noise_no_failsafe", float),
+    ("realized_accel", float),
+    ("distance_traveled", float),
+    ("follower_id", str),
+    ("fuel_consumption", float),
+    ("shock_time", int),
+]
+
+# supported emission formats, and the extension of the files they produce
+EMISSION_FORMATS = {"csv": "csv", "npz": "npz", "columnar": "columnar"}
+
+# dtype of the codes of categorical columns in the "columnar" format
+CATEGORY_DTYPE = np.int32
+
+
+class EmissionWriter(object):
+    """Chunked writer of emission data.
+
+    Attributes
+    ----------
+    path : str
+        path to the partial file (or directory of chunks, for the "npz" and
+        "columnar" formats) the data is written to while the simulation runs
+    columns : list of (str, type)
+        name and type of every column
+    fmt : str
+        the emission format, one of EMISSION_FORMATS
+    flush_interval : int
+        number of simulation steps between two writes to disk
+    num_rows : int
+        number of rows written so far, including buffered rows
+    """
+
+    def __init__(self, path, columns=None, fmt="csv", flush_interval=100):
+        """Instantiate the writer.
+
+        Parameters
+        ----------
+        path : str
+            path to the partial file. Any existing data at this path is
+            overwritten.
+        columns : list of (str, type), optional
+            name and type of every column. Defaults to EMISSION_COLUMNS.
+        fmt : str, optional
+            the emission format, "csv", "npz" or "columnar"
+        flush_interval : int, optional
+            number of simulation steps between two writes to disk
+        """
+        if fmt not in EMISSION_FORMATS:
+            raise ValueError("Emission format must be one of {}, got {}."
+                             .format(list(EMISSION_FORMATS), fmt))
+
+        self.path = path
+        self.columns = columns or EMISSION_COLUMNS
+        self.fmt = fmt
+        self.flush_interval = max(1, int(flush_interval))
+        self.num_rows = 0
+
+        self._buffer = []
+        self._steps = 0
+        self._num_chunks = 0
+        # maximum length of the values in each string column ("npz" only)
+        self._str_widths = {name: 1 for name, typ in self.columns
+                            if typ is str}
+        # categories of each string column ("columnar" only)
+        self._categories = {name: {} for name, typ in self.columns
+                            if typ is str}
+
+        self._remove_partial()
+        if self.fmt == "csv":
+            with open(self.path, "w") as f:
+                csv.writer(f, delimiter=',').writerow(
+                    [name for name, _ in self.columns])
+        else:
+            os.makedirs(self.path)
+
+    def add(self, row):
+        """Add a row of data, with one value per column in order."""
+        self._buffer.append(row)
+        self.num_rows += 1
+
+    def step(self):
+        """Mark the end of a simulation step.
+
+        The buffered rows are written to disk every flush_interval steps.
+        """
+        self._steps += 1
+        if self._steps % self.flush_interval == 0:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows to disk."""
+        if len(self._buffer) == 0:
+            return
+
+        if self.fmt == "csv":
+            with open(self.path, "a") as f:
+                csv.writer(f, delimiter=',').writerows(self._buffer)
+        elif self.fmt == "columnar":
+            # append the raw values of every column to its own file
+            for i, (name, typ) in enumerate(self.columns):
+                values = [row[i] for row in self._buffer]
+                if typ is str:
+                    categories = self._categories[name]
+                    values = np.array(
+                        [-1 if v is None or v == "" else
+                         categories.setdefault(str(v), len(categories))
+                         for v in values], dtype=CATEGORY_DTYPE)
+                else:
+                    values = np.array(values, dtype=self._dtype(name, typ))
+                with open(os.path.join(self.path, name + ".bin"), "ab") as f:
+                    values.tofile(f)
+        else:
+            chunk = {}
+            for i, (name, typ) in enumerate(self.columns):
+                values = [row[i] for row in self._buffer]
+                if typ is str:
+                    values = np.array(
+                        ["" if v is None else str(v) for v in values])
+                    self._str_widths[name] = max(
+                        self._str_widths[name], values.dtype.itemsize // 4)
+                elif typ is int:
+                    values = np.array(values, dtype=np.int64)
+                else:
+                    values = np.array(values, dtype=np.float64)
+                chunk[name] = values
+            np.savez(os.path.join(
+                self.path, "chunk_{:06d}.npz".format(self._num_chunks)),
+                **chunk)
+            self._num_chunks += 1
+
+        self._buffer.clear()
+
+    def close(self, final_path):
+        """Flush any remaining data and move it to its final location.
+
+        Parameters
+        ----------
+        final_path : str
+            path to the emission file
+        """
+        self.flush()
+
+        if self.fmt == "csv":
+            os.replace(self.path, final_path)
+        elif self.fmt == "columnar":
+            self._write_columns(final_path)
+            self._remove_partial()
+        else:
+            self._merge_chunks(final_path)
+            self._remove_partial()
+
+    def discard(self):
+        """Remove all data written so far."""
+        self._buffer.clear()
+        self._remove_partial()
+
+    def _dtype(self, name, typ):
+        """Return the dtype a column is stored with."""
+        if typ is str:
+            if self.fmt == "columnar":
+                return np.dtype(CATEGORY_DTYPE)
+            return np.dtype("U{}".format(self._str_widths[name]))
+        elif typ is int:
+            return np.dtype(np.int64)
+        else:
+            return np.dtype(np.float64)
+
+    def _write_columns(self, final_path):
+        """Move the raw column files into a directory of .npy files."""
+        if os.path.isdir(final_path):
+            shutil.rmtree(final_path)
+        os.makedirs(final_path)
+
+        for name, typ in self.columns:
+            raw_path = os.path.join(self.path, name + ".bin")
+            with open(os.path.join(final_path, name + ".npy"), "wb") as f:
+                np.lib.format.write_array_header_1_0(f, {
+                    "descr": np.lib.format.dtype_to_descr(
+                        self._dtype(name, typ)),
+                    "fortran_order": False,
+                    "shape": (self.num_rows,),
+                })
+                if os.path.exists(raw_path):
+                    with open(raw_path, "rb") as raw:
+                        shutil.copyfileobj(raw, f)
+
+            if typ is str:
+                categories = sorted(self._categories[name].items(),
+                                    key=lambda item: item[1])
+                np.save(os.path.join(final_path, name + ".categories.npy"),
+                        np.array([c for c, _ in categories], dtype=str))
+
+    def _merge_chunks(self, final_path):
+        """Stream the npz chunks into a single archive, column by column."""
+        chunks = sorted(glob.glob(os.path.join(self.path, "chunk_*.npz")))
+        with zipfile.ZipFile(final_path, "w", allowZip64=True) as zf:
+            for name, typ in self.columns:
+                dtype = self._dtype(name, typ)
+
+                with zf.open(name + ".npy", "w", force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(f, {
+                        "descr": np.lib.format.dtype_to_descr(dtype),
+                        "fortran_order": False,
+                        "shape": (self.num_rows,),
+                    })
+                    for chunk in chunks:
+                        with np.load(chunk) as data:
+                            f.write(data[name].astype(dtype).tobytes())
+
+    def _remove_partial(self):
+        """Remove the partial file or chunk directory, if it exists."""
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def find_emission_files(directory):
+    """Return the paths to all emission files in a directory.
+
+    Parameters
+    ----------
+    directory : str
+        directory to search (not recursively)
+
+    Returns
+    -------
+    list of str
+        sorted paths to the emission files of any supported format
+    """
+    extensions = tuple("." + ext for ext in EMISSION_FORMATS.values())
+    return sorted(os.path.join(directory, item)
+                  for item in os.listdir(directory)
+                  if item.endswith(extensions) and not item.startswith("."))
+
+
+def load_emission(path, columns=None, mmap=True):
+    """Load an emission file of any supported format.
+
+    String columns (vehicle and edge ids) are returned as pandas categoricals,
+    with missing values (e.g. vehicles without a leader) as NaN, similar to
+    the result of pandas.read_csv.
+
+    Parameters
+    ----------
+    path : str
+        path to a "csv" or "npz" emission file, or to a "columnar" emission
+        directory
+    columns : list of str, optional
+        names of the columns to load. Defaults to all columns.
+    mmap : bool, optional
+        whether to memory-map the columns of "columnar" emission files instead
+        of reading them into memory
+
+    Returns
+    -------
+    pandas.DataFrame
+        the emission data, with one row per vehicle and time step
+    """
+    import pandas as pd
+
+    str_columns = [name for name, typ in EMISSION_COLUMNS if typ is str]
+
+    if path.endswith(".csv"):
+        df = pd.read_csv(path, usecols=columns)
+        for name in str_columns:
+            if name in df.columns:
+                df[name] = df[name].astype("category")
+        return df
+
+    data = {}
+    if os.path.isdir(path):
+        if columns is None:
+            columns = [item[:-len(".npy")] for item in sorted(os.listdir(path))
+                       if item.endswith(".npy")
+                       and not item.endswith(".categories.npy")]
+        for name in columns:
+            values = np.load(os.path.join(path, name + ".npy"),
+                             mmap_mode="r" if mmap else None)
+            categories_path = os.path.join(path, name + ".categories.npy")
+            if os.path.exists(categories_path):
+                values = pd.Categorical.from_codes(
+                    np.asarray(values), np.load(categories_path))
+            data[name] = values
+    else:
+        with np.load(path) as archive:
+            if columns is None:
+                columns = list(archive.keys())
+            for name in columns:
+                values = archive[name]
+                if values.dtype.kind == "U":
+                    values = pd.Categorical(values)
+                    if "" in values.categories:
+                        values = values.remove_categories([""])
+                data[name] = values
+
+    # keep the order of the emission columns. The columns are not copied
+    # (pandas >= 1.3), so that memory-mapped columns are only read from disk
+    # when accessed
+    order = [name for name, _ in EMISSION_COLUMNS if name in data]
+    order += [name for name in data if name not in order]
+    return pd.DataFrame({name: data[name] for name in order}, columns=order,
+                        copy=False)
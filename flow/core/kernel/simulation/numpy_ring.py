@@ -0,0 +1,743 @@
+"""Script containing the NumPy ring simulation kernel class.
+
+This simulator replaces sumo for single-lane rings. The state of every ring
+is a row of the arrays of a RingArray, which can be shared by any number of
+rings (e.g. all environments of a hyperparameter sweep) and advanced in
+lock-step, with a single vectorized update of all rings. Vehicles are
+integrated with an Euler step (or a ballistic step, see the use_ballistic
+attribute of SumoParams), and vehicles whose acceleration is not set by Flow
+follow the Krauss model, the default car-following model of sumo.
+
+The simulator is accessed through an in-process API that implements the
+subset of the TraCI API used by Flow (see RingAPI), so that the TraCI vehicle
+and traffic light kernels are used unchanged.
+"""
+import math
+
+import numpy as np
+import traci.constants as tc
+from traci.exceptions import TraCIException
+
+from flow.controllers.car_following_kernels import get_kernel, \
+    krauss_safe_speed
+from flow.core.kernel.simulation.traci import TraCISimulation
+from flow.core.util import ensure_dir
+from flow.utils.exceptions import FatalFlowError
+
+# length of vehicles, in meters (sumo's default)
+VEHICLE_LENGTH = 5
+
+# headway of vehicles without a leader
+NO_LEADER_HEADWAY = 1e3
+
+
+class RingArray(object):
+    """The state of a set of single-lane rings, advanced in lock-step.
+
+    Every ring is a row of the arrays, and every vehicle a slot (column) in
+    the row of its ring. Rows and slots are reused once released, and the
+    arrays grow when more are needed.
+
+    Ring arrays are never copied, so that the simulation parameters holding
+    one (see the ring_array attribute of SumoParams) can be deep-copied for
+    every environment of a sweep, while all environments share the array.
+
+    Attributes
+    ----------
+    sim_step : float
+        seconds per simulation step, common to all rings
+    use_ballistic : bool
+        whether to use a ballistic integration step instead of an Euler step
+    ring_length : numpy.ndarray
+        length of every ring
+    speed_limit : numpy.ndarray
+        speed limit of every ring
+    time : numpy.ndarray
+        simulation time of every ring
+    active : numpy.ndarray
+        whether every slot holds a vehicle
+    x : numpy.ndarray
+        position of the front bumper of every vehicle on its ring
+    v : numpy.ndarray
+        speed of every vehicle
+    v_default : numpy.ndarray
+        speed every vehicle would have had without commands from Flow
+    distance : numpy.ndarray
+        distance traveled by every vehicle
+    cmd : numpy.ndarray
+        speed requested by Flow for the next step (NaN if none)
+    leader : numpy.ndarray
+        slot of the leader of every vehicle (-1 if none)
+    headway : numpy.ndarray
+        bumper-to-bumper gap between every vehicle and its leader
+    collided : numpy.ndarray
+        whether every vehicle collided with its leader in the last step
+    """
+
+    # vehicle attributes, with their type and the value of empty slots
+    VEHICLE_FIELDS = {
+        "active": (bool, False),
+        "x": (float, 0.),
+        "v": (float, 0.),
+        "v_default": (float, 0.),
+        "distance": (float, 0.),
+        "length": (float, VEHICLE_LENGTH),
+        "min_gap": (float, 2.5),
+        "max_speed": (float, 30.),
+        "accel": (float, 2.6),
+        "decel": (float, 4.5),
+        "tau": (float, 1.),
+        "sigma": (float, 0.5),
+        "speed_mode": (int, 31),
+        "cmd": (float, np.nan),
+        "cmd_persistent": (bool, False),
+        "leader": (int, -1),
+        "headway": (float, NO_LEADER_HEADWAY),
+        "collided": (bool, False),
+    }
+
+    # ring attributes, with their type and the value of empty rows
+    RING_FIELDS = {
+        "in_use": (bool, False),
+        "ring_length": (float, 1.),
+        "speed_limit": (float, 30.),
+        "time": (float, 0.),
+    }
+
+    def __init__(self, sim_step, use_ballistic=False, seed=None):
+        """Instantiate an empty ring array.
+
+        Parameters
+        ----------
+        sim_step : float
+            seconds per simulation step
+        use_ballistic : bool, optional
+            whether to use a ballistic integration step
+        seed : int, optional
+            seed of the random number generator of the Krauss model
+        """
+        self.sim_step = sim_step
+        self.use_ballistic = use_ballistic
+        self.rng = np.random.RandomState(seed)
+        self.num_rows = 0
+        self.num_slots = 0
+        for name, (dtype, fill) in self.RING_FIELDS.items():
+            setattr(self, name, np.full(0, fill, dtype=dtype))
+        for name, (dtype, fill) in self.VEHICLE_FIELDS.items():
+            setattr(self, name, np.full((0, 0), fill, dtype=dtype))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _grow(self, num_rows, num_slots):
+        """Grow the arrays to at least num_rows rings of num_slots slots."""
+        num_rows = max(num_rows, self.num_rows)
+        num_slots = max(num_slots, self.num_slots)
+        if num_rows == self.num_rows and num_slots == self.num_slots:
+            return
+
+        for name, (dtype, fill) in self.RING_FIELDS.items():
+            array = np.full(num_rows, fill, dtype=dtype)
+            array[:self.num_rows] = getattr(self, name)
+            setattr(self, name, array)
+        for name, (dtype, fill) in self.VEHICLE_FIELDS.items():
+            array = np.full((num_rows, num_slots), fill, dtype=dtype)
+            array[:self.num_rows, :self.num_slots] = getattr(self, name)
+            setattr(self, name, array)
+
+        self.num_rows = num_rows
+        self.num_slots = num_slots
+
+    def add_ring(self, length, speed_limit):
+        """Add a ring, and return its row."""
+        free = np.flatnonzero(~self.in_use)
+        if len(free) > 0:
+            row = int(free[0])
+        else:
+            row = self.num_rows
+            self._grow(max(1, 2 * self.num_rows), self.num_slots)
+
+        self.in_use[row] = True
+        self.ring_length[row] = length
+        self.speed_limit[row] = speed_limit
+        self.time[row] = 0
+        for name, (_, fill) in self.VEHICLE_FIELDS.items():
+            getattr(self, name)[row] = fill
+        return row
+
+    def remove_ring(self, row):
+        """Release the row of a ring, and all of its vehicles."""
+        self.in_use[row] = False
+        self.active[row] = False
+
+    def add_vehicle(self, row, x, v, **params):
+        """Add a vehicle to a ring, and return its slot.
+
+        Parameters
+        ----------
+        row : int
+            row of the ring
+        x : float
+            position of the vehicle on the ring
+        v : float
+            speed of the vehicle
+        params : dict
+            other attributes of the vehicle (see VEHICLE_FIELDS), e.g. its
+            length or maximum speed
+        """
+        free = np.flatnonzero(~self.active[row])
+        if len(free) > 0:
+            slot = int(free[0])
+        else:
+            slot = self.num_slots
+            self._grow(self.num_rows, max(1, 2 * self.num_slots))
+
+        for name, (_, fill) in self.VEHICLE_FIELDS.items():
+            getattr(self, name)[row, slot] = params.get(name, fill)
+        self.active[row, slot] = True
+        self.x[row, slot] = x % self.ring_length[row]
+        self.v[row, slot] = v
+        self.v_default[row, slot] = v
+        return slot
+
+    def remove_vehicle(self, row, slot):
+        """Remove a vehicle from a ring."""
+        self.active[row, slot] = False
+        self.cmd[row, slot] = np.nan
+        self.cmd_persistent[row, slot] = False
+
+    def _rows(self, rows):
+        """Return the rows to update, all rings in use by default."""
+        if rows is None:
+            return np.flatnonzero(self.in_use)
+        return np.asarray(rows, dtype=int)
+
+    def update_leaders(self, rows=None):
+        """Compute the leader and headway of every vehicle of some rings.
+
+        Parameters
+        ----------
+        rows : list of int, optional
+            rows of the rings. Defaults to all rings in use.
+        """
+        r = self._rows(rows)
+        if len(r) == 0 or self.num_slots == 0:
+            return
+
+        active = self.active[r]
+        x = self.x[r]
+        length = self.length[r]
+
+        # the leader of a vehicle is the next one by position, and the leader
+        # of the last vehicle is the first one
+        order = np.argsort(np.where(active, x, np.inf), axis=1, kind="stable")
+        n = active.sum(axis=1)[:, None]
+        rank = np.arange(self.num_slots)[None, :]
+        lead_rank = np.where(rank + 1 < n, rank + 1, 0)
+        lead_sorted = np.take_along_axis(order, lead_rank, axis=1)
+        lead_sorted = np.where((rank < n) & (n > 1), lead_sorted, -1)
+        leader = np.full(active.shape, -1, dtype=int)
+        np.put_along_axis(leader, order, lead_sorted, axis=1)
+
+        has_leader = leader >= 0
+        lead_idx = np.maximum(leader, 0)
+        x_lead = np.take_along_axis(x, lead_idx, axis=1)
+        length_lead = np.take_along_axis(length, lead_idx, axis=1)
+        ring_length = self.ring_length[r][:, None]
+
+        self.leader[r] = leader
+        self.headway[r] = np.where(
+            has_leader, (x_lead - x) % ring_length - length_lead,
+            NO_LEADER_HEADWAY)
+
+    def step(self, rows=None):
+        """Advance some rings by one simulation step, in a single update.
+
+        Vehicles with a requested speed (see the cmd attribute) adopt it,
+        subject to the checks of their speed mode (as in sumo, bit 0: safe
+        speed, bit 1: maximum acceleration, bit 2: maximum deceleration).
+        Other vehicles follow the Krauss model. Vehicles that would overlap
+        with their leader are stopped right behind it, and flagged as collided.
+
+        Parameters
+        ----------
+        rows : list of int, optional
+            rows of the rings. Defaults to all rings in use.
+        """
+        r = self._rows(rows)
+        if len(r) == 0 or self.num_slots == 0:
+            return
+        dt = self.sim_step
+
+        active = self.active[r]
+        v = self.v[r]
+        headway = self.headway[r]
+        leader = self.leader[r]
+        has_leader = leader >= 0
+        lead_idx = np.maximum(leader, 0)
+        v_lead = np.where(
+            has_leader, np.take_along_axis(v, lead_idx, axis=1), np.nan)
+
+        accel = self.accel[r]
+        decel = self.decel[r]
+        v_max = np.minimum(self.max_speed[r], self.speed_limit[r][:, None])
+        params = {
+            "accel": accel,
+            "b": decel,
+            "tau": self.tau[r],
+            "s0": self.min_gap[r],
+            "sigma": self.sigma[r],
+            "v_max": v_max,
+            "sim_step": dt,
+            "rand": self.rng.random_sample(v.shape),
+        }
+
+        # speed of the vehicles without commands from Flow
+        v_default = v + get_kernel("krauss")(v, v_lead, headway, params) * dt
+
+        # speed requested by Flow, subject to the checks of the speed mode
+        cmd = self.cmd[r]
+        mode = self.speed_mode[r]
+        v_cmd = np.nan_to_num(cmd)
+        v_cmd = np.where(mode & 1, np.minimum(
+            v_cmd, krauss_safe_speed(v_lead, headway, params)), v_cmd)
+        v_cmd = np.where(mode & 2, np.minimum(v_cmd, v + accel * dt), v_cmd)
+        v_cmd = np.where(mode & 4, np.maximum(v_cmd, v - decel * dt), v_cmd)
+
+        v_next = np.where(np.isnan(cmd), v_default, v_cmd)
+        v_next = np.where(active, np.clip(v_next, 0, v_max), 0)
+
+        if self.use_ballistic:
+            dx = 0.5 * (v + v_next) * dt
+        else:
+            dx = v_next * dt
+
+        # stop the vehicles that would run into their leader
+        dx_lead = np.take_along_axis(dx, lead_idx, axis=1)
+        collided = active & has_leader & (headway + dx_lead - dx < 0)
+        dx = np.where(collided, np.maximum(headway + dx_lead, 0), dx)
+        v_next = np.where(collided, 0, v_next)
+
+        self.x[r] = (self.x[r] + dx) % self.ring_length[r][:, None]
+        self.v[r] = v_next
+        self.v_default[r] = np.where(active, np.maximum(v_default, 0), 0)
+        self.distance[r] += dx
+        self.collided[r] = collided
+        self.cmd[r] = np.where(self.cmd_persistent[r], cmd, np.nan)
+        self.time[r] += dt
+
+        self.update_leaders(r)
+
+
+class _RingVehicleAPI(object):
+    """The TraCI vehicle API of a ring, see RingAPI."""
+
+    def __init__(self, api):
+        self._api = api
+        self._slots = {}  # slot of every vehicle, by id
+        self._pending = []  # vehicles that depart in the next step
+        self._types = {}
+        self._routes = {}
+        self._colors = {}
+        self._lc_modes = {}
+        self._subscribed = set()
+        self._leader_subscribed = set()
+
+    @property
+    def _ring(self):
+        return self._api.ring
+
+    @property
+    def _row(self):
+        return self._api.row
+
+    def _slot(self, veh_id):
+        try:
+            return self._slots[veh_id]
+        except KeyError:
+            raise TraCIException("Vehicle '{}' is not known".format(veh_id))
+
+    def _get(self, name, veh_id):
+        return getattr(self._ring, name)[self._row, self._slot(veh_id)]
+
+    def _set(self, name, veh_id, value):
+        getattr(self._ring, name)[self._row, self._slot(veh_id)] = value
+
+    def _insert_pending(self):
+        """Insert the vehicles added since the last step, and return them."""
+        departed = []
+        for veh_id, type_id, route, x, speed in self._pending:
+            cf_params = self._api.type_parameters[type_id][
+                "car_following_params"]
+            controller_params = cf_params.controller_params
+            self._slots[veh_id] = self._ring.add_vehicle(
+                self._row, x, speed,
+                min_gap=controller_params["minGap"],
+                max_speed=controller_params["maxSpeed"],
+                accel=controller_params["accel"],
+                decel=controller_params["decel"],
+                tau=controller_params["tau"],
+                sigma=controller_params["sigma"],
+                speed_mode=int(cf_params.speed_mode))
+            self._api.slot_ids[self._slots[veh_id]] = veh_id
+            self._types[veh_id] = type_id
+            self._routes[veh_id] = list(route)
+            departed.append(veh_id)
+        self._pending = []
+        return departed
+
+    def _results(self, veh_id):
+        """Return the subscription results of a vehicle."""
+        ring, row, slot = self._ring, self._row, self._slots[veh_id]
+        x = ring.x[row, slot]
+        edge, pos = self._api.network.get_edge(x)
+        position, angle = self._api.network.get_2d_position(x)
+        results = {
+            tc.VAR_LANE_INDEX: 0,
+            tc.VAR_LANEPOSITION: pos,
+            tc.VAR_ROAD_ID: edge,
+            tc.VAR_SPEED: ring.v[row, slot],
+            tc.VAR_EDGES: self._routes[veh_id],
+            tc.VAR_POSITION: position,
+            tc.VAR_ANGLE: angle,
+            tc.VAR_SPEED_WITHOUT_TRACI: ring.v_default[row, slot],
+            tc.VAR_FUELCONSUMPTION: 0.,
+            tc.VAR_DISTANCE: ring.distance[row, slot],
+            tc.VAR_TYPE: self._types[veh_id],
+            tc.VAR_LENGTH: ring.length[row, slot],
+        }
+        leader = ring.leader[row, slot]
+        if veh_id in self._leader_subscribed and leader >= 0:
+            # as in sumo, the gap excludes the minimum gap of the vehicle
+            results[tc.VAR_LEADER] = (
+                self._api.slot_ids[leader],
+                ring.headway[row, slot] - ring.min_gap[row, slot])
+        return results
+
+    def getIDList(self):
+        return list(self._slots)
+
+    def getIDCount(self):
+        return len(self._slots)
+
+    def addFull(self, vehID, routeID, typeID="DEFAULT_VEHTYPE",
+                departLane="first", departPos="base", departSpeed="0",
+                **kwargs):
+        if vehID in self._slots or \
+                any(vehID == pending[0] for pending in self._pending):
+            raise TraCIException(
+                "The vehicle '{}' to add already exists.".format(vehID))
+        if typeID not in self._api.type_parameters:
+            raise TraCIException("Invalid type '{}'.".format(typeID))
+        route = self._api.routes[routeID]
+        x = self._api.network.get_x(route[0], float(departPos))
+        self._pending.append(
+            (vehID, typeID, route, x, float(departSpeed)))
+
+    def remove(self, vehID, reason=tc.REMOVE_VAPORIZED):
+        self._pending = [p for p in self._pending if p[0] != vehID]
+        if vehID in self._slots:
+            slot = self._slots.pop(vehID)
+            del self._api.slot_ids[slot]
+            self._ring.remove_vehicle(self._row, slot)
+            self._ring.update_leaders([self._row])
+        self._subscribed.discard(vehID)
+        self._leader_subscribed.discard(vehID)
+
+    def subscribe(self, objectID, varIDs=None, begin=None, end=None):
+        self._subscribed.add(objectID)
+
+    def subscribeLeader(self, objectID, dist=0., begin=None, end=None):
+        self._leader_subscribed.add(objectID)
+
+    def unsubscribe(self, objectID):
+        self._subscribed.discard(objectID)
+        self._leader_subscribed.discard(objectID)
+
+    def getSubscriptionResults(self, objectID):
+        if objectID not in self._subscribed or objectID not in self._slots:
+            return None
+        return self._results(objectID)
+
+    def getAllSubscriptionResults(self):
+        return {veh_id: self._results(veh_id) for veh_id in self._slots
+                if veh_id in self._subscribed}
+
+    def slowDown(self, vehID, speed, duration):
+        self._set("cmd", vehID, speed)
+        self._set("cmd_persistent", vehID, False)
+
+    def setSpeed(self, vehID, speed):
+        # as in sumo, the speed is kept until a negative speed is set
+        self._set("cmd", vehID, speed if speed >= 0 else np.nan)
+        self._set("cmd_persistent", vehID, speed >= 0)
+
+    def setSpeedMode(self, vehID, sm):
+        self._set("speed_mode", vehID, int(sm))
+
+    def setLaneChangeMode(self, vehID, lcm):
+        self._lc_modes[vehID] = lcm
+
+    def changeLane(self, vehID, laneIndex, duration):
+        # rings only have a single lane
+        pass
+
+    def setRoute(self, vehID, edgeList):
+        self._routes[vehID] = list(edgeList)
+
+    def getMaxSpeed(self, vehID):
+        return self._get("max_speed", vehID)
+
+    def setMaxSpeed(self, vehID, speed):
+        self._set("max_speed", vehID, speed)
+
+    def setTau(self, vehID, tau):
+        self._set("tau", vehID, tau)
+
+    def setAccel(self, vehID, accel):
+        self._set("accel", vehID, accel)
+
+    def setDecel(self, vehID, decel):
+        self._set("decel", vehID, decel)
+
+    def setEmergencyDecel(self, vehID, decel):
+        pass
+
+    def setApparentDecel(self, vehID, decel):
+        pass
+
+    def getColor(self, vehID):
+        return self._colors.get(vehID, (255, 255, 0, 255))
+
+    def setColor(self, vehID, color):
+        self._colors[vehID] = tuple(color)
+
+    def getTypeID(self, vehID):
+        self._slot(vehID)
+        return self._types[vehID]
+
+    def getLength(self, vehID):
+        return self._get("length", vehID)
+
+    def getRoadID(self, vehID):
+        return self._api.network.get_edge(self._get("x", vehID))[0]
+
+    def getLanePosition(self, vehID):
+        return self._api.network.get_edge(self._get("x", vehID))[1]
+
+    def getLaneIndex(self, vehID):
+        self._slot(vehID)
+        return 0
+
+    def getSpeed(self, vehID):
+        return self._get("v", vehID)
+
+    def getFuelConsumption(self, vehID):
+        self._slot(vehID)
+        return 0.
+
+
+class _RingSimulationAPI(object):
+    """The TraCI simulation API of a ring, see RingAPI."""
+
+    def __init__(self, api):
+        self._api = api
+        self.departed = []
+        self.teleported = []
+
+    def subscribe(self, varIDs=None, begin=None, end=None):
+        pass
+
+    def getSubscriptionResults(self):
+        ring, row = self._api.ring, self._api.row
+        return {
+            tc.VAR_DEPARTED_VEHICLES_IDS: list(self.departed),
+            tc.VAR_ARRIVED_VEHICLES_IDS: [],
+            tc.VAR_TELEPORT_STARTING_VEHICLES_IDS: list(self.teleported),
+            # times are in milliseconds, as returned by sumo
+            tc.VAR_TIME_STEP: int(round(ring.time[row] * 1000)),
+            tc.VAR_DELTA_T: int(round(ring.sim_step * 1000)),
+            tc.VAR_LOADED_VEHICLES_NUMBER: len(self.departed),
+            tc.VAR_DEPARTED_VEHICLES_NUMBER: len(self.departed),
+            tc.VAR_ARRIVED_VEHICLES_NUMBER: 0,
+        }
+
+    def getStartingTeleportNumber(self):
+        return len(self.teleported)
+
+    def getTime(self):
+        return self._api.ring.time[self._api.row]
+
+
+class _RingTrafficLightAPI(object):
+    """The TraCI traffic light API of a ring, which has no traffic lights."""
+
+    def getIDList(self):
+        return []
+
+
+class _RingLaneAPI(object):
+    """The TraCI lane API of a ring, used by the pyglet renderer."""
+
+    def __init__(self, api):
+        self._api = api
+
+    def getIDList(self):
+        return ["{}_0".format(edge)
+                for edge in self._api.network.get_edge_list()]
+
+    def getShape(self, laneID):
+        network = self._api.network
+        edge = laneID.rsplit("_", 1)[0]
+        start = network.get_x(edge, 0)
+        return [network.get_2d_position(x)[0] for x in np.linspace(
+            start, start + network.edge_length(edge), 10)]
+
+
+class RingAPI(object):
+    """In-process TraCI API of a ring simulated in a RingArray.
+
+    Only the methods of the TraCI API that are used by Flow are implemented.
+
+    Attributes
+    ----------
+    ring : RingArray
+        the array holding the state of the ring
+    row : int
+        the row of the ring in the array
+    network : flow.core.kernel.network.NumpyRingNetwork
+        the network kernel of the ring
+    type_parameters : dict
+        the parameters of every vehicle type
+    routes : dict
+        the edges of every route, by route id
+    slot_ids : dict
+        the id of the vehicle in every slot of the row
+    """
+
+    def __init__(self, ring, network):
+        """Add a ring to a ring array.
+
+        Parameters
+        ----------
+        ring : RingArray
+            the ring array
+        network : flow.core.kernel.network.NumpyRingNetwork
+            the network kernel of the ring
+        """
+        self.ring = ring
+        self.network = network
+        self.row = ring.add_ring(network.length(), network.max_speed())
+        self.type_parameters = network.network.vehicles.type_parameters
+        self.routes = {
+            'route{}_{}'.format(edge, i): route
+            for edge in network.rts
+            for i, (route, _) in enumerate(network.rts[edge])}
+        self.slot_ids = {}
+
+        self.vehicle = _RingVehicleAPI(self)
+        self.simulation = _RingSimulationAPI(self)
+        self.trafficlight = _RingTrafficLightAPI()
+        self.lane = _RingLaneAPI(self)
+
+    def simulationStep(self, step=0.):
+        """Advance the ring by one step."""
+        self.ring.step([self.row])
+        self.finish_step()
+
+    def finish_step(self):
+        """Complete a step of the ring, once the ring array was advanced.
+
+        Vehicles added since the last step depart, and the collisions of the
+        step are reported as teleports.
+        """
+        ring, row = self.ring, self.row
+        self.simulation.teleported = [
+            veh_id for veh_id, slot in self.vehicle._slots.items()
+            if ring.collided[row, slot]]
+        self.simulation.departed = self.vehicle._insert_pending()
+        if len(self.simulation.departed) > 0:
+            ring.update_leaders([row])
+
+    def close(self):
+        """Remove the ring from the ring array."""
+        self.ring.remove_ring(self.row)
+
+
+def lockstep_simulation_step(simulations):
+    """Advance the rings of several simulation kernels in lock-step.
+
+    The rings that share a ring array are advanced with a single vectorized
+    update, instead of one update per ring.
+
+    Parameters
+    ----------
+    simulations : list of NumpyRingSimulation
+        the simulation kernels
+    """
+    arrays = {}
+    for simulation in simulations:
+        api = simulation.kernel_api
+        arrays.setdefault(id(api.ring), (api.ring, []))[1].append(api)
+
+    for ring, apis in arrays.values():
+        ring.step([api.row for api in apis])
+        for api in apis:
+            api.finish_step()
+
+
+class NumpyRingSimulation(TraCISimulation):
+    """NumPy simulation kernel for single-lane rings.
+
+    Extends flow.core.kernel.simulation.TraCISimulation, whose subscriptions,
+    collision checks and emission data are reused, with the ring simulated by
+    a RingArray instead of sumo.
+    """
+
+    def start_simulation(self, network, sim_params):
+        """Add the ring to its ring array.
+
+        The ring is added to the ring array of the simulation parameters (see
+        the ring_array attribute of SumoParams), or to a new ring array if
+        none is specified.
+
+        Raises
+        ------
+        flow.utils.exceptions.FatalFlowError
+            if the step size of the ring array does not match the simulation
+            parameters
+        """
+        # Save the simulation step size (for later use).
+        self.sim_step = sim_params.sim_step
+
+        # Collect the parameters of the emission writer.
+        self.emission_format = getattr(sim_params, "emission_format", "csv")
+        self.emission_flush_interval = getattr(
+            sim_params, "emission_flush_interval", 100)
+
+        # Update the emission path term.
+        self.emission_path = sim_params.emission_path
+        if self.emission_path is not None:
+            ensure_dir(self.emission_path)
+
+        ring = getattr(sim_params, "ring_array", None)
+        if ring is None:
+            ring = RingArray(sim_params.sim_step,
+                             use_ballistic=sim_params.use_ballistic,
+                             seed=sim_params.seed)
+        elif not math.isclose(ring.sim_step, sim_params.sim_step):
+            raise FatalFlowError(
+                "The step size of the ring array ({}) does not match the "
+                "simulation step size ({}).".format(
+                    ring.sim_step, sim_params.sim_step))
+
+        kernel_api = RingAPI(ring, network)
+        kernel_api.simulationStep()
+        return kernel_api
+
+    def simulation_step(self):
+        """See parent class."""
+        self.kernel_api.simulationStep()
@@ -1,6 +1,8 @@
 """Script containing the TraCI simulation kernel class."""
 
 from flow.core.kernel.simulation import KernelSimulation
+from flow.core.kernel.simulation.emission import EmissionWriter, \
+    EMISSION_COLUMNS, EMISSION_FORMATS
 from flow.core.util import ensure_dir
 import flow.config as config
 import traci.constants as tc
@@ -11,12 +13,21 @@ import time
 import logging
 import subprocess
 import signal
-import csv
+import weakref
 
 
 # Number of retries on restarting SUMO before giving up
 RETRIES_ON_ERROR = 10
 
+# libsumo only supports one simulation per process: weak reference to the
+# simulation kernel currently running it, if any
+_libsumo_owner = None
+
+
+def _get_libsumo_owner():
+    """Return the simulation kernel running libsumo, or None."""
+    return _libsumo_owner() if _libsumo_owner is not None else None
+
 
 class TraCISimulation(KernelSimulation):
     """Sumo simulation kernel.
@@ -25,8 +36,9 @@ class TraCISimulation(KernelSimulation):
 
     Attributes
     ----------
-    sumo_proc : subprocess.Popen
-        contains the subprocess.Popen instance used to start traci
+    sumo_proc : subprocess.Popen or None
+        contains the subprocess.Popen instance used to start traci, or None
+        if sumo is running in the current process through libsumo
     sim_step : float
         seconds per simulation step
     emission_path : str or None
@@ -34,20 +46,16 @@ class TraCISimulation(KernelSimulation):
         output is not generated if this value is not specified
     time : float
         used to internally keep track of the simulation time
-    stored_data : dict <str, dict <float, dict <str, Any>>>
-        a dict object used to store additional data if an emission file is
-        provided. The first key corresponds to the name of the vehicle, the
-        second corresponds to the time the sample was issued, and the final
-        keys represent the additional data stored at every given time for every
-        vehicle, and consists of the following keys:
-
-        * acceleration (no noise): the accelerations issued to the vehicle,
-          excluding noise
-        * acceleration (requested): the requested acceleration by the vehicle,
-          including noise
-        * acceleration (actual): the actual acceleration by the vehicle,
-          collected by computing the difference between the speeds of the
-          vehicle and dividing it by the sim_step term
+    emission_writer : flow.core.kernel.simulation.emission.EmissionWriter
+        streams the additional data collected at every step to disk if an
+        emission path is provided. One row is written per vehicle and time
+        step, with the columns listed in EMISSION_COLUMNS. The writer is
+        created on the first step after a rollout starts, and its data is moved
+        to the final emission file by save_emission.
+    emission_format : str
+        format of the emission files, "csv" or "npz"
+    emission_flush_interval : int
+        number of steps between two writes of emission data to disk
     """
 
     def __init__(self, master_kernel):
@@ -65,7 +73,9 @@ class TraCISimulation(KernelSimulation):
         self.sim_step = None
         self.emission_path = None
         self.time = 0
-        self.stored_data = dict()
+        self.emission_writer = None
+        self.emission_format = "csv"
+        self.emission_flush_interval = 100
 
     def pass_api(self, kernel_api):
         """See parent class.
@@ -100,53 +110,48 @@ class TraCISimulation(KernelSimulation):
 
         # Collect the additional data to store in the emission file.
         if self.emission_path is not None:
+            if self.emission_writer is None:
+                self.emission_writer = EmissionWriter(
+                    os.path.join(self.emission_path, ".{}-{}.partial".format(
+                        self.master_kernel.network.network.name,
+                        os.getpid())),
+                    columns=EMISSION_COLUMNS,
+                    fmt=self.emission_format,
+                    flush_interval=self.emission_flush_interval)
+
             kv = self.master_kernel.vehicle
+            t = round(self.time, 2)
             for veh_id in self.master_kernel.vehicle.get_ids():
-                t = round(self.time, 2)
-
-                # some miscellaneous pre-processing
-                position = kv.get_2d_position(veh_id)
-
-                # Make sure dictionaries corresponding to the vehicle and
-                # time are available.
-                if veh_id not in self.stored_data.keys():
-                    self.stored_data[veh_id] = dict()
-                if t not in self.stored_data[veh_id].keys():
-                    self.stored_data[veh_id][t] = dict()
-
                 # Bibek: Modify below according to our needs (more data means more computation time)
-                # Add the speed, position, and lane data.
-                self.stored_data[veh_id][t].update({
-                    "speed": kv.get_speed(veh_id),
-                    "edge": kv.get_edge(veh_id),
-                    #"edge_id": kv.get_edge(veh_id),
-                    #"relative_position": kv.get_position(veh_id),
-                    "x": kv.get_x_by_id(veh_id), # Is not accurate for bottleneck, do not use.
-                    #"y": position[1],
-
-                    "space_headway": kv.get_headway(veh_id), 
-                    "leader_id": kv.get_leader(veh_id),
-                    "follower_id": kv.get_follower(veh_id),
-                    #"leader_rel_speed": kv.get_speed(kv.get_leader(veh_id)) - kv.get_speed(veh_id),
-                    #"target_accel_with_noise_with_failsafe": kv.get_accel(veh_id, noise=True, failsafe=True),
-                    #"target_accel_no_noise_no_failsafe": kv.get_accel(veh_id, noise=False, failsafe=False),
-                    "target_accel_with_noise_no_failsafe": kv.get_accel(veh_id, noise=True, failsafe=False),
-                    #"target_accel_no_noise_with_failsafe": kv.get_accel(veh_id, noise=False, failsafe=True),
-                    
-                    "shock_time": int(kv.get_shock_time(veh_id)), # If kernel vehicle is ModifiedIDMController
-                    "realized_accel": kv.get_realized_accel(veh_id),
-                    #"road_grade": kv.get_road_grade(veh_id),
-                    "distance_traveled": kv.get_distance(veh_id),
-                    "fuel_consumption": kv.get_fuel_consumption(veh_id),
-                })
+                # The order must match EMISSION_COLUMNS
+                self.emission_writer.add((
+                    t,
+                    veh_id,
+                    kv.get_x_by_id(veh_id), # Is not accurate for bottleneck, do not use.
+                    kv.get_edge(veh_id),
+                    kv.get_speed(veh_id),
+                    kv.get_headway(veh_id),
+                    kv.get_leader(veh_id),
+                    kv.get_accel(veh_id, noise=True, failsafe=False),
+                    kv.get_realized_accel(veh_id),
+                    kv.get_distance(veh_id),
+                    kv.get_follower(veh_id),
+                    kv.get_fuel_consumption(veh_id),
+                    int(kv.get_shock_time(veh_id)), # If kernel vehicle is ModifiedIDMController
+                ))
+            self.emission_writer.step()
 
     def close(self):
         """See parent class."""
-        # Save the emission data to a csv.
+        global _libsumo_owner
+
+        # Save the emission data to an emission file.
         if self.emission_path is not None:
             self.save_emission()
 
         self.kernel_api.close()
+        if _get_libsumo_owner() is self:
+            _libsumo_owner = None
 
     def check_collision(self):
         """See parent class."""
@@ -168,11 +173,22 @@ class TraCISimulation(KernelSimulation):
         # Save the simulation step size (for later use).
         self.sim_step = sim_params.sim_step
 
+        # Collect the parameters of the emission writer.
+        self.emission_format = getattr(sim_params, "emission_format", "csv")
+        self.emission_flush_interval = getattr(
+            sim_params, "emission_flush_interval", 100)
+
         # Update the emission path term.
         self.emission_path = sim_params.emission_path
         if self.emission_path is not None:
             ensure_dir(self.emission_path)
 
+        # run sumo in the same process through libsumo, if requested
+        if getattr(sim_params, "use_libsumo", False):
+            kernel_api = self._start_libsumo(network, sim_params)
+            if kernel_api is not None:
+                return kernel_api
+
         error = None
         for _ in range(RETRIES_ON_ERROR):
             try:
@@ -189,56 +205,7 @@ class TraCISimulation(KernelSimulation):
                     "--num-clients", str(sim_params.num_clients),
                     "--step-length", str(sim_params.sim_step)
                 ]
-
-                # use a ballistic integration step (if request)
-                if sim_params.use_ballistic:
-                    sumo_call.append("--step-method.ballistic")
-
-                # ignore step logs (if requested)
-                if sim_params.no_step_log:
-                    sumo_call.append("--no-step-log")
-
-                # add the lateral resolution of the sublanes (if requested)
-                if sim_params.lateral_resolution is not None:
-                    sumo_call.append("--lateral-resolution")
-                    sumo_call.append(str(sim_params.lateral_resolution))
-
-                if sim_params.overtake_right:
-                    sumo_call.append("--lanechange.overtake-right")
-                    sumo_call.append("true")
-
-                # specify a simulation seed (if requested)
-                if sim_params.seed is not None:
-                    sumo_call.append("--seed")
-                    sumo_call.append(str(sim_params.seed))
-
-                if not sim_params.print_warnings:
-                    sumo_call.append("--no-warnings")
-                    sumo_call.append("true")
-
-                # set the time it takes for a gridlock teleport to occur
-                sumo_call.append("--time-to-teleport")
-                sumo_call.append(str(int(sim_params.teleport_time)))
-
-                # check collisions at intersections
-                sumo_call.append("--collision.check-junctions")
-                sumo_call.append("true")
-
-                # Bibek: Modifications from Michael
-                sumo_call.append("--start")
-                sumo_call.append("true")
-
-                sumo_call.append("--quit-on-end")
-                sumo_call.append("true")
-                
-                #Bibek: Test
-                sumo_call.append("--collision.action")
-                sumo_call.append("warn") # Can be [none,warn,teleport,remove]
-
-                #sumo_call.append("--ignore-accidents")
-                #sumo_call.append("true")
-
-                # End test 
+                sumo_call.extend(self._get_sumo_options(sim_params))
 
                 logging.info(" Starting SUMO on port " + str(port))
                 logging.debug(" Cfg file: " + str(network.cfg))
@@ -272,76 +239,186 @@ class TraCISimulation(KernelSimulation):
                 self.teardown_sumo()
         raise error
 
+    def _get_sumo_options(self, sim_params):
+        """Return the command line options passed to sumo on startup.
+
+        These are shared by the socket-based (TraCI) and in-process (libsumo)
+        simulation instances.
+
+        Parameters
+        ----------
+        sim_params : flow.core.params.SumoParams
+            simulation-specific parameters
+
+        Returns
+        -------
+        list of str
+            the sumo command line options
+        """
+        sumo_call = []
+
+        # use a ballistic integration step (if request)
+        if sim_params.use_ballistic:
+            sumo_call.append("--step-method.ballistic")
+
+        # ignore step logs (if requested)
+        if sim_params.no_step_log:
+            sumo_call.append("--no-step-log")
+
+        # add the lateral resolution of the sublanes (if requested)
+        if sim_params.lateral_resolution is not None:
+            sumo_call.append("--lateral-resolution")
+            sumo_call.append(str(sim_params.lateral_resolution))
+
+        if sim_params.overtake_right:
+            sumo_call.append("--lanechange.overtake-right")
+            sumo_call.append("true")
+
+        # specify a simulation seed (if requested)
+        if sim_params.seed is not None:
+            sumo_call.append("--seed")
+            sumo_call.append(str(sim_params.seed))
+
+        if not sim_params.print_warnings:
+            sumo_call.append("--no-warnings")
+            sumo_call.append("true")
+
+        # set the time it takes for a gridlock teleport to occur
+        sumo_call.append("--time-to-teleport")
+        sumo_call.append(str(int(sim_params.teleport_time)))
+
+        # check collisions at intersections
+        sumo_call.append("--collision.check-junctions")
+        sumo_call.append("true")
+
+        # Bibek: Modifications from Michael
+        sumo_call.append("--start")
+        sumo_call.append("true")
+
+        sumo_call.append("--quit-on-end")
+        sumo_call.append("true")
+        
+        #Bibek: Test
+        sumo_call.append("--collision.action")
+        sumo_call.append("warn") # Can be [none,warn,teleport,remove]
+
+        #sumo_call.append("--ignore-accidents")
+        #sumo_call.append("true")
+
+        # End test
+
+        return sumo_call
+
+    def _start_libsumo(self, network, sim_params):
+        """Start a sumo simulation instance in the current process.
+
+        The simulation is driven through libsumo, which exposes the same
+        interface as a traci connection without serializing every command
+        over a socket. Since libsumo cannot run the sumo gui, the socket-based
+        instance is used instead when rendering with sumo-gui, or if libsumo
+        is not installed, or if libsumo is already running the simulation of
+        another environment of this process (e.g. several environments per
+        RLlib worker).
+
+        Returns
+        -------
+        module or None
+            the libsumo module, used as the kernel api, or None if the
+            simulation should be started with traci instead
+        """
+        if sim_params.render is True:
+            logging.warning(" libsumo does not support sumo-gui, falling "
+                            "back to traci.")
+            return None
+
+        try:
+            import libsumo
+        except ImportError:
+            logging.warning(" libsumo is not available, falling back to "
+                            "traci.")
+            return None
+
+        global _libsumo_owner
+        owner = _get_libsumo_owner()
+        if owner is not None and owner is not self:
+            logging.warning(" libsumo is already running the simulation of "
+                            "another environment, falling back to traci.")
+            return None
+
+        sumo_call = [
+            "sumo", "-c", network.cfg,
+            "--step-length", str(sim_params.sim_step)
+        ]
+        sumo_call.extend(self._get_sumo_options(sim_params))
+
+        logging.info(" Starting SUMO through libsumo")
+        logging.debug(" Cfg file: " + str(network.cfg))
+        logging.debug(" Emission file: " + str(self.emission_path))
+        logging.debug(" Step length: " + str(sim_params.sim_step))
+
+        # close the previous instance of this kernel (when restarting), or an
+        # instance whose kernel was garbage collected without being closed
+        if owner is self or (_libsumo_owner is not None and owner is None):
+            try:
+                libsumo.close()
+            except Exception:
+                pass
+
+        libsumo.start(sumo_call)
+        libsumo.simulationStep()
+        _libsumo_owner = weakref.ref(self)
+
+        self.sumo_proc = None
+        return libsumo
+
     def teardown_sumo(self):
         """Kill the sumo subprocess instance."""
+        if self.sumo_proc is None:
+            # sumo is running in this process through libsumo
+            return
         try:
             os.killpg(self.sumo_proc.pid, signal.SIGTERM)
         except Exception as e:
             print("Error during teardown: {}".format(e))
 
     def save_emission(self, run_id=0):
-        """Save any collected emission data to a csv file.
+        """Save any collected emission data to an emission file.
 
-        If not data was collected, nothing happens. Moreover, any internally
-        stored data by this class is clear whenever data is stored.
+        If not data was collected, nothing happens. Most of the data has
+        already been written to disk while the simulation ran; this method
+        writes the remaining data and moves it to the emission file. Data
+        collected afterwards is written to a new file.
 
         Parameters
         ----------
         run_id : int
             the rollout number, appended to the name of the emission file. Used
             to store emission files from multiple rollouts run sequentially.
+
+        Returns
+        -------
+        str or None
+            path of the emission file, or None if no data was collected
         """
         # If there is no stored data, ignore this operation. This is to ensure
         # that data isn't deleted if the operation is called twice.
-        if len(self.stored_data) == 0:
-            return
-
-        # Get a csv name for the emission file.
-        name = "{}-{}_emission.csv".format(
-            self.master_kernel.network.network.name, run_id)
-
-        # The name of all stored data-points (excluding id and time)
-        # Bibek: Need to change here as well
-        stored_ids = [
-            "x",
-            "edge",
-            "speed",
-            "space_headway",
-            "leader_id",
-            #"target_accel_with_noise_with_failsafe",
-            #"target_accel_no_noise_no_failsafe",
-            "target_accel_with_noise_no_failsafe",
-            #"target_accel_no_noise_with_failsafe",
-            "realized_accel",
-            #"target_accel_with_noise_with_failsafe",
-            #"road_grade",
-            #"edge_id",
-            #"lane_number",
-            "distance_traveled",
-            #"relative_position",
-            "follower_id",
-            #"leader_rel_speed",
-            "fuel_consumption",
-            "shock_time"
-        ]
-
-        # Update the stored data to push to the csv file.
-        final_data = {"time": [], "id": []}
-        final_data.update({key: [] for key in stored_ids})
-
-        for veh_id in self.stored_data.keys():
-            for t in self.stored_data[veh_id].keys():
-                final_data['time'].append(t)
-                final_data['id'].append(veh_id)
-                for key in stored_ids:
-                    final_data[key].append(self.stored_data[veh_id][t][key])
-
-        with open(os.path.join(self.emission_path, name), "w") as f:
-            print(os.path.join(self.emission_path, name), self.emission_path)
-            writer = csv.writer(f, delimiter=',')
-            writer.writerow(final_data.keys())
-            writer.writerows(zip(*final_data.values()))
-
-        # Clear all memory from the stored data. This is useful if this
-        # function is called in between resets.
-        self.stored_data.clear()
+        if self.emission_writer is None:
+            return None
+        if self.emission_writer.num_rows == 0:
+            self.emission_writer.discard()
+            self.emission_writer = None
+            return None
+
+        # Get a name for the emission file.
+        name = "{}-{}_emission.{}".format(
+            self.master_kernel.network.network.name, run_id,
+            EMISSION_FORMATS[self.emission_writer.fmt])
+
+        path = os.path.join(self.emission_path, name)
+        print(path, self.emission_path)
+        self.emission_writer.close(path)
+
+        # Start a new file if this function is called in between resets.
+        self.emission_writer = None
+
+        return path
@@ -0,0 +1,274 @@
+"""Script containing the geometry index used for bottleneck local zones.
+
+In the bottleneck, the absolute position of vehicles does not account for the
+length of the zipper junctions, where lanes merge, and the lanes before and
+after a zipper are not numbered alike. The geometry of the network (where the
+zippers are, how long they are, and which lanes they merge) is compiled once
+from the edge starts and the connections of the network (see
+BottleneckGeometry). It maps the (edge, lane, position) of any vehicle to a
+corrected longitudinal position, and the (edge, lane) of any vehicle to the
+lanes its local zone covers.
+
+At every step, vehicles are bucketed by lane and sorted by corrected position
+(see BottleneckZoneIndex), after which the local zone of any vehicle is found
+with a binary search per covered lane, instead of a scan over every vehicle in
+the network.
+"""
+from bisect import bisect_left, bisect_right
+
+
+class BottleneckGeometry(object):
+    """Compiled geometry of the zippers of a network.
+
+    Attributes
+    ----------
+    zippers : dict
+        Key = id of every zipper junction, i.e. every internal edge in which
+        lanes merge
+        Element = id of the edge downstream of the zipper
+    shifts : dict
+        Key = id of every edge (not junction)
+        Element = length of the zippers upstream of the edge, added to the
+        positions of vehicles on the edge
+    zipper_starts : dict
+        Key = id of every zipper junction
+        Element = corrected position of the start of the zipper
+    """
+
+    def __init__(self, network):
+        """Compile the geometry of a network.
+
+        Parameters
+        ----------
+        network : flow.core.kernel.network.BaseKernelNetwork
+            the network kernel
+        """
+        self.network = network
+        edge_starts = network.total_edgestarts_dict
+        edges = network.get_edge_list()
+        junctions = network.get_junction_list()
+
+        # the edge downstream of every junction, and the base edge of every
+        # edge or junction: the edge itself, or the edge downstream of a
+        # junction
+        self._base = {edge: edge for edge in edges}
+        for junction in junctions:
+            following = self._first_next(junction)
+            self._base[junction] = following[0] if following else junction
+
+        # the edge after every edge, possibly through a junction
+        self._next = {}
+        for edge in edges:
+            following = self._first_next(edge)
+            if following and following[0] in self._base:
+                self._next[edge] = self._base[following[0]]
+
+        # the (edge, lane) pair every lane of a junction leads to
+        self._lane_targets = {}
+        self.zippers = {}
+        for junction in junctions:
+            targets = {}
+            for lane in range(max(network.num_lanes(junction), 0)):
+                following = network.next_edge(junction, lane)
+                if len(following) > 0:
+                    targets[lane] = following[0]
+            self._lane_targets[junction] = targets
+            if len(set(targets.values())) < len(targets) \
+                    and self._base[junction] in edge_starts:
+                self.zippers[junction] = self._base[junction]
+
+        self.shifts = {}
+        for edge in edges:
+            if edge not in edge_starts:
+                continue
+            self.shifts[edge] = sum(
+                network.edge_length(zipper)
+                for zipper, downstream in self.zippers.items()
+                if edge_starts[downstream] <= edge_starts[edge])
+        self.zipper_starts = {
+            zipper: edge_starts[downstream] + self.shifts[downstream]
+            - network.edge_length(zipper)
+            for zipper, downstream in self.zippers.items()}
+
+        # edges and junctions that are not zippers, by base edge
+        self._members = {}
+        for edge in edges + junctions:
+            if edge not in self.zippers:
+                self._members.setdefault(self._base[edge], []).append(edge)
+
+        self._zone_lanes = {}
+
+    def _first_next(self, edge):
+        """Return the edge following an edge in any of its lanes."""
+        for lane in range(max(self.network.num_lanes(edge), 0)):
+            following = self.network.next_edge(edge, lane)
+            if len(following) > 0:
+                return following[0]
+        return None
+
+    def _merged_lanes(self, zipper, lane):
+        """Return the lanes of a zipper that merge with one of its lanes."""
+        targets = self._lane_targets[zipper]
+        if lane not in targets:
+            return []
+        return [other for other, target in targets.items()
+                if target == targets[lane]]
+
+    def corrected_position(self, edge, lane_position, x):
+        """Return the corrected longitudinal position of a vehicle.
+
+        Parameters
+        ----------
+        edge : str
+            edge or junction of the vehicle
+        lane_position : float
+            position of the vehicle on its edge
+        x : float
+            absolute position of the vehicle (see get_x_by_id)
+
+        Returns
+        -------
+        float
+            the position of the vehicle, including the length of the zippers
+            upstream of it
+        """
+        if edge in self.zippers:
+            return self.zipper_starts[edge] + lane_position
+        return x + self.shifts.get(edge, 0)
+
+    def zone_lanes(self, edge, lane):
+        """Return the lanes covered by the local zone of a vehicle.
+
+        - A vehicle in a zipper sees the vehicles in the lanes of the zipper
+          that merge with its own, and in the lane these lanes merge into.
+        - Any other vehicle sees the vehicles in the same lane of its edge
+          and of the next edge (as well as of the junctions leading to
+          them), and in the lanes of the zipper leading to the next edge
+          that merge with the lane it would take.
+
+        Parameters
+        ----------
+        edge : str
+            edge or junction of the vehicle
+        lane : int
+            lane of the vehicle
+
+        Returns
+        -------
+        list of (str, int)
+            the covered (edge, lane) pairs
+        """
+        key = (edge, lane)
+        if key in self._zone_lanes:
+            return self._zone_lanes[key]
+
+        if edge in self.zippers:
+            lanes = [(edge, other) for other in
+                     self._merged_lanes(edge, lane)]
+            if lane in self._lane_targets[edge]:
+                lanes.append(self._lane_targets[edge][lane])
+        else:
+            base = self._base.get(edge, edge)
+            following = self._next.get(base)
+            lanes = [(member, lane) for member in self._members.get(base, [])]
+            if following is not None:
+                lanes += [(member, lane)
+                          for member in self._members.get(following, [])]
+                for via, via_lane in self.network.next_edge(base, lane):
+                    if self.zippers.get(via) == following:
+                        lanes += [(via, other) for other in
+                                  self._merged_lanes(via, via_lane)]
+
+        # the lane of the vehicle itself is always covered
+        if key not in lanes:
+            lanes.insert(0, key)
+
+        self._zone_lanes[key] = lanes
+        return lanes
+
+
+class BottleneckZoneIndex(object):
+    """Vehicles bucketed by lane and sorted by corrected position.
+
+    Attributes
+    ----------
+    geometry : BottleneckGeometry
+        the geometry of the network
+    positions : dict
+        corrected position of every vehicle, by vehicle id
+    """
+
+    def __init__(self, geometry, veh_ids, edges, lanes, lane_positions, xs):
+        """Build the index.
+
+        Parameters
+        ----------
+        geometry : BottleneckGeometry
+            the geometry of the network
+        veh_ids : list of str
+            ids of the vehicles
+        edges : list of str
+            edge of every vehicle. Vehicles without an edge (e.g. vehicles
+            that collided) keep their absolute position, and are not part of
+            any local zone
+        lanes : list of int
+            lane of every vehicle
+        lane_positions : list of float
+            position of every vehicle on its edge
+        xs : list of float
+            absolute position of every vehicle
+        """
+        self.geometry = geometry
+        self.positions = {}
+        self._where = {}
+        buckets = {}
+        for veh_id, edge, lane, lane_pos, x in zip(
+                veh_ids, edges, lanes, lane_positions, xs):
+            if not edge:
+                self.positions[veh_id] = x
+                continue
+            position = geometry.corrected_position(edge, lane_pos, x)
+            self.positions[veh_id] = position
+            self._where[veh_id] = (edge, lane)
+            buckets.setdefault((edge, lane), []).append((position, veh_id))
+
+        # Key = (edge, lane), Element = (positions, ids) sorted by position
+        self._buckets = {}
+        for key, bucket in buckets.items():
+            bucket.sort(key=lambda item: item[0])
+            self._buckets[key] = ([item[0] for item in bucket],
+                                  [item[1] for item in bucket])
+
+    def query(self, veh_id, distance):
+        """Return the vehicles in the local zone of a vehicle.
+
+        Parameters
+        ----------
+        veh_id : str
+            id of the vehicle
+        distance : float
+            length of the local zone, ahead of the vehicle
+
+        Returns
+        -------
+        list of str
+            ids of the vehicles in the lanes covered by the local zone (see
+            BottleneckGeometry.zone_lanes) whose corrected position is within
+            distance ahead of the vehicle, including the vehicle itself,
+            sorted by corrected position
+        """
+        if veh_id not in self._where:
+            return []
+        x_position = self.positions[veh_id]
+
+        found = []
+        for key in self.geometry.zone_lanes(*self._where[veh_id]):
+            if key not in self._buckets:
+                continue
+            positions, ids = self._buckets[key]
+            start = bisect_left(positions, x_position)
+            end = bisect_right(positions, x_position + distance)
+            found.extend(zip(positions[start:end], ids[start:end]))
+
+        found.sort(key=lambda item: item[0])
+        return [item[1] for item in found]
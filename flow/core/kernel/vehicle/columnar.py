@@ -0,0 +1,186 @@
+"""Script containing the columnar vehicle state store.
+
+The store keeps the per-step state of every vehicle in the network in a set of
+NumPy arrays ("columns") indexed by a stable vehicle slot. Slots are assigned
+when a vehicle departs and released when it arrives, so that the state of all
+vehicles can be gathered for a single step with one fancy-indexing operation
+instead of one or two dictionary lookups per vehicle.
+"""
+import numpy as np
+
+# default value stored in numeric columns for missing information, matching
+# the default "error" values returned by the vehicle kernel getters
+MISSING = -1001
+
+# name and dtype of every column held by the store. All columns are float64,
+# like the arrays built from the scalar getters when the store is disabled
+# (see TraCIVehicle.get_state_array), so that both return the same values
+COLUMNS = [
+    ('speed', np.float64),
+    ('previous_speed', np.float64),
+    ('position', np.float64),
+    ('x', np.float64),
+    ('headway', np.float64),
+    ('lane', np.float64),
+    ('length', np.float64),
+    ('distance', np.float64),
+    ('fuel_consumption', np.float64),
+]
+
+
+class ColumnarVehicleState(object):
+    """Array-backed store of per-vehicle state.
+
+    Attributes
+    ----------
+    capacity : int
+        number of slots currently allocated in every column. The columns are
+        doubled in size whenever a vehicle departs and no slot is free.
+    columns : dict of str: numpy.ndarray
+        state arrays, indexed by the slot of each vehicle
+    active : numpy.ndarray of bool
+        whether a vehicle currently occupies each slot
+    """
+
+    def __init__(self, capacity=64):
+        """Instantiate the store.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            initial number of slots
+        """
+        self.capacity = max(1, int(capacity))
+        self.columns = {
+            name: np.full(self.capacity, MISSING, dtype=dtype)
+            for name, dtype in COLUMNS}
+        self.active = np.zeros(self.capacity, dtype=bool)
+
+        # vehicle id -> slot, and slot -> vehicle id
+        self._slots = {}
+        self._ids = [None] * self.capacity
+        # slots released by arriving vehicles, reused by departing ones
+        self._free = list(range(self.capacity - 1, -1, -1))
+
+    def __len__(self):
+        """Return the number of vehicles currently in the store."""
+        return len(self._slots)
+
+    def __contains__(self, veh_id):
+        """Return whether a vehicle is currently in the store."""
+        return veh_id in self._slots
+
+    def clear(self):
+        """Release all slots."""
+        for column in self.columns.values():
+            column.fill(MISSING)
+        self.active.fill(False)
+        self._slots.clear()
+        self._ids = [None] * self.capacity
+        self._free = list(range(self.capacity - 1, -1, -1))
+
+    def add(self, veh_id):
+        """Assign a slot to a vehicle, and return it.
+
+        If the vehicle already has a slot, the existing slot is returned.
+        """
+        slot = self._slots.get(veh_id)
+        if slot is not None:
+            return slot
+
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self._slots[veh_id] = slot
+        self._ids[slot] = veh_id
+        self.active[slot] = True
+        return slot
+
+    def remove(self, veh_id):
+        """Release the slot of a vehicle, if it has one."""
+        slot = self._slots.pop(veh_id, None)
+        if slot is None:
+            return
+        for column in self.columns.values():
+            column[slot] = MISSING
+        self.active[slot] = False
+        self._ids[slot] = None
+        self._free.append(slot)
+
+    def _grow(self):
+        """Double the number of slots in every column."""
+        old_capacity = self.capacity
+        self.capacity *= 2
+        for name, column in self.columns.items():
+            new_column = np.full(self.capacity, MISSING, dtype=column.dtype)
+            new_column[:old_capacity] = column
+            self.columns[name] = new_column
+        active = np.zeros(self.capacity, dtype=bool)
+        active[:old_capacity] = self.active
+        self.active = active
+        self._ids.extend([None] * (self.capacity - old_capacity))
+        # keep the lowest slots at the end of the list, so they are used first
+        self._free = list(range(self.capacity - 1, old_capacity - 1, -1)) + \
+            self._free
+
+    def slot(self, veh_id):
+        """Return the slot of a vehicle, or -1 if it is not in the store."""
+        return self._slots.get(veh_id, -1)
+
+    def slots(self, veh_ids=None):
+        """Return the slots of a list of vehicles.
+
+        Parameters
+        ----------
+        veh_ids : list of str, optional
+            vehicle ids. If not specified, the slots of all vehicles currently
+            in the store are returned, in increasing order.
+
+        Returns
+        -------
+        numpy.ndarray
+            slot of each vehicle, -1 for vehicles that are not in the store
+        """
+        if veh_ids is None:
+            return np.flatnonzero(self.active)
+        get = self._slots.get
+        return np.fromiter((get(veh_id, -1) for veh_id in veh_ids),
+                           dtype=np.int64, count=len(veh_ids))
+
+    def ids(self, slots=None):
+        """Return the ids of the vehicles in a set of slots.
+
+        If slots is not specified, the ids of all vehicles currently in the
+        store are returned, in the same order as ``slots()``.
+        """
+        if slots is None:
+            slots = self.slots()
+        return [self._ids[slot] for slot in slots]
+
+    def set(self, name, slots, values):
+        """Write values of a column in bulk."""
+        self.columns[name][slots] = values
+
+    def get(self, name, veh_ids=None):
+        """Return the values of a column for a list of vehicles.
+
+        Parameters
+        ----------
+        name : str
+            name of the column
+        veh_ids : list of str, optional
+            vehicle ids. If not specified, the values of all vehicles
+            currently in the store are returned, in the order of ``ids()``.
+
+        Returns
+        -------
+        numpy.ndarray
+            the requested values. Vehicles that are not in the store are
+            given the value MISSING.
+        """
+        column = self.columns[name]
+        slots = self.slots(veh_ids)
+        values = column[slots]
+        if veh_ids is not None:
+            values[slots < 0] = MISSING
+        return values
@@ -0,0 +1,81 @@
+"""Script containing the bounded history of the inflows and outflows.
+
+The inflow and outflow rates of a network are computed over the number of
+vehicles that departed (resp. arrived) during the last time-steps. Instead of
+keeping the number of every time-step since the last reset, and summing the
+last ones at every query, the counter keeps the running totals of a bounded
+number of time-steps in a ring buffer, so that:
+
+* memory is bounded by the longest time span queried (see FlowCounter), and
+* the number of vehicles over any time span is the difference of two running
+  totals, in O(1) however many time spans are queried (e.g. 20 time-steps for
+  the observations and 500 seconds for the evaluation).
+"""
+
+
+class FlowCounter(object):
+    """Running totals of a count over the last time-steps.
+
+    Attributes
+    ----------
+    capacity : int
+        maximum number of time-steps counts are summed over
+    num_steps : int
+        number of time-steps added since the last reset
+    """
+
+    def __init__(self, capacity):
+        """Instantiate the counter.
+
+        Parameters
+        ----------
+        capacity : int
+            maximum number of time-steps counts are summed over. Longer spans
+            are limited to the last capacity time-steps
+        """
+        self.capacity = max(1, int(capacity))
+        # running total after every one of the last capacity + 1 time-steps,
+        # the extra total being the one before the oldest time-step
+        self._totals = [0] * (self.capacity + 1)
+        self._last = 0
+        self.num_steps = 0
+
+    def __len__(self):
+        """Return the number of time-steps the counts can be summed over."""
+        return min(self.num_steps, self.capacity)
+
+    def reset(self):
+        """Clear the counts of all time-steps."""
+        self._totals = [0] * (self.capacity + 1)
+        self._last = 0
+        self.num_steps = 0
+
+    def append(self, count):
+        """Add the count of a new time-step."""
+        total = self._totals[self.num_steps % len(self._totals)]
+        self.num_steps += 1
+        self._totals[self.num_steps % len(self._totals)] = total + count
+        self._last = count
+
+    def last(self):
+        """Return the count of the last time-step, or 0 if there is none."""
+        return self._last
+
+    def sum(self, num_steps):
+        """Return the sum of the counts of the last time-steps.
+
+        Parameters
+        ----------
+        num_steps : int
+            number of time-steps, limited to the number of time-steps
+            available (see __len__)
+
+        Returns
+        -------
+        int or float
+            the sum of the counts
+        """
+        num_steps = min(num_steps, len(self))
+        size = len(self._totals)
+        return self._totals[self.num_steps % size] - \
+            self._totals[(self.num_steps - num_steps) % size]
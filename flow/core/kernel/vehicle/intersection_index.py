@@ -0,0 +1,153 @@
+"""Script containing the distance index used for intersection local zones.
+
+In the intersection, the local zone of a vehicle contains the vehicles ahead
+of it on the same approach, i.e. on the edges of its route and the junction
+links between them, ordered by the distance they traveled. The approaches
+(edge groups) are derived once from the routes and the connections of the
+network (see EdgeGroups), so that they generalize to any network whose routes
+do not cross each other's edges.
+
+At every step, vehicles are grouped by approach and sorted by distance
+traveled (see DistanceIndex), after which the local zone of any vehicle is
+found with a binary search, in O(log n + k) for k vehicles in the zone.
+"""
+from bisect import bisect_right
+
+
+class EdgeGroups(object):
+    """Approaches of a network, derived from its routes.
+
+    Every route forms a group with the junction links between its successive
+    edges. Routes sharing edges are merged into a single group.
+
+    Attributes
+    ----------
+    network : flow.core.kernel.network.BaseKernelNetwork
+        the network kernel the groups were derived from
+    groups : dict
+        Key = id of every edge or junction link that is part of a route
+        Element = id of its group (an int)
+    """
+
+    def __init__(self, network):
+        """Derive the groups of a network from its routes.
+
+        Parameters
+        ----------
+        network : flow.core.kernel.network.BaseKernelNetwork
+            the network kernel
+        """
+        self.network = network
+        self.groups = {}
+        num_groups = 0
+
+        for route_choices in network.rts.values():
+            for route, _ in route_choices:
+                members = self._route_members(route)
+                existing = {self.groups[edge] for edge in members
+                            if edge in self.groups}
+                if len(existing) > 0:
+                    group = min(existing)
+                    # merge the groups of routes sharing edges with this one
+                    for edge, other in list(self.groups.items()):
+                        if other in existing:
+                            self.groups[edge] = group
+                else:
+                    group = num_groups
+                    num_groups += 1
+                for edge in members:
+                    self.groups[edge] = group
+
+    def _route_members(self, route):
+        """Return the edges of a route and the junction links between them."""
+        members = list(route)
+        for edge, following in zip(route[:-1], route[1:]):
+            for lane in range(max(self.network.num_lanes(edge), 0)):
+                for link, link_lane in self.network.next_edge(edge, lane):
+                    if link[0] != ":" or link in members:
+                        continue
+                    # only the links leading to the next edge of the route
+                    if any(target == following for target, _ in
+                           self.network.next_edge(link, link_lane)):
+                        members.append(link)
+        return members
+
+
+class DistanceIndex(object):
+    """Vehicles grouped by approach and sorted by distance traveled.
+
+    Attributes
+    ----------
+    edge_groups : EdgeGroups
+        the approaches of the network
+    """
+
+    def __init__(self, edge_groups, veh_ids, edges, distances):
+        """Build the index.
+
+        Parameters
+        ----------
+        edge_groups : EdgeGroups
+            the approaches of the network
+        veh_ids : list of str
+            ids of the vehicles
+        edges : list of str
+            edge of every vehicle. Vehicles on an edge that is not part of an
+            approach are not indexed
+        distances : list of float
+            distance traveled by every vehicle
+        """
+        self.edge_groups = edge_groups
+        self._distances = {}
+        buckets = {}
+        for veh_id, edge, distance in zip(veh_ids, edges, distances):
+            group = edge_groups.groups.get(edge)
+            if group is None:
+                continue
+            self._distances[veh_id] = distance
+            buckets.setdefault(group, []).append((distance, veh_id))
+
+        # Key = group, Element = (distances, ids) sorted by distance
+        self._buckets = {}
+        for group, bucket in buckets.items():
+            bucket.sort(key=lambda item: item[0])
+            self._buckets[group] = ([item[0] for item in bucket],
+                                    [item[1] for item in bucket])
+
+    def query(self, veh_id, edge, distance):
+        """Return the vehicles in the local zone of a vehicle.
+
+        Parameters
+        ----------
+        veh_id : str
+            id of the vehicle
+        edge : str
+            edge of the vehicle
+        distance : float
+            length of the local zone, ahead of the vehicle
+
+        Returns
+        -------
+        list of str
+            the vehicle, followed by the vehicles of its approach that
+            traveled more than it, by at most distance, sorted by distance
+            traveled
+
+        Raises
+        ------
+        ValueError
+            if the edge of the vehicle is not part of an approach
+        """
+        group = self.edge_groups.groups.get(edge)
+        if group is None:
+            # We end up here if the vehicle has exited the network. But this function is still getting called.
+            print(f"Edge not recognized: {edge}")
+            raise ValueError("Edge not recognized")
+
+        veh_distance = self._distances[veh_id]
+        distances, ids = self._buckets[group]
+        start = bisect_right(distances, veh_distance)
+        end = bisect_right(distances, veh_distance + distance)
+
+        # Sorted in the order, RL + everyone in front starting from the closest
+        return [veh_id] + ids[start:end]
@@ -0,0 +1,137 @@
+"""Script containing the lane index used for multi-lane headway queries.
+
+The index keeps the vehicles of every lane of every edge sorted by position
+from one step to the next. Instead of being rebuilt and sorted from scratch at
+every step, it is updated from the vehicles that left the network or their
+lane (arrivals, moves to another edge, lane changes), the vehicles that
+entered a lane (departures, moves, lane changes), and the new positions of the
+vehicles that stayed in their lane. As vehicles rarely overtake one another
+within a lane, the order of a lane is restored with an insertion sort, in
+linear time for nearly sorted lanes.
+"""
+from bisect import bisect_right
+
+
+def _insertion_sort(ids, positions):
+    """Sort vehicle ids and positions in place, by position.
+
+    The sort is stable, and linear in the number of vehicles if only a few of
+    them are out of order.
+    """
+    for i in range(1, len(positions)):
+        pos = positions[i]
+        if positions[i - 1] <= pos:
+            continue
+        veh_id = ids[i]
+        j = i - 1
+        while j >= 0 and positions[j] > pos:
+            positions[j + 1] = positions[j]
+            ids[j + 1] = ids[j]
+            j -= 1
+        positions[j + 1] = pos
+        ids[j + 1] = veh_id
+
+
+class LaneIndex(object):
+    """Vehicles of every lane of the network, sorted by position.
+
+    Only lanes with vehicles are stored.
+    """
+
+    def __init__(self):
+        """Instantiate an empty index."""
+        # Key = edge id, Element = dict with, for every lane index with
+        # vehicles, a list [ids, positions] of the vehicle ids and positions
+        # in the lane, sorted by position
+        self._lanes = {}
+        # Key = vehicle id, Element = (edge, lane) of the vehicle
+        self._where = {}
+
+    def __len__(self):
+        """Return the number of vehicles in the index."""
+        return len(self._where)
+
+    def _discard(self, veh_ids):
+        """Remove a set of vehicles from their lanes."""
+        affected = {self._where.pop(veh_id) for veh_id in veh_ids}
+        for edge, lane in affected:
+            entry = self._lanes[edge][lane]
+            keep = [i for i, veh_id in enumerate(entry[0])
+                    if veh_id not in veh_ids]
+            entry[0] = [entry[0][i] for i in keep]
+            entry[1] = [entry[1][i] for i in keep]
+            if len(entry[0]) == 0:
+                del self._lanes[edge][lane]
+                if len(self._lanes[edge]) == 0:
+                    del self._lanes[edge]
+
+    def update(self, states):
+        """Update the index with the state of the vehicles at a new step.
+
+        Parameters
+        ----------
+        states : dict
+            Key = vehicle id of every vehicle in the network
+            Element = tuple (edge, lane, position) of the vehicle. Vehicles
+            with an empty edge (e.g. vehicles that collided) are not indexed
+        """
+        # vehicles that left the network or their lane
+        moved = {veh_id for veh_id, (edge, lane) in self._where.items()
+                 if veh_id not in states
+                 or states[veh_id][0] != edge or states[veh_id][1] != lane}
+        if len(moved) > 0:
+            self._discard(moved)
+
+        # new positions of the vehicles that stayed in their lane
+        for lanes in self._lanes.values():
+            for entry in lanes.values():
+                ids = entry[0]
+                entry[1] = [states[veh_id][2] for veh_id in ids]
+                _insertion_sort(ids, entry[1])
+
+        # vehicles that entered the network or a new lane
+        if len(states) > len(self._where):
+            for veh_id, (edge, lane, pos) in states.items():
+                if veh_id in self._where or not edge:
+                    continue
+                entry = self._lanes.setdefault(edge, {}).setdefault(
+                    lane, [[], []])
+                index = bisect_right(entry[1], pos)
+                entry[0].insert(index, veh_id)
+                entry[1].insert(index, pos)
+                self._where[veh_id] = (edge, lane)
+
+    def remove(self, veh_id):
+        """Remove a vehicle from the index, if it is in it."""
+        if veh_id in self._where:
+            self._discard({veh_id})
+
+    def lane(self, edge, lane):
+        """Return the vehicles in a lane, sorted by position.
+
+        Parameters
+        ----------
+        edge : str
+            edge id
+        lane : int
+            lane index
+
+        Returns
+        -------
+        list of str
+            vehicle ids, sorted by position. Must not be modified
+        list of float
+            positions of the vehicles on the edge, in the same order
+        """
+        entry = self._lanes.get(edge, {}).get(lane)
+        if entry is None:
+            return [], []
+        return entry[0], entry[1]
+
+    def ids_on_edge(self, edge):
+        """Return the ids of the vehicles on an edge.
+
+        The vehicles are sorted by lane index, and by position within a lane.
+        """
+        lanes = self._lanes.get(edge, {})
+        return [veh_id for lane in sorted(lanes) for veh_id in lanes[lane][0]]
@@ -12,9 +12,17 @@ from flow.controllers.rlcontroller import RLController
 from flow.controllers.car_following_models import IDMController 
 from flow.controllers.controllers_for_daware import ModifiedIDMController # Bibek
 from flow.controllers.lane_change_controllers import SimLaneChangeController
+from flow.core.kernel.vehicle.columnar import ColumnarVehicleState
+from flow.core.kernel.vehicle.flow_counter import FlowCounter
+from flow.core.kernel.vehicle.bottleneck_index import BottleneckGeometry, \
+    BottleneckZoneIndex
+from flow.core.kernel.vehicle.intersection_index import EdgeGroups, \
+    DistanceIndex
+from flow.core.kernel.vehicle.lane_index import LaneIndex
+from flow.core.kernel.vehicle.position_index import SortedPositionIndex
 from bisect import bisect_left
-import itertools
 from copy import deepcopy
+from itertools import islice
 
 # colors for vehicles
 WHITE = (255, 255, 255)
@@ -68,17 +76,23 @@ class TraCIVehicle(KernelVehicle):
         # contain the minGap attribute of each type of vehicle
         self.minGap = {}
 
-        # list of vehicle ids located in each edge in the network
-        self._ids_by_edge = dict()
+        # vehicles of every lane of the network, sorted by position, and
+        # updated incrementally at every step (see _multi_lane_headways)
+        self._lane_index = LaneIndex()
+
+        # number of time-steps the inflow and outflow rates are computed
+        # over at most, bounding the memory used by their history
+        flow_history = getattr(sim_params, "flow_history", 3600)
+        self._flow_capacity = max(1, int(flow_history / self.sim_step))
 
         # number of vehicles that entered the network for every time-step
-        self._num_departed = []
+        self._num_departed = FlowCounter(self._flow_capacity)
         self._departed_ids = 0
 
         # number of vehicles to exit the network for every time-step
-        self._num_arrived = []
+        self._num_arrived = FlowCounter(self._flow_capacity)
         self._arrived_ids = 0
-        self._arrived_rl_ids = []
+        self._arrived_rl_ids = collections.deque(maxlen=self._flow_capacity)
 
         # whether or not to automatically color vehicles
         try:
@@ -90,6 +104,34 @@ class TraCIVehicle(KernelVehicle):
         # old speeds used to compute accelerations
         self.previous_speeds = {}
 
+        # array-backed copy of the per-step vehicle state, used by the
+        # vectorized getters (see get_state_array)
+        if getattr(sim_params, "columnar_state", False):
+            self._columnar = ColumnarVehicleState()
+        else:
+            self._columnar = None
+
+        # whether to retrieve the subscription results of all vehicles in a
+        # single request, see the bulk_subscription attribute of SumoParams
+        self._bulk_subscription = getattr(
+            sim_params, "bulk_subscription", False)
+
+        # vehicles sorted by absolute position, used by the local-zone
+        # methods. Built lazily once per step (see get_position_index)
+        self._position_index = None
+
+        # compiled zipper geometry of the network, built once, and vehicles
+        # bucketed by lane, built lazily once per step, used by the bottleneck
+        # local-zone methods (see get_bottleneck_index)
+        self._bottleneck_geometry = None
+        self._bottleneck_index = None
+
+        # approaches of the network, derived once from its routes, and
+        # vehicles grouped by approach, built lazily once per step, used by
+        # the intersection local-zone methods (see get_intersection_index)
+        self._edge_groups = None
+        self._intersection_index = None
+
     def initialize(self, vehicles):
         """Initialize vehicle state information.
 
@@ -139,10 +181,18 @@ class TraCIVehicle(KernelVehicle):
         # copy over the previous speeds
 
         vehicle_obs = {}
-        for veh_id in self.__ids:
-            self.previous_speeds[veh_id] = self.get_speed(veh_id)
-            vehicle_obs[veh_id] = \
-                self.kernel_api.vehicle.getSubscriptionResults(veh_id)
+        if self._bulk_subscription:
+            # retrieve the results of all vehicles at once, and only keep the
+            # vehicles that are known to the kernel
+            all_obs = self.kernel_api.vehicle.getAllSubscriptionResults()
+            for veh_id in self.__ids:
+                self.previous_speeds[veh_id] = self.get_speed(veh_id)
+                vehicle_obs[veh_id] = all_obs.get(veh_id)
+        else:
+            for veh_id in self.__ids:
+                self.previous_speeds[veh_id] = self.get_speed(veh_id)
+                vehicle_obs[veh_id] = \
+                    self.kernel_api.vehicle.getSubscriptionResults(veh_id)
         sim_obs = self.kernel_api.simulation.getSubscriptionResults()
 
         arrived_rl_ids = []
@@ -170,6 +220,11 @@ class TraCIVehicle(KernelVehicle):
                 # is already in the class; its state data just needs to be
                 # updated
                 pass
+            elif self._bulk_subscription:
+                # the type of the vehicle is read from the subscription
+                # results, saving a separate request to the simulator
+                obs = self._subscribe(veh_id)
+                obs = self._add_departed(veh_id, obs[tc.VAR_TYPE], obs)
             else:
                 veh_type = self.kernel_api.vehicle.getTypeID(veh_id)
                 obs = self._add_departed(veh_id, veh_type)
@@ -184,8 +239,8 @@ class TraCIVehicle(KernelVehicle):
             for veh_id in self.__rl_ids:
                 self.__vehicles[veh_id]["last_lc"] = -float("inf")
                 self.prev_last_lc[veh_id] = -float("inf")
-            self._num_departed.clear()
-            self._num_arrived.clear()
+            self._num_departed.reset()
+            self._num_arrived.reset()
             self._departed_ids = 0
             self._arrived_ids = 0
             self._arrived_rl_ids.clear()
@@ -259,13 +314,105 @@ class TraCIVehicle(KernelVehicle):
         # update the sumo observations variable
         self.__sumo_obs = vehicle_obs.copy()
 
+        # positions have changed, so the position indices must be rebuilt
+        self._position_index = None
+        self._bottleneck_index = None
+        self._intersection_index = None
+
         # update the lane leaders data for each vehicle
         self._multi_lane_headways()
 
         # make sure the rl vehicle list is still sorted
         self.__rl_ids.sort()
 
-    def _add_departed(self, veh_id, veh_type):
+        # fill the columnar state store in bulk
+        if self._columnar is not None:
+            self._update_columnar()
+
+    def _update_columnar(self):
+        """Copy the state of all vehicles into the columnar store.
+
+        This is done once per step, after which the vectorized getters can
+        gather the state of any set of vehicles with a single indexing
+        operation.
+        """
+        store = self._columnar
+        ids = self.__ids
+        num_vehicles = len(ids)
+        slots = np.fromiter((store.add(veh_id) for veh_id in ids),
+                            dtype=np.int64, count=num_vehicles)
+
+        empty = {}
+        obs = [self.__sumo_obs.get(veh_id) or empty for veh_id in ids]
+        vehicles = [self.__vehicles.get(veh_id, empty) for veh_id in ids]
+
+        def _column(values):
+            return np.fromiter(values, dtype=np.float64, count=num_vehicles)
+
+        store.set("speed", slots, _column(
+            o.get(tc.VAR_SPEED, -1001) for o in obs))
+        store.set("previous_speed", slots, _column(
+            self.previous_speeds.get(veh_id, -1001) for veh_id in ids))
+        store.set("position", slots, _column(
+            o.get(tc.VAR_LANEPOSITION, -1001) for o in obs))
+        store.set("lane", slots, _column(
+            o.get(tc.VAR_LANE_INDEX, -1001) for o in obs))
+        store.set("distance", slots, _column(
+            o.get(tc.VAR_DISTANCE, -1001) for o in obs))
+        store.set("fuel_consumption", slots, _column(
+            o.get(tc.VAR_FUELCONSUMPTION, -1001) for o in obs))
+        store.set("headway", slots, _column(
+            v.get("headway", -1001) for v in vehicles))
+        store.set("length", slots, _column(
+            v.get("length", -1001) for v in vehicles))
+        store.set("x", slots, self._get_x_array(ids))
+
+    def resubscribe(self):
+        """Subscribe again to the variables of all vehicles in the network.
+
+        Loading a saved simulation state (see flow.core.warmup_cache) removes
+        the subscriptions to the vehicles. The subscription results of the
+        current step are kept, and new results are available after the next
+        simulation step.
+        """
+        for veh_id in self.__ids:
+            self._subscribe(veh_id)
+
+    def _subscribe(self, veh_id):
+        """Subscribe to the variables of a vehicle.
+
+        Parameters
+        ----------
+        veh_id: str
+            name of the vehicle
+
+        Returns
+        -------
+        dict
+            subscription results from the vehicle at the current time step
+        """
+        variables = [
+            tc.VAR_LANE_INDEX, tc.VAR_LANEPOSITION,
+            tc.VAR_ROAD_ID,
+            tc.VAR_SPEED,
+            tc.VAR_EDGES,
+            tc.VAR_POSITION,
+            tc.VAR_ANGLE,
+            tc.VAR_SPEED_WITHOUT_TRACI,
+            tc.VAR_FUELCONSUMPTION,
+            tc.VAR_DISTANCE
+        ]
+        if self._bulk_subscription:
+            # constant parameters, so that they do not need to be requested
+            # separately when the vehicle departs
+            variables += [tc.VAR_TYPE, tc.VAR_LENGTH]
+
+        self.kernel_api.vehicle.subscribe(veh_id, variables)
+        self.kernel_api.vehicle.subscribeLeader(veh_id, 2000)
+
+        return self.kernel_api.vehicle.getSubscriptionResults(veh_id)
+
+    def _add_departed(self, veh_id, veh_type, obs=None):
         """Add a vehicle that entered the network from an inflow or reset.
 
         Parameters
@@ -274,6 +421,10 @@ class TraCIVehicle(KernelVehicle):
             name of the vehicle
         veh_type: str
             type of vehicle, as specified to sumo
+        obs: dict, optional
+            subscription results of the vehicle, if it was already subscribed
+            to (see _subscribe). The initial state of the vehicle is then read
+            from these results instead of being requested from the simulator.
 
         Returns
         -------
@@ -330,22 +481,15 @@ class TraCIVehicle(KernelVehicle):
                     self.__controlled_lc_ids.append(veh_id)
 
         # subscribe the new vehicle
-        self.kernel_api.vehicle.subscribe(veh_id, [
-            tc.VAR_LANE_INDEX, tc.VAR_LANEPOSITION,
-            tc.VAR_ROAD_ID,
-            tc.VAR_SPEED,
-            tc.VAR_EDGES,
-            tc.VAR_POSITION,
-            tc.VAR_ANGLE,
-            tc.VAR_SPEED_WITHOUT_TRACI,
-            tc.VAR_FUELCONSUMPTION,
-            tc.VAR_DISTANCE
-        ])
-        self.kernel_api.vehicle.subscribeLeader(veh_id, 2000)
+        if obs is None:
+            self._subscribe(veh_id)
 
         # some constant vehicle parameters to the vehicles class
-        self.__vehicles[veh_id]["length"] = self.kernel_api.vehicle.getLength(
-            veh_id)
+        if obs is not None and tc.VAR_LENGTH in obs:
+            self.__vehicles[veh_id]["length"] = obs[tc.VAR_LENGTH]
+        else:
+            self.__vehicles[veh_id]["length"] = \
+                self.kernel_api.vehicle.getLength(veh_id)
 
         # set the "last_lc" parameter of the vehicle
         self.__vehicles[veh_id]["last_lc"] = -float("inf")
@@ -365,23 +509,28 @@ class TraCIVehicle(KernelVehicle):
         self.kernel_api.vehicle.setLaneChangeMode(veh_id, lc_mode)
 
         # get initial state info
-        self.__sumo_obs[veh_id] = dict()
-        self.__sumo_obs[veh_id][tc.VAR_ROAD_ID] = \
-            self.kernel_api.vehicle.getRoadID(veh_id)
-        self.__sumo_obs[veh_id][tc.VAR_LANEPOSITION] = \
-            self.kernel_api.vehicle.getLanePosition(veh_id)
-        self.__sumo_obs[veh_id][tc.VAR_LANE_INDEX] = \
-            self.kernel_api.vehicle.getLaneIndex(veh_id)
-        self.__sumo_obs[veh_id][tc.VAR_SPEED] = \
-            self.kernel_api.vehicle.getSpeed(veh_id)
-        self.__sumo_obs[veh_id][tc.VAR_FUELCONSUMPTION] = \
-            self.kernel_api.vehicle.getFuelConsumption(veh_id)
+        if obs is not None:
+            self.__sumo_obs[veh_id] = dict(obs)
+        else:
+            self.__sumo_obs[veh_id] = dict()
+            self.__sumo_obs[veh_id][tc.VAR_ROAD_ID] = \
+                self.kernel_api.vehicle.getRoadID(veh_id)
+            self.__sumo_obs[veh_id][tc.VAR_LANEPOSITION] = \
+                self.kernel_api.vehicle.getLanePosition(veh_id)
+            self.__sumo_obs[veh_id][tc.VAR_LANE_INDEX] = \
+                self.kernel_api.vehicle.getLaneIndex(veh_id)
+            self.__sumo_obs[veh_id][tc.VAR_SPEED] = \
+                self.kernel_api.vehicle.getSpeed(veh_id)
+            self.__sumo_obs[veh_id][tc.VAR_FUELCONSUMPTION] = \
+                self.kernel_api.vehicle.getFuelConsumption(veh_id)
 
         # make sure that the order of rl_ids is kept sorted
         self.__rl_ids.sort()
         self.num_rl_vehicles = len(self.__rl_ids)
 
         # get the subscription results from the new vehicle
+        if obs is not None:
+            return obs
         new_obs = self.kernel_api.vehicle.getSubscriptionResults(veh_id)
 
         return new_obs
@@ -407,6 +556,14 @@ class TraCIVehicle(KernelVehicle):
         if veh_id in self.__sumo_obs:
             del self.__sumo_obs[veh_id]
 
+        if self._columnar is not None:
+            self._columnar.remove(veh_id)
+
+        self._position_index = None
+        self._bottleneck_index = None
+        self._intersection_index = None
+        self._lane_index.remove(veh_id)
+
         # remove it from all other id lists (if it is there)
         if veh_id in self.__human_ids:
             self.__human_ids.remove(veh_id)
@@ -497,28 +654,31 @@ class TraCIVehicle(KernelVehicle):
         """See parent class."""
         if isinstance(edges, (list, np.ndarray)):
             return sum([self.get_ids_by_edge(edge) for edge in edges], [])
-        return self._ids_by_edge.get(edges, []) or []
+        return self._lane_index.ids_on_edge(edges)
+
+    def _flow_rate(self, counter, time_span):
+        """Return the rate (in veh/hr) of a count over a time span.
+
+        Time spans shorter than a time-step cover the whole history, and
+        longer time spans than the history are limited to it.
+        """
+        if len(counter) == 0:
+            return 0
+        num_steps = min(int(time_span / self.sim_step) or len(counter),
+                        len(counter))
+        return 3600 * counter.sum(num_steps) / (num_steps * self.sim_step)
 
     def get_inflow_rate(self, time_span):
         """See parent class."""
-        if len(self._num_departed) == 0:
-            return 0
-        num_inflow = self._num_departed[-int(time_span / self.sim_step):]
-        return 3600 * sum(num_inflow) / (len(num_inflow) * self.sim_step)
+        return self._flow_rate(self._num_departed, time_span)
 
     def get_outflow_rate(self, time_span):
         """See parent class."""
-        if len(self._num_arrived) == 0:
-            return 0
-        num_outflow = self._num_arrived[-int(time_span / self.sim_step):]
-        return 3600 * sum(num_outflow) / (len(num_outflow) * self.sim_step)
+        return self._flow_rate(self._num_arrived, time_span)
 
     def get_num_arrived(self):
         """See parent class."""
-        if len(self._num_arrived) > 0:
-            return self._num_arrived[-1]
-        else:
-            return 0
+        return self._num_arrived.last()
 
     def get_arrived_ids(self):
         """See parent class."""
@@ -528,7 +688,8 @@ class TraCIVehicle(KernelVehicle):
         """See parent class."""
         if len(self._arrived_rl_ids) > 0:
             arrived = []
-            for arr in self._arrived_rl_ids[-k:]:
+            for arr in reversed(list(islice(reversed(self._arrived_rl_ids),
+                                            k))):
                 arrived.extend(arr)
             return arrived
         else:
@@ -724,39 +885,22 @@ class TraCIVehicle(KernelVehicle):
         This includes the lane leaders/followers/headways/tailways/
         leader velocity/follower velocity for all
         vehicles in the network.
+
+        The lane index (see flow.core.kernel.vehicle.lane_index.LaneIndex) is
+        first updated with the new edges, lanes and positions of the vehicles.
         """
-        edge_list = self.master_kernel.network.get_edge_list()
-        junction_list = self.master_kernel.network.get_junction_list()
-        tot_list = edge_list + junction_list
         num_edges = (len(self.master_kernel.network.get_edge_list()) + len(
             self.master_kernel.network.get_junction_list()))
 
-        # maximum number of lanes in the network
-        max_lanes = max([self.master_kernel.network.num_lanes(edge_id)
-                         for edge_id in tot_list])
-
-        # Key = edge id
-        # Element = list, with the ith element containing tuples with the name
-        #           and position of all vehicles in lane i
-        edge_dict = dict.fromkeys(tot_list)
-
-        # add the vehicles to the edge_dict element
-        for veh_id in self.get_ids():
-            edge = self.get_edge(veh_id)
-            lane = self.get_lane(veh_id)
-            pos = self.get_position(veh_id)
-            if edge:
-                if edge_dict[edge] is None:
-                    edge_dict[edge] = [[] for _ in range(max_lanes)]
-                edge_dict[edge][lane].append((veh_id, pos))
-
-        # sort all lanes in each edge by position
-        for edge in tot_list:
-            if edge_dict[edge] is None:
-                del edge_dict[edge]
-            else:
-                for lane in range(max_lanes):
-                    edge_dict[edge][lane].sort(key=lambda x: x[1])
+        # update the vehicles sorted by position in each lane
+        empty = {}
+        states = {}
+        for veh_id in self.__ids:
+            obs = self.__sumo_obs.get(veh_id) or empty
+            states[veh_id] = (obs.get(tc.VAR_ROAD_ID, ''),
+                              obs.get(tc.VAR_LANE_INDEX, -1001),
+                              obs.get(tc.VAR_LANEPOSITION, -1001))
+        self._lane_index.update(states)
 
         for veh_id in self.get_rl_ids():
             # collect the lane leaders, followers, headways, and tailways for
@@ -764,8 +908,7 @@ class TraCIVehicle(KernelVehicle):
             edge = self.get_edge(veh_id)
             if edge:
                 headways, tailways, leaders, followers = \
-                    self._multi_lane_headways_util(veh_id, edge_dict,
-                                                   num_edges)
+                    self._multi_lane_headways_util(veh_id, num_edges)
 
                 # add the above values to the vehicles class
                 self.set_lane_headways(veh_id, headways)
@@ -773,28 +916,15 @@ class TraCIVehicle(KernelVehicle):
                 self.set_lane_leaders(veh_id, leaders)
                 self.set_lane_followers(veh_id, followers)
 
-        self._ids_by_edge = dict().fromkeys(edge_list)
-
-        for edge_id in edge_dict:
-            edges = list(itertools.chain.from_iterable(edge_dict[edge_id]))
-            # check for edges with no vehicles
-            if len(edges) > 0:
-                edges, _ = zip(*edges)
-                self._ids_by_edge[edge_id] = list(edges)
-            else:
-                self._ids_by_edge[edge_id] = []
-
-    def _multi_lane_headways_util(self, veh_id, edge_dict, num_edges):
+    def _multi_lane_headways_util(self, veh_id, num_edges):
         """Compute multi-lane data for the specified vehicle.
 
         Parameters
         ----------
         veh_id : str
             name of the vehicle
-        edge_dict : dict < list<tuple> >
-            Key = Edge name
-                Index = lane index
-                Element = list sorted by position of (vehicle id, position)
+        num_edges : int
+            number of edges and junctions in the network
 
         Returns
         -------
@@ -804,12 +934,6 @@ class TraCIVehicle(KernelVehicle):
         tailway : list<float>
             Index = lane index
             Element = tailway at this lane
-        lead_speed : list<str>
-            Index = lane index
-            Element = speed of leader at this lane
-        follow_speed : list<str>
-            Index = lane index
-            Element = speed of follower at this lane
         leader : list<str>
             Index = lane index
             Element = leader at this lane
@@ -830,10 +954,8 @@ class TraCIVehicle(KernelVehicle):
 
         for lane in range(num_lanes):
             # check the vehicle's current  edge for lane leaders and followers
-            if len(edge_dict[this_edge][lane]) > 0:
-                ids, positions = zip(*edge_dict[this_edge][lane])
-                ids = list(ids)
-                positions = list(positions)
+            ids, positions = self._lane_index.lane(this_edge, lane)
+            if len(ids) > 0:
                 index = bisect_left(positions, this_pos)
 
                 # if you are at the end or the front of the edge, the lane
@@ -861,16 +983,16 @@ class TraCIVehicle(KernelVehicle):
             # if lane leader not found, check next edges
             if leader[lane] == "":
                 headway[lane], leader[lane] = self._next_edge_leaders(
-                    veh_id, edge_dict, lane, num_edges)
+                    veh_id, lane, num_edges)
 
             # if lane follower not found, check previous edges
             if follower[lane] == "":
                 tailway[lane], follower[lane] = self._prev_edge_followers(
-                    veh_id, edge_dict, lane, num_edges)
+                    veh_id, lane, num_edges)
 
         return headway, tailway, leader, follower
 
-    def _next_edge_leaders(self, veh_id, edge_dict, lane, num_edges):
+    def _next_edge_leaders(self, veh_id, lane, num_edges):
         """Search for leaders in the next edge.
 
         Looks to the edges/junctions in front of the vehicle's current edge
@@ -899,15 +1021,11 @@ class TraCIVehicle(KernelVehicle):
             add_length += self.master_kernel.network.edge_length(edge)
             edge, lane = self.master_kernel.network.next_edge(edge, lane)[0]
 
-            try:
-                if len(edge_dict[edge][lane]) > 0:
-                    leader = edge_dict[edge][lane][0][0]
-                    headway = edge_dict[edge][lane][0][1] - pos + add_length \
-                        - self.get_length(leader)
-            except KeyError:
-                # current edge has no vehicles, so move on
-                # print(traceback.format_exc())
-                continue
+            ids, positions = self._lane_index.lane(edge, lane)
+            if len(ids) > 0:
+                leader = ids[0]
+                headway = positions[0] - pos + add_length \
+                    - self.get_length(leader)
 
             # stop if a lane follower is found
             if leader != "":
@@ -915,7 +1033,7 @@ class TraCIVehicle(KernelVehicle):
 
         return headway, leader
 
-    def _prev_edge_followers(self, veh_id, edge_dict, lane, num_edges):
+    def _prev_edge_followers(self, veh_id, lane, num_edges):
         """Search for followers in the previous edge.
 
         Looks to the edges/junctions behind the vehicle's current edge for
@@ -944,15 +1062,11 @@ class TraCIVehicle(KernelVehicle):
             edge, lane = self.master_kernel.network.prev_edge(edge, lane)[0]
             add_length += self.master_kernel.network.edge_length(edge)
 
-            try:
-                if len(edge_dict[edge][lane]) > 0:
-                    tailway = pos - edge_dict[edge][lane][-1][1] + add_length \
-                              - self.get_length(veh_id)
-                    follower = edge_dict[edge][lane][-1][0]
-            except KeyError:
-                # current edge has no vehicles, so move on
-                # print(traceback.format_exc())
-                continue
+            ids, positions = self._lane_index.lane(edge, lane)
+            if len(ids) > 0:
+                tailway = pos - positions[-1] + add_length \
+                    - self.get_length(veh_id)
+                follower = ids[-1]
 
             # stop if a lane follower is found
             if follower != "":
@@ -1026,12 +1140,26 @@ class TraCIVehicle(KernelVehicle):
     def get_x_by_id(self, veh_id):
         """See parent class."""
         if isinstance(veh_id, (list, np.ndarray)):
-            return [self.get_x_by_id(vehID) for vehID in veh_id]
-        if self.get_edge(veh_id) == '':
+            return self._get_x_array(veh_id).tolist()
+        edge = self.get_edge(veh_id)
+        if edge == '':
             # occurs when a vehicle crashes is teleported for some other reason
             return 0.
         return self.master_kernel.network.get_x(
-            self.get_edge(veh_id), self.get_position(veh_id))
+            edge, self.get_position(veh_id))
+
+    def _get_x_array(self, veh_ids):
+        """Return the absolute positions of a set of vehicles as an array.
+
+        The positions are computed by the network in a single vectorized
+        operation (see get_x_array of the network kernel).
+        """
+        edges = self.get_edge(list(veh_ids))
+        x = self.master_kernel.network.get_x_array(
+            edges, self.get_position(list(veh_ids)))
+        # occurs when a vehicle crashes is teleported for some other reason
+        x[[i for i, edge in enumerate(edges) if edge == '']] = 0.
+        return x
 
     def update_vehicle_colors(self):
         """See parent class.
@@ -1186,40 +1314,90 @@ class TraCIVehicle(KernelVehicle):
         return 0
     
     # Bibek: I wrote the things below
-    def get_local_density(self, veh_id, current_length, distance, direction='front', error = None):
-        """
-        Getting local density. In a circular track, the position resets to 0.
-        Returns local density in veh/m
-        """
-        position = self.get_x_by_id(veh_id) 
-        #length = self.get_length(veh_id)
-
-        # get Vehicle IDs
-        veh_ids = self.kernel_api.vehicle.getIDList()
-
-        # vehicle positions
-        vehicle_pos = [self.get_x_by_id(item) for item in veh_ids] 
+    def get_state_array(self, name, veh_ids=None):
+        """Return a state variable of a set of vehicles as an array.
 
-        # vehicle positions in the range of interest
-        if direction == 'front':
-            position_bound = [position, position + distance]
-            if position_bound[1]>=current_length:
-                position_bound = [position, current_length, (position + distance - current_length)] 
+        If the columnar state store is enabled (see the `columnar_state`
+        attribute of SumoParams), the values are gathered from the store in a
+        single operation. Otherwise, they are collected from the scalar
+        getters of this class.
 
-                num_vehicles = np.sum([1 if (pos>=position_bound[0] and pos<=position_bound[1]) |\
-                    (pos>0.0 and pos<=position_bound[2]) else 0 for pos in vehicle_pos])
+        Parameters
+        ----------
+        name : str
+            one of "speed", "previous_speed", "position", "x", "headway",
+            "lane", "length", "distance", or "fuel_consumption"
+        veh_ids : list of str, optional
+            vehicle ids. Defaults to all vehicles in the network, in the order
+            of `get_ids()`.
 
-            else: 
-                num_vehicles = np.sum([1 if pos>=position_bound[0] and pos<=position_bound[1] else 0 for pos in vehicle_pos])
-        else: 
-            position_bound = [position - distance, position]
-            if position_bound[0]<=0:
-                position_bound = [0.0, position, current_length - (distance - position)]
+        Returns
+        -------
+        numpy.ndarray
+            the value of the state variable for every vehicle. Vehicles
+            without a value are given -1001.
+        """
+        if veh_ids is None:
+            veh_ids = self.__ids
+
+        if self._columnar is not None:
+            return self._columnar.get(name, veh_ids)
+        if name == "x":
+            return self._get_x_array(veh_ids)
+
+        getters = {
+            "speed": self.get_speed,
+            "previous_speed": self.get_previous_speed,
+            "position": self.get_position,
+            "x": self.get_x_by_id,
+            "headway": self.get_headway,
+            "lane": self.get_lane,
+            "length": self.get_length,
+            "distance": self.get_distance,
+            "fuel_consumption": self.get_fuel_consumption,
+        }
+        if name not in getters:
+            raise KeyError("Unknown vehicle state variable: {}".format(name))
+        getter = getters[name]
+        return np.array([getter(veh_id) for veh_id in veh_ids],
+                        dtype=np.float64)
+
+    def get_speed_array(self, veh_ids=None):
+        """Return the speeds of a set of vehicles as an array."""
+        return self.get_state_array("speed", veh_ids)
+
+    def get_position_array(self, veh_ids=None):
+        """Return the lane positions of a set of vehicles as an array."""
+        return self.get_state_array("position", veh_ids)
+
+    def get_x_array(self, veh_ids=None):
+        """Return the absolute positions of a set of vehicles as an array."""
+        return self.get_state_array("x", veh_ids)
+
+    def get_headway_array(self, veh_ids=None):
+        """Return the headways of a set of vehicles as an array."""
+        return self.get_state_array("headway", veh_ids)
+
+    def get_lane_array(self, veh_ids=None):
+        """Return the lane indices of a set of vehicles as an array."""
+        return self.get_state_array("lane", veh_ids)
+
+    def get_leader_speed_array(self, veh_ids=None):
+        """Return the speeds of the leaders of a set of vehicles.
+
+        Vehicles without a leader are given -1001.
+        """
+        if veh_ids is None:
+            veh_ids = self.__ids
+        leaders = [self.get_leader(veh_id) or "" for veh_id in veh_ids]
+        return self.get_state_array("speed", leaders)
 
-                num_vehicles = np.sum([1 if (pos>=position_bound[0] and pos<=position_bound[1]) |\
-                    (pos>position_bound[2] and pos<=current_length) else 0 for pos in vehicle_pos])
-            else: 
-                num_vehicles = np.sum([1 if pos>=position_bound[0] and pos<=position_bound[1] else 0 for pos in vehicle_pos])
+    def get_local_density(self, veh_id, current_length, distance, direction='front', error = None):
+        """
+        Getting local density. In a circular track, the position resets to 0.
+        Returns local density in veh/km (number of vehicles in the zone, normalized by the zone length)
+        """
+        num_vehicles = self.get_num_veh_local_zone(veh_id, current_length, distance, direction)
 
         local_density = num_vehicles*1000/ distance 
         # veh/km : Normalize over local zone? vs Normalize over network length?
@@ -1302,184 +1480,88 @@ class TraCIVehicle(KernelVehicle):
         self.__rl_ids.sort()
         self.num_rl_vehicles = len(self.__rl_ids)
 
+    def get_position_index(self):
+        """Return the index of all vehicles sorted by absolute position.
+
+        The index is built at most once per simulation step, the first time a
+        local-zone query is made after the vehicles have moved.
+
+        Returns
+        -------
+        flow.core.kernel.vehicle.position_index.SortedPositionIndex
+            the position index
+        """
+        if self._position_index is None:
+            veh_ids = list(self.__ids)
+            self._position_index = SortedPositionIndex(
+                veh_ids, self.get_x_array(veh_ids))
+        return self._position_index
+
     def get_veh_list_local_zone(self, veh_id, current_length, distance, direction='front', error = None):
         """
-        Getting local density. In a circular track, the position resets to 0.
-        Returns local density in veh/m
+        Getting the list of vehicles in the local zone (including veh_id). In a circular track, the position resets to 0.
+        Vehicles are returned in the order of get_ids()
         """
         position = self.get_x_by_id(veh_id) 
-        #length = self.get_length(veh_id)
-
-        # get Vehicle IDs
-        veh_ids = self.kernel_api.vehicle.getIDList()
-
-        # vehicle positions
-        vehicle_pos = [self.get_x_by_id(item) for item in veh_ids] 
-
-        # vehicle positions in the range of interest
-        if direction == 'front':
-            position_bound = [position, position + distance]
-            if position_bound[1]>=current_length:
-                position_bound = [position, current_length, (position + distance - current_length)] 
-
-                veh_selected = [veh_ids[i] if (vehicle_pos[i]>=position_bound[0] and vehicle_pos[i]<=position_bound[1]) |\
-                    (vehicle_pos[i]>0.0 and vehicle_pos[i]<=position_bound[2]) else 0 for i in range(len(vehicle_pos))]
-
-            else: 
-                veh_selected = [veh_ids[i] if vehicle_pos[i]>=position_bound[0] and vehicle_pos[i]<=position_bound[1] else 0 for i in range(len(vehicle_pos))]
-        else: 
-            position_bound = [position - distance, position]
-            if position_bound[0]<=0:
-                position_bound = [0.0, position, current_length - (distance - position)]
-
-                veh_selected = [veh_ids[i] if (vehicle_pos[i]>=position_bound[0] and vehicle_pos[i]<=position_bound[1]) |\
-                    (vehicle_pos[i]>position_bound[2] and vehicle_pos[i]<=current_length) else 0 for i in range(len(vehicle_pos))]
-            else: 
-                veh_selected = [veh_ids[i] if vehicle_pos[i]>=position_bound[0] and vehicle_pos[i]<=position_bound[1] else 0 for i in range(len(vehicle_pos))]
-
-        # filter zeros
-        veh_selected = list(filter(lambda a: a != 0, veh_selected))
-        return veh_selected
-        
+        return self.get_position_index().query(position, current_length, distance, direction)
+
     def get_num_veh_local_zone(self, veh_id, current_length, distance, direction='front', error = None):
         """
-        Getting local density. In a circular track, the position resets to 0.
-        Returns local density in veh/m
+        Getting the number of vehicles in the local zone (including veh_id). In a circular track, the position resets to 0.
         """
         position = self.get_x_by_id(veh_id) 
-        #length = self.get_length(veh_id)
-
-        # get Vehicle IDs
-        veh_ids = self.kernel_api.vehicle.getIDList()
-
-        # vehicle positions
-        vehicle_pos = [self.get_x_by_id(item) for item in veh_ids] 
+        return self.get_position_index().count(position, current_length, distance, direction)
 
-        # vehicle positions in the range of interest
-        if direction == 'front':
-            position_bound = [position, position + distance]
-            if position_bound[1]>=current_length:
-                position_bound = [position, current_length, (position + distance - current_length)] 
-
-                num_vehicles = np.sum([1 if (pos>=position_bound[0] and pos<=position_bound[1]) |\
-                    (pos>0.0 and pos<=position_bound[2]) else 0 for pos in vehicle_pos])
-
-            else: 
-                num_vehicles = np.sum([1 if pos>=position_bound[0] and pos<=position_bound[1] else 0 for pos in vehicle_pos])
-        else: 
-            position_bound = [position - distance, position]
-            if position_bound[0]<=0:
-                position_bound = [0.0, position, current_length - (distance - position)]
+    # Stuff for Bottleneck
+    def get_bottleneck_index(self):
+        """Return the index of the vehicles used by the bottleneck local zones.
 
-                num_vehicles = np.sum([1 if (pos>=position_bound[0] and pos<=position_bound[1]) |\
-                    (pos>position_bound[2] and pos<=current_length) else 0 for pos in vehicle_pos])
-            else: 
-                num_vehicles = np.sum([1 if pos>=position_bound[0] and pos<=position_bound[1] else 0 for pos in vehicle_pos])
+        The zipper geometry of the network is compiled the first time (see
+        flow.core.kernel.vehicle.bottleneck_index.BottleneckGeometry), and the
+        vehicles are bucketed by lane at most once per simulation step.
 
-        return num_vehicles
+        Returns
+        -------
+        flow.core.kernel.vehicle.bottleneck_index.BottleneckZoneIndex
+            the bottleneck index
+        """
+        network = self.master_kernel.network
+        if self._bottleneck_geometry is None or \
+                self._bottleneck_geometry.network is not network:
+            self._bottleneck_geometry = BottleneckGeometry(network)
+            self._bottleneck_index = None
+        if self._bottleneck_index is None:
+            veh_ids = list(self.__ids)
+            self._bottleneck_index = BottleneckZoneIndex(
+                self._bottleneck_geometry, veh_ids,
+                self.get_edge(veh_ids), self.get_lane(veh_ids),
+                self.get_position(veh_ids), self.get_x_by_id(veh_ids))
+        return self._bottleneck_index
 
-    # Stuff for Bottleneck
     def corrected_position_zipper(self,):
         """
         To reduce computations:
         Instead of putthing this logic in get_veh_list_local_zone_bottleneck, where every RL vehicle would repeat the same logic,
         We call this function once every time a state is called 
-        """
-
-        # Perform the position offset to all vehicles and store fresh positions in dict
-        # Every RL vehicle calls this.
-        all_ids = self.kernel_api.vehicle.getIDList()
-        position_dict = {}
-        for item in all_ids:
-            position = self.get_x_by_id(item)
-            edge = self.get_edge(item)
-
-            # Inside zipper lane
-            if edge.startswith(":"):
-                lane_position = self.get_position(item)
-                if ":4" in edge:
-                    position = 550 + lane_position 
-                elif ":5" in edge:
-                    position = 550 + 40 + 280 + lane_position
-
-            # After the zipper lanes
-            if edge == "4":
-                position = position + 40 
-
-            if edge == "5":
-                position = position + 80
-            
-            position_dict[item] = position 
-        return position_dict
 
-    def get_veh_list_local_zone_bottleneck(self, veh_id, distance, lane_mapping_dict_outside, lane_mapping_dict_inside,  position_dict):
+        The position of vehicles inside the zippers, and after them, is offset by the length of the zippers.
+        The offsets are compiled once from the network (see get_bottleneck_index). The returned dict must not be modified
         """
-        Need fixes:
-        1. When the RL vehicle itself is in zipper lane
-        2. When the leader/s are in zipper lane
-        3. The position just continues after the zipper lane. For example, position is 550 before zipper, after the vehicle travels 50m inside zipper, position is 551 after zipper lane. 
+        return self.get_bottleneck_index().positions
 
-        Sorting: In increasing distance order from the RL with RL at index 0
-        
-        The mapping of lanes before and after zipper is simple and straightforward.
-        0,1 map to 0, 2,3 map to 1, 4,5 map to 2 and 6,7 map to 3
-        
-        Length of both zippers is 40m
+    def get_veh_list_local_zone_bottleneck(self, veh_id, distance, lane_mapping_dict_outside=None, lane_mapping_dict_inside=None, position_dict=None):
         """
+        Sorting: In increasing distance order from the RL with RL at index 0
 
-        x_position = position_dict[veh_id]
-        veh_lane = self.get_lane(veh_id)
-        veh_edge = self.get_edge(veh_id)
-
-        veh_list = []
-        vehicles_within_lz = [ (item, self.get_edge(item), self.get_lane(item))  for item in position_dict if position_dict[item] >= x_position and position_dict[item] <= x_position + distance]
-        #print(f"ID: {veh_id}:, Vehicles within LZ: {vehicles_within_lz}")
-        # Since the position problem is solved, all cases become a lane problem now. Just do the lane filtering in various cases.
-                                             
-        # Case 1: If the ego RL vehicle itself is in zipper lane (Identified by the edge id starting with `:`)
-        # Then get the x_position by adding the distance to the zipper and lane position
-        # When the RL ego vehicle is in zipper lane: position= -1001 (useless)
-        # lane= 0, 5, 7 (based on the edge before the zipper lane) 
-        # edge= :4_0 or :5_0 (always :4_0 for first zipper)
-        if veh_edge in lane_mapping_dict_inside.keys(): # They keys should be for for inside edges
-            veh_list = []
-            for item, item_edge, item_lane in vehicles_within_lz:
-                #print(f"Item: {item}, Edge: {self.get_edge(item)}, Lane: {self.get_lane(item)}")
-                # Vehicles inside: i.e., among all vehicles in vehicles_within_lz with edge :4, lane 0 or lane 1 .. simiarly according to mapping
-                # If RL and the vehicle both have 4: or 5:
-                if item_edge == veh_edge and item_lane in lane_mapping_dict_inside[veh_edge][veh_lane]: # [current_edge][veh_lane] returns a list with 2 options
-                    veh_list.append(item)
-            
-                # Vehicles outside: Among all vehicles in vehicles_within_lz with edge 4 and lane 0 and such
-                outside_edge = veh_edge[1] # 4 or 5
-                if item_edge == outside_edge and item_lane == lane_mapping_dict_outside[outside_edge][veh_lane]: # If the vehicle is in lane 0 or lane 1, outside the zip, we should look at lane 0
-                    veh_list.append(item)
-
-        else: 
-            # Case 2: If the ego RL vehicle is not in the zipper lane. 
-            for item, item_edge, item_lane in vehicles_within_lz:
-                # Subcase I: Some of the leader/s are in zipper lane (but the RL vehicle is not). 
-                if item_edge in lane_mapping_dict_inside.keys():
-                    # Consider vehicles in the zipper lane according to lane_mapping_dict_inside mapping    
-                    if item_edge[1] == str(int(veh_edge) +1) and item_lane in lane_mapping_dict_inside[item_edge][veh_lane]: # This dict has to be accessed by leader_edge because leader does not have : in this case
-                        veh_list.append(item)
+        Lanes considered (see BottleneckGeometry.zone_lanes):
+        1. When the RL vehicle itself is in zipper lane: the zipper lanes that merge with its own, and the lane they merge into
+        2. Otherwise: the same lane in the current and next edge, and the zipper lanes before the next edge that merge with it
 
-                else:
-                    # Subcase II: Some of the leaders are NOT in zipper lanes that we care about (but still may be in other edges that begin with :, such as :3_0).
-                    if veh_edge.startswith(":"):
-                        veh_edge = veh_edge[1] # so that int operations can be performed
-                    if item_edge.startswith(":"):
-                        item_edge = item_edge[1] 
-
-                    # No mappings, only append if they are in the same lane and edge
-                    if item_edge == veh_edge or item_edge == str(int(veh_edge) +1):
-                        if item_lane == veh_lane:
-                            veh_list.append(item)
-
-        #print(f"Veh list: {veh_list}") 
-        # sort according to x-value
-        veh_list = sorted(veh_list, key=lambda x: position_dict[x])
-        return veh_list
+        The mapping of lanes before and after zipper (e.g. 0,1 map to 0, 2,3 map to 1, 4,5 map to 2 and 6,7 map to 3)
+        is read from the connections of the network, so lane_mapping_dict_outside and lane_mapping_dict_inside are not used anymore.
+        position_dict must be the one returned by corrected_position_zipper at the current step
+        """
+        return self.get_bottleneck_index().query(veh_id, distance)
 
     def get_leader_bottleneck(self, veh_id, lane_mapping_dict_outside, lane_mapping_dict_inside, position_dict, local_zone):
         """
@@ -1498,65 +1580,42 @@ class TraCIVehicle(KernelVehicle):
             return immediate_leader
         
     # Stuff for intersection
+    def get_intersection_index(self):
+        """Return the index of the vehicles used by the intersection local zones.
+
+        The approaches of the network are derived from its routes the first
+        time (see flow.core.kernel.vehicle.intersection_index.EdgeGroups), and
+        the vehicles are grouped by approach at most once per simulation step.
+
+        Returns
+        -------
+        flow.core.kernel.vehicle.intersection_index.DistanceIndex
+            the intersection index
+        """
+        network = self.master_kernel.network
+        if self._edge_groups is None or \
+                self._edge_groups.network is not network:
+            self._edge_groups = EdgeGroups(network)
+            self._intersection_index = None
+        if self._intersection_index is None:
+            veh_ids = list(self.__ids)
+            self._intersection_index = DistanceIndex(
+                self._edge_groups, veh_ids, self.get_edge(veh_ids),
+                [self.get_distance(veh_id) for veh_id in veh_ids])
+        return self._intersection_index
+
     def get_veh_list_local_zone_intersection(self, veh_id, distance):
         """
         get leader and distance, until distance exceeds the distance
         sorting: According to how TSE accepts input? 
 
+        Vehicles that are ahead may not always be in the same edge.
+        Since get_x_by_id can be unreliable, use get_distance instead.
+        The vehicles considered are the ones on the same approach (e.g. left1_0, :center0_0 and left0_0),
+        i.e. on the edges of the same route and the junction links between them (see get_intersection_index)
         """
-        # current vehicles lane
-        #lane = str(self.get_edge(veh_id)) + '_' + str(self.get_lane(veh_id))
-
-        # Vehicles that are ahead may not always be in the same edge.
-        # Since get_x_by_id can be unreliable, use get_distance instead.
-        all_ids = list(self.kernel_api.vehicle.getIDList())
-        #print(f"\nRL ID: {veh_id}, Distance travelled: {self.get_distance(veh_id)}, type = {type(self.get_distance(veh_id))}")
-
-        # Remove the current RL ID from the list
-        # all_ids.remove(veh_id) # Even not removing it, works because of veh_distance > 0
-
-        # Depending on which edge the current vehicle id is, we have 2 cases
-        edge = self.get_edge(veh_id)
-        veh_distance = self.get_distance(veh_id) # distance travelled by the current vehicle
-        
-        distances = {}
-        # If the edge is left0_0 or left1_0
-        if edge == 'left0_0' or edge == 'left1_0' or edge == ':center0_0':
-            # Then we only need to look at vehicles in these edges
-            veh_list = [item for item in all_ids if self.get_edge(item) == 'left0_0' or self.get_edge(item) == 'left1_0' or self.get_edge(item) == ':center0_0']
-            # get the total distance travelled of this vehicle
-            for item in veh_list:
-                distances[item] = self.get_distance(item)
-
-            # Just select the vehicles for which distance travelled - veh_distance <= distance
-            selected_veh_list = [item for item in veh_list if (distances[item] - veh_distance <= distance) and (distances[item] - veh_distance > 0)]
-            # sort according to distance travelled
-            sorted_veh_list = sorted(selected_veh_list, key=lambda x: distances[x])
-        
-        elif edge == 'right0_0' or edge == 'right1_0' or edge == ':center0_2':
-            # Then we only need to look at vehicles in these edges
-            veh_list = [item for item in all_ids if self.get_edge(item) == 'right0_0' or self.get_edge(item) == 'right1_0' or self.get_edge(item) == ':center0_2']
-            
-            # get the total distance travelled of this vehicle
-            for item in veh_list:
-                distances[item] = self.get_distance(item)
-
-            # Just select the vehicles for which distance travelled - veh_distance <= distance
-            selected_veh_list = [item for item in veh_list if (distances[item] - veh_distance <= distance) and (distances[item] - veh_distance > 0)]
-
-            # sort according to distance travelled
-            sorted_veh_list = sorted(selected_veh_list, key=lambda x: distances[x])
-
-        else:
-            # We end up here if the vehicle has exited the network. But this function is still getting called. 
-            print(f"Edge not recognized: {edge}")
-            raise ValueError("Edge not recognized")   
-
-        # Sorted in the order, RL + everyone in front starting from the closest
-        sorted_veh_list.insert(0, veh_id)
-        #print(f"RL ID: {veh_id}, After Sorting: {sorted_veh_list}")
-
-        return sorted_veh_list
+        return self.get_intersection_index().query(
+            veh_id, self.get_edge(veh_id), distance)
 
 
 
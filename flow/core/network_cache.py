@@ -0,0 +1,111 @@
+"""Contains a cache of the networks compiled by sumo's netconvert.
+
+Every time an environment is created or its network is regenerated (e.g. when
+the length of a ring is randomized at every reset), the node, edge, type and
+connection files of the network are compiled into a .net.xml file by
+netconvert, which is then parsed to collect the edges and connections of the
+network. Both steps take seconds, and are repeated by every RLlib worker for
+the same networks.
+
+Since the compiled network is fully determined by the files given to
+netconvert, it is stored once under a hash of their content, along with the
+parsed edges and connections, and reused by later generations of the same
+network. Processes sharing a cache coordinate through file locks, so that a
+network is compiled by a single process while the others wait for it.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+
+from filelock import FileLock
+
+
+def network_key(paths, name):
+    """Return the key of the network compiled from a set of files.
+
+    Parameters
+    ----------
+    paths : list of str
+        paths of the files given to netconvert (node, edge, type and
+        connection files, and netconvert configuration)
+    name : str
+        name of the network. Files are named after the network, and the names
+        are removed from their content, so that networks differing only by
+        their names share the same key
+
+    Returns
+    -------
+    str
+        sha1 hash of the content of the files
+    """
+    sha = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        sha.update(os.path.basename(path).replace(name, "").encode())
+        sha.update(data.replace(name.encode(), b""))
+    return sha.hexdigest()
+
+
+class NetworkCache(object):
+    """Cache of compiled networks, stored in a directory.
+
+    Every network is stored in a sub-directory named after its key, containing
+    the compiled network ("net.xml") and its parsed edges and connections
+    ("net.pkl").
+    """
+
+    def __init__(self, path):
+        """Instantiate the cache.
+
+        Parameters
+        ----------
+        path : str
+            directory of the cache. Created if it does not exist.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, key, net_file, compile_network):
+        """Return the edges and connections of a network, compiling it once.
+
+        Parameters
+        ----------
+        key : str
+            key of the network, see network_key
+        net_file : str
+            path the compiled network (.net.xml) is expected at
+        compile_network : function
+            method compiling the network into net_file, and returning its
+            edges and connections. Only called if the network is not in the
+            cache
+
+        Returns
+        -------
+        dict
+            the edges of the network
+        dict
+            the connections of the network
+        """
+        entry_dir = os.path.join(self.path, key)
+
+        # only one process compiles a given network, the others wait for it
+        with FileLock(entry_dir + ".lock"):
+            if os.path.isdir(entry_dir):
+                shutil.copyfile(os.path.join(entry_dir, "net.xml"), net_file)
+                with open(os.path.join(entry_dir, "net.pkl"), "rb") as f:
+                    return pickle.load(f)
+
+            edges, connections = compile_network()
+
+            # write to a temporary directory first, so that a failure never
+            # leaves a partially written network in the cache
+            tmp_dir = "{}.tmp-{}".format(entry_dir, os.getpid())
+            os.makedirs(tmp_dir, exist_ok=True)
+            shutil.copyfile(net_file, os.path.join(tmp_dir, "net.xml"))
+            with open(os.path.join(tmp_dir, "net.pkl"), "wb") as f:
+                pickle.dump((edges, connections), f)
+            os.rename(tmp_dir, entry_dir)
+
+        return edges, connections
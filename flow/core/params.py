@@ -588,6 +588,63 @@ class SumoParams(SimParams):
         current time step
     use_ballistic: bool, optional
         If true, use a ballistic integration step instead of an euler step
+    columnar_state : bool, optional
+        If true, the vehicle kernel additionally keeps the state of all
+        vehicles in NumPy arrays that are filled once per step, and that back
+        the vectorized getters (e.g. `get_speed_array`). Recommended for
+        networks with many vehicles, such as the bottleneck.
+    bulk_subscription : bool, optional
+        If true, the vehicle kernel collects the subscription results of all
+        vehicles with a single request per step, and reads the type, length
+        and initial state of departing vehicles from their subscription
+        results instead of requesting each of them separately.
+    use_libsumo : bool, optional
+        If true, sumo is run in the current process through libsumo instead of
+        as a subprocess connected to over a socket. This removes the cost of
+        serializing every TraCI command, and the need for a free port. Falls
+        back to TraCI if libsumo is not installed or if render is True.
+    emission_format : str, optional
+        format of the emission files, if an emission path is specified. One
+        of "csv" (the default), "npz", a NumPy archive with one typed array
+        per column, or "columnar", a directory of memory-mappable arrays with
+        categorical vehicle and edge ids. See
+        flow.core.kernel.simulation.emission.load_emission to read them
+    emission_flush_interval : int, optional
+        number of simulation steps between two writes of the emission data to
+        disk. Emission data is streamed to disk while the simulation runs, so
+        memory usage is bounded by the data collected during this interval.
+    warmup_cache : str, optional
+        directory in which the state of the simulation after the warmup steps
+        is cached. The state is keyed by the environment, network, vehicles,
+        inflows and seed, and later resets with the same key load it instead
+        of running the warmup steps again. Not used when emission data is
+        collected, since the rows of the warmup steps would be missing from
+        the emission file. When set, resets with restart_instance keep the
+        seed specified here instead of drawing a new one, since every new
+        seed would be a new key. See flow.core.warmup_cache
+    ring_array : flow.core.kernel.simulation.numpy_ring.RingArray, optional
+        ring array in which the rings of environments using the "numpy"
+        simulator are stored. Environments sharing a ring array can be
+        advanced in lock-step with a single vectorized update (see
+        flow.core.kernel.simulation.numpy_ring.lockstep_simulation_step). A
+        new ring array is created for every environment if not specified.
+        Ring arrays are not copied when the parameters are.
+    network_cache : str, optional
+        directory in which the networks compiled by netconvert are cached,
+        along with their parsed edges and connections. Networks are keyed by
+        the content of their node, edge, type and connection files, and later
+        generations of the same network (e.g. by other workers, or by resets
+        randomizing the length of a ring) reuse them instead of running
+        netconvert again. Processes sharing the directory coordinate through
+        file locks. See flow.core.network_cache
+    flow_history : float, optional
+        longest time span (in seconds) the inflow and outflow rates of the
+        network are computed over. Only the number of vehicles that departed
+        and arrived during this time span is kept, bounding its memory usage.
+        Longer time spans are limited to it.
+    warmup_cache_size : int, optional
+        maximum number of states kept in the warmup cache. The least recently
+        used states are removed when more are stored
     """
 
     def __init__(self,
@@ -609,7 +666,17 @@ class SumoParams(SimParams):
                  teleport_time=-1,
                  num_clients=1,
                  color_by_speed=False,
-                 use_ballistic=False):
+                 use_ballistic=False,
+                 columnar_state=False,
+                 bulk_subscription=False,
+                 use_libsumo=False,
+                 emission_format="csv",
+                 emission_flush_interval=100,
+                 warmup_cache=None,
+                 ring_array=None,
+                 network_cache=None,
+                 flow_history=3600,
+                 warmup_cache_size=16):
         """Instantiate SumoParams."""
         super(SumoParams, self).__init__(
             sim_step, render, restart_instance, emission_path, save_render,
@@ -624,6 +691,16 @@ class SumoParams(SimParams):
         self.num_clients = num_clients
         self.color_by_speed = color_by_speed
         self.use_ballistic = use_ballistic
+        self.columnar_state = columnar_state
+        self.bulk_subscription = bulk_subscription
+        self.use_libsumo = use_libsumo
+        self.emission_format = emission_format
+        self.emission_flush_interval = emission_flush_interval
+        self.warmup_cache = warmup_cache
+        self.ring_array = ring_array
+        self.network_cache = network_cache
+        self.flow_history = flow_history
+        self.warmup_cache_size = warmup_cache_size
 
 
 class EnvParams:
@@ -657,6 +734,12 @@ class EnvParams:
         specifies whether to clip actions from the policy by their range when
         they are inputted to the reward function. Note that the actions are
         still clipped before they are provided to `apply_rl_actions`.
+    batch_controllers : bool, optional
+        specifies whether the acceleration controllers of the same class are
+        dispatched in batches, with a single vectorized call per class (and
+        set of failsafes) per step instead of one call per vehicle. Only
+        controllers implementing `get_accel_batch` (e.g. IDMController) are
+        batched. See flow.controllers.batched
     """
 
     def __init__(self,
@@ -665,7 +748,8 @@ class EnvParams:
                  warmup_steps=0,
                  sims_per_step=1,
                  evaluate=False,
-                 clip_actions=True):
+                 clip_actions=True,
+                 batch_controllers=False):
         """Instantiate EnvParams."""
         self.additional_params = \
             additional_params if additional_params is not None else {}
@@ -674,6 +758,7 @@ class EnvParams:
         self.sims_per_step = sims_per_step
         self.evaluate = evaluate
         self.clip_actions = clip_actions
+        self.batch_controllers = batch_controllers
 
     def get_additional_param(self, key):
         """Return a variable from additional_params."""
@@ -0,0 +1,140 @@
+"""Contains a parallel executor for independent rollouts.
+
+Rollouts of non-RL (or already trained) controllers are independent of each
+other, so they can be run in a pool of worker processes. Every rollout is
+given its own seed, its own sumo port and its own emission sub-directory, so
+that workers do not interfere with each other. Once a rollout is over, its
+emission files are moved into the shared emission directory.
+"""
+import os
+import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def apply_rollout_params(flow_params, seed=None, port=None,
+                         emission_path=None):
+    """Set the seed, port and emission path of a set of flow parameters.
+
+    Parameters
+    ----------
+    flow_params : dict
+        the flow parameters of the rollout. The "sim" entry is modified in
+        place.
+    seed : int, optional
+        seed of the sumo instance. Left unchanged if not specified.
+    port : int, optional
+        port of the sumo instance. Left unchanged if not specified.
+    emission_path : str, optional
+        emission directory of the rollout. Only set if the rollout already
+        generates emission data.
+
+    Returns
+    -------
+    dict
+        the modified flow parameters
+    """
+    sim_params = flow_params["sim"]
+    if seed is not None:
+        sim_params.seed = seed
+    if port is not None:
+        sim_params.port = port
+    if emission_path is not None and sim_params.emission_path is not None:
+        sim_params.emission_path = emission_path
+    return flow_params
+
+
+def _run_rollout(rollout_fn, index, seed, rng_seed, port, emission_path):
+    """Run a single rollout (in a worker process).
+
+    The python and numpy random number generators are seeded first, with the
+    seed of the rollout if specified and with rng_seed otherwise, since
+    forked workers would otherwise all inherit the same random state (e.g.
+    choosing the same ring length).
+    """
+    if seed is not None:
+        rng_seed = seed
+    random.seed(rng_seed)
+    np.random.seed(rng_seed % (2 ** 32))
+
+    rollout_dir = None
+    if emission_path is not None:
+        rollout_dir = os.path.join(emission_path, "rollout_{}".format(index))
+        os.makedirs(rollout_dir, exist_ok=True)
+
+    result = rollout_fn(index=index, seed=seed, port=port,
+                        emission_path=rollout_dir)
+
+    # move the emission files of the rollout to the shared directory
+    if rollout_dir is not None:
+        for item in os.listdir(rollout_dir):
+            if not item.startswith("."):
+                os.replace(os.path.join(rollout_dir, item),
+                           os.path.join(emission_path, item))
+        shutil.rmtree(rollout_dir, ignore_errors=True)
+
+    return result
+
+
+def run_rollouts(rollout_fn,
+                 num_rollouts,
+                 num_workers=None,
+                 seed=None,
+                 base_port=None,
+                 emission_path=None):
+    """Run a number of independent rollouts in parallel.
+
+    Parameters
+    ----------
+    rollout_fn : callable
+        function called as ``rollout_fn(index=i, seed=seed, port=port,
+        emission_path=path)`` that runs the i-th rollout and returns its
+        results (e.g. the info_dict of an Experiment). The seed, port and
+        emission path should be applied to the flow parameters of the
+        rollout, see apply_rollout_params. Must be defined at the module level
+        so that it can be sent to the workers.
+    num_rollouts : int
+        number of rollouts
+    num_workers : int, optional
+        number of worker processes. Defaults to the number of cpus. If 1, the
+        rollouts are run in the current process.
+    seed : int, optional
+        base seed. Rollout i is given the seed ``seed + i``. If not specified,
+        the sumo instances are not seeded, and the random number generators
+        of every rollout are seeded from fresh entropy.
+    base_port : int, optional
+        base sumo port. Rollout i is given the port ``base_port + i``. If not
+        specified, every rollout looks for a free port.
+    emission_path : str, optional
+        shared emission directory. Every rollout writes its emission files to
+        a "rollout_<i>" sub-directory, which are moved to this directory once
+        it is over.
+
+    Returns
+    -------
+    list
+        the results of every rollout, in order
+    """
+    # independent seeds of the random number generators of every rollout,
+    # used if no seed is specified
+    rng_seeds = [int(child.generate_state(1)[0]) for child in
+                 np.random.SeedSequence().spawn(num_rollouts)]
+    jobs = [(index,
+             None if seed is None else seed + index,
+             rng_seeds[index],
+             None if base_port is None else base_port + index)
+            for index in range(num_rollouts)]
+
+    if num_workers == 1:
+        return [_run_rollout(rollout_fn, index, rollout_seed, rng_seed, port,
+                             emission_path)
+                for index, rollout_seed, rng_seed, port in jobs]
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_run_rollout, rollout_fn, index,
+                                   rollout_seed, rng_seed, port,
+                                   emission_path)
+                   for index, rollout_seed, rng_seed, port in jobs]
+        return [future.result() for future in futures]
@@ -0,0 +1,180 @@
+"""Contains the aggregation of vehicles into segments of the network.
+
+Macroscopic observations and controllers (e.g. the observations of
+flow.envs.BottleneckDesiredVelocityEnv, or the ramp meter of
+flow.envs.BottleneckEnv) split every edge of interest into segments, and
+every segment into its lanes, and aggregate the vehicles in each of the
+resulting cells: their number, the sum of their speeds, etc.
+
+The aggregator assigns every vehicle to its cell with a single binary search
+over the segment boundaries of all edges (see SegmentAggregator.cells), after
+which any statistic of the cells is computed with a single weighted count
+(see SegmentAggregator.aggregate), and the vehicles of every cell are grouped
+with a single stable sort (see SegmentAggregator.members).
+"""
+import numpy as np
+
+
+class SegmentAggregator(object):
+    """Aggregation of vehicles into (edge, segment, lane) cells.
+
+    Cells are numbered edge by edge, in the order of the edges, and for every
+    edge segment by segment, and lane by lane in every segment, i.e. in the
+    order of the flattened (segment, lane) array of every edge.
+
+    Attributes
+    ----------
+    edges : list of str
+        the edges split into segments
+    num_segments : list of int
+        number of segments of every edge
+    num_lanes : list of int
+        number of lanes of every edge
+    offsets : list of int
+        index of the first cell of every edge
+    num_cells : int
+        total number of cells
+    """
+
+    def __init__(self, edges, slices, num_lanes):
+        """Instantiate the aggregator.
+
+        Parameters
+        ----------
+        edges : list of str
+            the edges split into segments
+        slices : list of array_like
+            boundaries of the segments of every edge, starting at the start
+            of the edge and ending at its end (e.g. np.linspace(0, length,
+            num_segments + 1))
+        num_lanes : list of int
+            number of lanes of every edge
+        """
+        self.edges = list(edges)
+        self.num_segments = [len(bounds) - 1 for bounds in slices]
+        self.num_lanes = list(num_lanes)
+        self.offsets = []
+        self.num_cells = 0
+        for num_segments, lanes in zip(self.num_segments, self.num_lanes):
+            self.offsets.append(self.num_cells)
+            self.num_cells += num_segments * lanes
+        self._codes = {edge: i for i, edge in enumerate(self.edges)}
+
+        # boundaries of all edges in a single sorted array: the boundaries of
+        # every edge are shifted by a multiple of a span exceeding the length
+        # of every edge, so that a single search covers all edges
+        self._span = 2 * max([float(np.max(bounds)) for bounds in slices]
+                             + [0.]) + 1.
+        self._bounds = np.concatenate(
+            [code * self._span + np.asarray(bounds, dtype=np.float64)
+             for code, bounds in enumerate(slices)]) \
+            if len(slices) > 0 else np.zeros(0)
+        first = np.cumsum([0] + [n + 1 for n in self.num_segments])[:-1]
+        self._first_bound = np.asarray(first, dtype=np.int64)
+        self._num_segments = np.asarray(self.num_segments, dtype=np.int64)
+        self._num_lanes = np.asarray(self.num_lanes, dtype=np.int64)
+        self._offsets = np.asarray(self.offsets, dtype=np.int64)
+
+    def cell(self, edge, segment, lane):
+        """Return the index of a cell."""
+        code = self._codes[edge]
+        return self.offsets[code] + segment * self.num_lanes[code] + lane
+
+    def edge_cells(self, edge):
+        """Return the indices of the cells of an edge, as a slice."""
+        code = self._codes[edge]
+        return slice(self.offsets[code], self.offsets[code]
+                     + self.num_segments[code] * self.num_lanes[code])
+
+    def cells(self, edges, lanes, positions):
+        """Return the cell of every vehicle.
+
+        Positions at a segment boundary belong to the segment before it, and
+        positions at the very start of an edge to its last segment (i.e. the
+        segment is the index of the first boundary at or after the position,
+        minus one, with negative indices counting from the end).
+
+        Parameters
+        ----------
+        edges : list of str
+            edge of every vehicle
+        lanes : array_like
+            lane of every vehicle
+        positions : array_like
+            position of every vehicle on its edge
+
+        Returns
+        -------
+        numpy.ndarray
+            the cell of every vehicle, or -1 for vehicles that are not on one
+            of the edges, or on a lane out of the edge
+        """
+        get = self._codes.get
+        codes = np.fromiter((get(edge, -1) for edge in edges),
+                            dtype=np.int64, count=len(edges))
+        lanes = np.asarray(lanes, dtype=np.int64).reshape(-1)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1)
+        valid = codes >= 0
+        safe_codes = np.where(valid, codes, 0)
+
+        index = np.searchsorted(self._bounds,
+                                safe_codes * self._span + positions)
+        num_segments = self._num_segments[safe_codes]
+        segments = index - self._first_bound[safe_codes] - 1
+        segments = np.where(segments < 0, segments + num_segments,
+                            np.minimum(segments, num_segments - 1))
+
+        num_lanes = self._num_lanes[safe_codes]
+        valid &= (lanes >= 0) & (lanes < num_lanes) & (segments >= 0)
+        return np.where(
+            valid, self._offsets[safe_codes] + segments * num_lanes + lanes,
+            -1)
+
+    def aggregate(self, cells, weights=None, mask=None):
+        """Return the sum of a quantity over the vehicles of every cell.
+
+        Parameters
+        ----------
+        cells : numpy.ndarray
+            the cell of every vehicle (see cells)
+        weights : array_like, optional
+            the quantity summed for every vehicle. Vehicles are counted if not
+            specified
+        mask : array_like of bool, optional
+            the vehicles included. All vehicles are included if not specified
+
+        Returns
+        -------
+        numpy.ndarray
+            the sum over every cell
+        """
+        keep = cells >= 0
+        if mask is not None:
+            keep &= np.asarray(mask, dtype=bool)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)[keep]
+        return np.bincount(cells[keep], weights=weights,
+                           minlength=self.num_cells).astype(np.float64)
+
+    def members(self, cells):
+        """Group the vehicles of every cell.
+
+        Parameters
+        ----------
+        cells : numpy.ndarray
+            the cell of every vehicle (see cells)
+
+        Returns
+        -------
+        numpy.ndarray
+            the indices of the vehicles in the cells, sorted by cell, in
+            their original order within a cell
+        numpy.ndarray
+            the bounds of every cell in the indices: the vehicles of cell i
+            are at indices bounds[i]:bounds[i + 1]
+        """
+        keep = np.flatnonzero(cells >= 0)
+        order = keep[np.argsort(cells[keep], kind="stable")]
+        counts = np.bincount(cells[keep], minlength=self.num_cells)
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        return order, bounds
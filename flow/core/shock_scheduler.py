@@ -0,0 +1,236 @@
+"""Contains the scheduler of the shocks applied to vehicles.
+
+A shock model (see flow.density_aware_util.get_shock_model) draws the
+intensity and duration of every shock, and the start of every shock is
+precomputed (see flow.density_aware_util.get_time_steps). The scheduler
+compiles them into a timeline of start and stop events, kept in a heap sorted
+by time-step, so that advancing the scheduler at every step only looks at the
+events due at that step, instead of scanning the shock times and counting
+the duration of the current shock.
+
+Every shock is applied to one or more vehicles, chosen by the environment
+when the shock starts, and shocks may overlap. The vehicles of every shock,
+and the time-steps they were shocked during, are kept in a log (see
+ShockScheduler.get_log), which is stored next to the emission file of every
+rollout (see ShockScheduler.save_log) and read by the evaluators (see
+load_shock_log).
+"""
+import heapq
+import math
+import os
+
+import numpy as np
+
+# events at the same time-step: shocks are stopped before others are started,
+# so that a vehicle can be shocked again right after its shock ends
+STOP = 0
+START = 1
+
+# suffix appended to the path of the emission file of a rollout to get the
+# path of its shock log
+SHOCK_LOG_SUFFIX = ".shocks"
+
+
+def shock_log_path(emission_file):
+    """Return the path of the shock log of a rollout from its emission file."""
+    return emission_file + SHOCK_LOG_SUFFIX
+
+
+def load_shock_log(path):
+    """Load a shock log stored with ShockScheduler.save_log.
+
+    Parameters
+    ----------
+    path : str
+        path to the shock log (see shock_log_path)
+
+    Returns
+    -------
+    (list of str, numpy.ndarray) or None
+        the log (see ShockScheduler.get_log), or None if there is no log at
+        this path (e.g. for rollouts without shocks)
+    """
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as data:
+        return data["ids"].tolist(), data["log"]
+
+
+class ShockScheduler(object):
+    """Timeline of the start and stop events of a set of shocks.
+
+    Usage, at every time-step::
+
+        stopped, started = scheduler.advance(step)
+        for shock, veh_ids in stopped:
+            ...  # restore the vehicles
+        for shock in started:
+            veh_ids = ...  # choose the vehicles to shock
+            scheduler.start(shock, veh_ids)
+            ...  # apply scheduler.values[shock] to the vehicles
+
+    Attributes
+    ----------
+    starts : numpy.ndarray
+        time-step at which every shock starts
+    stops : numpy.ndarray
+        time-step at which every shock stops (exclusive)
+    values : numpy.ndarray
+        value of every shock (e.g. the acceleration or the speed of the
+        shocked vehicles)
+    shock_ids : dict
+        Key = index of every shock in progress
+        Element = ids of the vehicles shocked
+    """
+
+    def __init__(self, shock_times, durations, values, sim_step):
+        """Compile the timeline of the shocks.
+
+        Parameters
+        ----------
+        shock_times : array_like
+            time-step at which every shock starts, in the first column (see
+            flow.density_aware_util.get_time_steps)
+        durations : float or array_like
+            duration of every shock, in seconds. Shocks last for at least one
+            time-step
+        values : float or array_like
+            value of every shock
+        sim_step : float
+            duration of a time-step, in seconds
+        """
+        num_shocks = len(shock_times)
+        self.starts = np.array([int(times[0]) for times in shock_times],
+                               dtype=np.int64)
+        durations = np.broadcast_to(np.asarray(durations, dtype=np.float64),
+                                    (num_shocks,))
+        num_steps = [max(1, math.ceil(round(duration / sim_step, 6)))
+                     for duration in durations]
+        self.stops = self.starts + np.array(num_steps, dtype=np.int64)
+        self.values = np.array(np.broadcast_to(
+            np.asarray(values, dtype=np.float64), (num_shocks,)))
+
+        self._events = []
+        for shock in range(num_shocks):
+            self._events.append((int(self.starts[shock]), START, shock))
+            self._events.append((int(self.stops[shock]), STOP, shock))
+        heapq.heapify(self._events)
+
+        self.shock_ids = {}
+        self._step = None
+        # rows of the log of every shock in progress
+        self._log_rows = {}
+        self._log_ids = []
+        self._log = []
+        # number of rows of the log already saved
+        self._num_saved = 0
+
+    def __len__(self):
+        """Return the number of shocks."""
+        return len(self.starts)
+
+    def advance(self, step):
+        """Return the shocks stopping and starting at a time-step.
+
+        Events of earlier time-steps that were not yet returned are returned
+        as well.
+
+        Parameters
+        ----------
+        step : int
+            the time-step
+
+        Returns
+        -------
+        list of (int, list of str)
+            the index of every shock stopping, and the ids of its vehicles to
+            restore (see stop)
+        list of int
+            the index of every shock starting. Its vehicles are given by
+            start
+        """
+        self._step = step
+        stopped = []
+        started = []
+        events = self._events
+        while events and events[0][0] <= step:
+            _, kind, shock = heapq.heappop(events)
+            if kind == START:
+                started.append(shock)
+            elif shock in self.shock_ids:
+                stopped.append((shock, self.stop(shock)))
+            elif shock in started:
+                # the whole shock elapsed since the last time-step
+                started.remove(shock)
+        return stopped, started
+
+    def start(self, shock, veh_ids):
+        """Start a shock on a set of vehicles.
+
+        Parameters
+        ----------
+        shock : int
+            index of the shock
+        veh_ids : list of str
+            ids of the vehicles shocked
+        """
+        veh_ids = list(veh_ids)
+        self.shock_ids[shock] = veh_ids
+        self._log_rows[shock] = range(len(self._log),
+                                      len(self._log) + len(veh_ids))
+        for veh_id in veh_ids:
+            self._log_ids.append(veh_id)
+            self._log.append([shock, self._step, -1, self.values[shock]])
+
+    def stop(self, shock):
+        """Stop a shock, possibly before its end.
+
+        Returns
+        -------
+        list of str
+            the ids of the vehicles of the shock to restore, i.e. those that
+            are not held by another shock in progress
+        """
+        for row in self._log_rows.pop(shock):
+            self._log[row][2] = self._step
+        veh_ids = self.shock_ids.pop(shock)
+        held = set(self.get_active_ids())
+        return [veh_id for veh_id in veh_ids if veh_id not in held]
+
+    def get_active_ids(self):
+        """Return the ids of the vehicles currently shocked."""
+        return [veh_id for veh_ids in self.shock_ids.values()
+                for veh_id in veh_ids]
+
+    def get_log(self):
+        """Return the log of the shocks applied.
+
+        Returns
+        -------
+        list of str
+            the id of every vehicle shocked, once per shock
+        numpy.ndarray
+            for every vehicle shocked, the index of the shock, the time-step
+            it started at, the time-step it stopped at (exclusive, or -1 if it
+            is in progress), and the value of the shock
+        """
+        return list(self._log_ids), \
+            np.array(self._log, dtype=np.float64).reshape(-1, 4)
+
+    def save_log(self, path):
+        """Save the log of the shocks started since the last save.
+
+        The log of a rollout is stored next to its emission file (see
+        shock_log_path), and loaded with load_shock_log.
+
+        Parameters
+        ----------
+        path : str
+            path of the log file
+        """
+        ids, log = self.get_log()
+        start = self._num_saved
+        with open(path, "wb") as f:
+            np.savez(f, ids=np.array(ids[start:], dtype=str),
+                     log=log[start:])
+        self._num_saved = len(ids)
@@ -0,0 +1,234 @@
+"""Contains a cache of the state of simulations after their warmup steps.
+
+Every reset of an environment runs `env_params.warmup_steps` steps before the
+first observation is returned, which can take minutes for networks with
+thousands of warmup steps (e.g. the bottleneck). Since the warmup is fully
+determined by the environment, network, vehicles, inflows and seed, the state
+at the end of the warmup can be stored once and loaded by later resets.
+
+A cached state consists of:
+
+* the state of the sumo simulation, saved with `simulation.saveState` and
+  loaded with `simulation.loadState`.
+* the Python-side state of Flow: the vehicle kernel (including the
+  controllers of every vehicle), the attributes of the environment returned by
+  `Env.get_warmup_state`, and the observation at the end of the warmup.
+
+The key includes the seed of the simulation, so environments using a cache
+keep the seed they were created with over resets (see Env.reset). The cache
+holds a bounded number of states, and removes the least recently used ones.
+
+The python and numpy random number generators are not part of the state:
+restoring them would replay the same random stream (noise, shocks, etc.) in
+every rollout loading the state. They carry on from their current state
+instead, as if the warm-up steps did not draw from them.
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import warnings
+
+import numpy as np
+
+# simulation parameters that affect the state of the simulation after warmup
+SIM_KEY_ATTRIBUTES = ["seed", "sim_step", "lateral_resolution",
+                      "use_ballistic", "teleport_time", "overtake_right"]
+
+
+def _canonical(obj):
+    """Return a json serializable description of an object.
+
+    Classes (e.g. controllers) are described by their name, and other objects
+    by their attributes, so that the description does not depend on memory
+    addresses.
+    """
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return obj
+    if isinstance(obj, float):
+        return repr(obj)
+    if isinstance(obj, np.ndarray):
+        return _canonical(obj.tolist())
+    if isinstance(obj, np.generic):
+        return _canonical(obj.item())
+    if isinstance(obj, type):
+        return "{}.{}".format(obj.__module__, obj.__qualname__)
+    if isinstance(obj, dict):
+        return [[_canonical(key), _canonical(value)]
+                for key, value in sorted(obj.items(), key=lambda x: str(x[0]))]
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(value) for value in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted(_canonical(value) for value in obj)
+    if hasattr(obj, "__dict__"):
+        return [_canonical(type(obj)), _canonical(vars(obj))]
+    return repr(obj)
+
+
+def warmup_key(env):
+    """Return the key of the state of an environment after its warmup.
+
+    Parameters
+    ----------
+    env : flow.envs.Env
+        the environment, after its sumo instance was (re)started
+
+    Returns
+    -------
+    str
+        sha1 hash of the environment and network classes, the network,
+        vehicle, inflow, initial and environment parameters, the initial
+        state of the vehicles and the seed of the simulation
+    """
+    description = {
+        "env": _canonical(type(env)),
+        "network": _canonical(type(env.network)),
+        "net_params": _canonical(env.net_params),
+        "vehicles": _canonical(env.network.vehicles),
+        "initial_config": _canonical(env.initial_config),
+        "env_params": _canonical(env.env_params),
+        "initial_state": _canonical(env.initial_state),
+        "sim_params": {name: _canonical(getattr(env.sim_params, name, None))
+                       for name in SIM_KEY_ATTRIBUTES},
+    }
+    return hashlib.sha1(json.dumps(
+        description, sort_keys=True).encode()).hexdigest()
+
+
+class WarmupCache(object):
+    """Cache of post-warmup simulation states, stored in a directory.
+
+    Every state is stored in a sub-directory named after its key, containing
+    the sumo state ("state.xml") and the Flow state ("flow.pkl"). The
+    modification time of the sub-directory is updated whenever the state is
+    loaded, and the states used least recently are removed once the cache
+    holds more than max_size states.
+    """
+
+    def __init__(self, path, max_size=16):
+        """Instantiate the cache.
+
+        Parameters
+        ----------
+        path : str
+            directory of the cache. Created if it does not exist.
+        max_size : int, optional
+            maximum number of states kept in the cache
+        """
+        self.path = path
+        self.max_size = max(1, int(max_size))
+        os.makedirs(path, exist_ok=True)
+
+    def load(self, env, key):
+        """Load a cached state into an environment.
+
+        Parameters
+        ----------
+        env : flow.envs.Env
+            the environment, reset up to (but excluding) its warmup steps
+        key : str
+            key of the state, see warmup_key
+
+        Returns
+        -------
+        array_like or dict or None
+            the observation at the end of the warmup, or None if the state is
+            not in the cache
+        """
+        state_dir = os.path.join(self.path, key)
+        try:
+            with open(os.path.join(state_dir, "flow.pkl"), "rb") as f:
+                state = pickle.load(f)
+            # mark the state as recently used
+            os.utime(state_dir)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # not cached, or removed by another process in the meantime
+            return None
+
+        env.k.kernel_api.simulation.loadState(
+            os.path.join(state_dir, "state.xml"))
+
+        # replace the vehicle kernel with its state after warmup
+        vehicle = state["vehicle"]
+        vehicle.master_kernel = env.k
+        vehicle.pass_api(env.k.kernel_api)
+        env.k.vehicle = vehicle
+        # loading a state removes the subscriptions to the vehicles
+        vehicle.resubscribe()
+
+        env.k.simulation.time = state["time"]
+        env.set_warmup_state(state["env"])
+
+        return state["observation"]
+
+    def save(self, env, key, observation):
+        """Store the state of an environment at the end of its warmup.
+
+        States that cannot be pickled (e.g. vehicles with controllers holding
+        lambdas) are not cached, and a warning is issued instead.
+
+        Parameters
+        ----------
+        env : flow.envs.Env
+            the environment, right after its warmup steps
+        key : str
+            key of the state, see warmup_key
+        observation : array_like or dict
+            the observation at the end of the warmup
+        """
+        state_dir = os.path.join(self.path, key)
+        if os.path.isdir(state_dir):
+            return
+
+        # the vehicle kernel is pickled without its references to the
+        # simulation (as done for Env.initial_vehicles)
+        vehicle = env.k.vehicle
+        master_kernel, kernel_api = vehicle.master_kernel, vehicle.kernel_api
+        vehicle.master_kernel = None
+        vehicle.kernel_api = None
+        try:
+            data = pickle.dumps({
+                "vehicle": vehicle,
+                "time": env.k.simulation.time,
+                "env": env.get_warmup_state(),
+                "observation": observation,
+            })
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            warnings.warn("The state after warmup could not be cached: "
+                          "{}".format(e))
+            return
+        finally:
+            vehicle.master_kernel = master_kernel
+            vehicle.kernel_api = kernel_api
+
+        # write to a temporary directory first, so that other processes using
+        # the same cache never load a partially written state
+        tmp_dir = "{}.tmp-{}".format(state_dir, os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+        env.k.kernel_api.simulation.saveState(
+            os.path.join(tmp_dir, "state.xml"))
+        with open(os.path.join(tmp_dir, "flow.pkl"), "wb") as f:
+            f.write(data)
+        try:
+            os.rename(tmp_dir, state_dir)
+        except OSError:
+            # another process stored the same state in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used states beyond max_size."""
+        states = []
+        for name in os.listdir(self.path):
+            state_dir = os.path.join(self.path, name)
+            # skip the states being written by other processes
+            if ".tmp-" in name or not os.path.isdir(state_dir):
+                continue
+            try:
+                states.append((os.path.getmtime(state_dir), state_dir))
+            except OSError:
+                continue
+        states.sort(reverse=True)
+        for _, state_dir in states[self.max_size:]:
+            shutil.rmtree(state_dir, ignore_errors=True)
@@ -24,6 +24,8 @@ import sumolib
 
 from flow.core.util import ensure_dir
 from flow.core.kernel import Kernel
+from flow.controllers.batched import get_batched_actions
+from flow.core.warmup_cache import WarmupCache, warmup_key
 from flow.utils.exceptions import FatalFlowError
 
 
@@ -61,7 +63,7 @@ class Env(gym.Env, metaclass=ABCMeta):
     network : flow.networks.Network
         see flow/networks/base.py
     simulator : str
-        the simulator used, one of {'traci', 'aimsun'}
+        the simulator used, one of {'traci', 'aimsun', 'numpy'}
     k : flow.core.kernel.Kernel
         Flow kernel object, using for state acquisition and issuing commands to
         the certain components of the simulator. For more information, see:
@@ -117,7 +119,8 @@ class Env(gym.Env, metaclass=ABCMeta):
         network : flow.networks.Network
             see flow/networks/base.py
         simulator : str
-            the simulator used, one of {'traci', 'aimsun'}. Defaults to 'traci'
+            the simulator used, one of {'traci', 'aimsun', 'numpy'}. Defaults to
+            'traci'
 
         Raises
         ------
@@ -139,7 +142,9 @@ class Env(gym.Env, metaclass=ABCMeta):
             # 1.0 works with stress_test_start 10k times
             time.sleep(1.0 * int(time_stamp[-6:]) / 1e6)
         # FIXME: this is sumo-specific
-        self.sim_params.port = sumolib.miscutils.getFreeSocketPort()
+        # a preset port is kept, e.g. when rollouts run in parallel workers
+        if self.sim_params.port is None:
+            self.sim_params.port = sumolib.miscutils.getFreeSocketPort()
         # time_counter: number of steps taken since the start of a rollout
         self.time_counter = 0
         # step_counter: number of total steps taken
@@ -247,7 +252,9 @@ class Env(gym.Env, metaclass=ABCMeta):
         self.k.close()
 
         # killed the sumo process if using sumo/TraCI
-        if self.simulator == 'traci':
+        # (there is no process to kill if sumo is run through libsumo)
+        if self.simulator == 'traci' and \
+                self.k.simulation.sumo_proc is not None:
             self.k.simulation.sumo_proc.kill()
 
         if render is not None:
@@ -321,69 +328,139 @@ class Env(gym.Env, metaclass=ABCMeta):
         info : dict
             contains other diagnostic information from the previous action
         """
-        for _ in range(self.env_params.sims_per_step):
-            self.time_counter += 1
-            self.step_counter += 1
-
-            # perform acceleration actions for controlled human-driven vehicles
-            if len(self.k.vehicle.get_controlled_ids()) > 0:
-                accel = []
-                for veh_id in self.k.vehicle.get_controlled_ids():
-                    action = self.k.vehicle.get_acc_controller(
-                        veh_id).get_action(self)
-                    accel.append(action)
-                self.k.vehicle.apply_acceleration(
-                    self.k.vehicle.get_controlled_ids(), accel)
-
-            # perform lane change actions for controlled human-driven vehicles
-            if len(self.k.vehicle.get_controlled_lc_ids()) > 0:
-                direction = []
-                for veh_id in self.k.vehicle.get_controlled_lc_ids():
-                    target_lane = self.k.vehicle.get_lane_changing_controller(
-                        veh_id).get_action(self)
-                    direction.append(target_lane)
-                self.k.vehicle.apply_lane_change(
-                    self.k.vehicle.get_controlled_lc_ids(),
-                    direction=direction)
+        crash = self.simulate(rl_actions)
+        return self.get_step_result(rl_actions, crash)
 
-            # perform (optionally) routing actions for all vehicles in the
-            # network, including RL and SUMO-controlled vehicles
-            routing_ids = []
-            routing_actions = []
-            for veh_id in self.k.vehicle.get_ids():
-                if self.k.vehicle.get_routing_controller(veh_id) \
-                        is not None:
-                    routing_ids.append(veh_id)
-                    route_contr = self.k.vehicle.get_routing_controller(
-                        veh_id)
-                    routing_actions.append(route_contr.choose_route(self))
+    def simulate(self, rl_actions):
+        """Advance the simulation by one environment step.
 
-            self.k.vehicle.choose_routes(routing_ids, routing_actions)
+        The simulation is advanced by the number of time steps requested per
+        environment step, or until a collision occurs.
 
-            self.apply_rl_actions(rl_actions)
+        Parameters
+        ----------
+        rl_actions : array_like
+            an list of actions provided by the rl algorithm
 
-            self.additional_command()
+        Returns
+        -------
+        bool
+            whether the simulator experienced a collision
+        """
+        crash = False
+        for _ in range(self.env_params.sims_per_step):
+            self.prepare_simulation_step(rl_actions)
 
             # advance the simulation in the simulator by one step
             self.k.simulation.simulation_step()
 
-            # store new observations in the vehicles and traffic lights class
-            self.k.update(reset=False)
-
-            # update the colors of vehicles
-            if self.sim_params.render:
-                self.k.vehicle.update_vehicle_colors()
-
-            # crash encodes whether the simulator experienced a collision
-            crash = self.k.simulation.check_collision()
+            crash = self.process_simulation_step()
 
             # stop collecting new simulation steps if there is a collision
             if crash:
                 break
 
-            # render a frame
+        return crash
+
+    def prepare_simulation_step(self, rl_actions):
+        """Assign the actions of all agents before a simulation step.
+
+        Parameters
+        ----------
+        rl_actions : array_like
+            an list of actions provided by the rl algorithm
+        """
+        self.time_counter += 1
+        self.step_counter += 1
+
+        # perform acceleration actions for controlled human-driven vehicles
+        if len(self.k.vehicle.get_controlled_ids()) > 0:
+            if getattr(self.env_params, "batch_controllers", False):
+                accel = get_batched_actions(
+                    self, self.k.vehicle.get_controlled_ids())
+            else:
+                accel = []
+                for veh_id in self.k.vehicle.get_controlled_ids():
+                    action = self.k.vehicle.get_acc_controller(
+                        veh_id).get_action(self)
+                    accel.append(action)
+            self.k.vehicle.apply_acceleration(
+                self.k.vehicle.get_controlled_ids(), accel)
+
+        # perform lane change actions for controlled human-driven vehicles
+        if len(self.k.vehicle.get_controlled_lc_ids()) > 0:
+            direction = []
+            for veh_id in self.k.vehicle.get_controlled_lc_ids():
+                target_lane = self.k.vehicle.get_lane_changing_controller(
+                    veh_id).get_action(self)
+                direction.append(target_lane)
+            self.k.vehicle.apply_lane_change(
+                self.k.vehicle.get_controlled_lc_ids(),
+                direction=direction)
+
+        # perform (optionally) routing actions for all vehicles in the
+        # network, including RL and SUMO-controlled vehicles
+        routing_ids = []
+        routing_actions = []
+        for veh_id in self.k.vehicle.get_ids():
+            if self.k.vehicle.get_routing_controller(veh_id) \
+                    is not None:
+                routing_ids.append(veh_id)
+                route_contr = self.k.vehicle.get_routing_controller(
+                    veh_id)
+                routing_actions.append(route_contr.choose_route(self))
+
+        self.k.vehicle.choose_routes(routing_ids, routing_actions)
+
+        self.apply_rl_actions(rl_actions)
+
+        self.additional_command()
+
+    def process_simulation_step(self):
+        """Collect the results of a simulation step.
+
+        Returns
+        -------
+        bool
+            whether the simulator experienced a collision
+        """
+        # store new observations in the vehicles and traffic lights class
+        self.k.update(reset=False)
+
+        # update the colors of vehicles
+        if self.sim_params.render:
+            self.k.vehicle.update_vehicle_colors()
+
+        # crash encodes whether the simulator experienced a collision
+        crash = self.k.simulation.check_collision()
+
+        # render a frame
+        if not crash:
             self.render()
 
+        return crash
+
+    def get_step_result(self, rl_actions, crash):
+        """Return the result of an environment step, once simulated.
+
+        Parameters
+        ----------
+        rl_actions : array_like
+            an list of actions provided by the rl algorithm
+        crash : bool
+            whether the simulator experienced a collision
+
+        Returns
+        -------
+        observation : array_like
+            agent's observation of the current environment
+        reward : float
+            amount of reward associated with the previous state/action pair
+        done : bool
+            indicates whether the episode has ended
+        info : dict
+            contains other diagnostic information from the previous action
+        """
         states = self.get_state()
 
         # collect information of the state of the network based on the
@@ -455,8 +532,11 @@ class Env(gym.Env, metaclass=ABCMeta):
         if self.sim_params.restart_instance or \
                 (self.step_counter > 2e6 and self.simulator != 'aimsun'):
             self.step_counter = 0
-            # issue a random seed to induce randomness into the next rollout
-            self.sim_params.seed = random.randint(0, 1e5)
+            # issue a random seed to induce randomness into the next rollout,
+            # unless the state after warmup is cached: it is keyed by the
+            # seed, so that a new seed would never hit the cache
+            if getattr(self.sim_params, "warmup_cache", None) is None:
+                self.sim_params.seed = random.randint(0, 1e5)
 
             self.k.vehicle = deepcopy(self.initial_vehicles)
             self.k.vehicle.master_kernel = self.k
@@ -551,14 +631,86 @@ class Env(gym.Env, metaclass=ABCMeta):
         observation = np.copy(states)
 
         # perform (optional) warm-up steps before training
-        for _ in range(self.env_params.warmup_steps):
-            observation, _, _, _ = self.step(rl_actions=None)
+        observation = self.warmup(observation)
 
         # render a frame
         self.render(reset=True)
 
         return observation
 
+    def warmup(self, observation=None):
+        """Perform the warm-up steps of a rollout.
+
+        If a warmup cache is specified in the simulation parameters, the state
+        of the simulation after the warm-up steps is loaded from the cache if
+        available, and stored in it otherwise. See flow.core.warmup_cache.
+
+        Parameters
+        ----------
+        observation : array_like or dict, optional
+            the observation before the warm-up steps
+
+        Returns
+        -------
+        array_like or dict
+            the observation after the warm-up steps
+        """
+        cache_path = getattr(self.sim_params, "warmup_cache", None)
+        if cache_path is None or self.env_params.warmup_steps == 0 \
+                or self.simulator != 'traci' \
+                or self.sim_params.emission_path is not None:
+            for _ in range(self.env_params.warmup_steps):
+                observation, _, _, _ = self.step(rl_actions=None)
+            return observation
+
+        cache = WarmupCache(
+            cache_path, getattr(self.sim_params, "warmup_cache_size", 16))
+        key = warmup_key(self)
+        cached_observation = cache.load(self, key)
+        if cached_observation is not None:
+            return cached_observation
+
+        for _ in range(self.env_params.warmup_steps):
+            observation, _, _, _ = self.step(rl_actions=None)
+        cache.save(self, key, observation)
+        return observation
+
+    def get_warmup_state(self):
+        """Return the attributes of the environment to cache after warmup.
+
+        Environments that modify other attributes during the warm-up steps
+        should extend this method.
+
+        Returns
+        -------
+        dict
+            the value of every attribute, by name
+        """
+        return {
+            "time_counter": self.time_counter,
+            "state": self.state,
+        }
+
+    def set_warmup_state(self, state):
+        """Restore the attributes of the environment cached after warmup.
+
+        The step counter is cumulative over rollouts, and is advanced by the
+        number of warm-up steps instead of being restored.
+
+        Parameters
+        ----------
+        state : dict
+            the value of every attribute, by name (see get_warmup_state)
+        """
+        state = dict(state)
+        # absolute step counter of states cached by earlier versions
+        state.pop("step_counter", None)
+        for name, value in state.items():
+            setattr(self, name, value)
+        # the time counter starts at zero at every reset, so that it is the
+        # number of steps taken during the warm-up
+        self.step_counter += state["time_counter"]
+
     def additional_command(self):
         """Additional commands that may be performed by the step method."""
         pass
@@ -21,6 +21,7 @@ import numpy as np
 from gym.spaces.box import Box
 
 from flow.core import rewards
+from flow.core.segment_aggregation import SegmentAggregator
 from flow.envs.base import Env
 
 MAX_LANES = 4  # base number of largest number of lanes in the network
@@ -111,6 +112,12 @@ class BottleneckEnv(Env):
         A dict mapping edges to a dict of lanes where each entry in the lane
         dict tracks the vehicles that are in that lane. Used to save on
         unnecessary lookups.
+    lane_aggregator : flow.core.segment_aggregation.SegmentAggregator
+        Aggregates the vehicles of every lane of the edges in EDGE_LIST. Used
+        to build edge_dict, and to count the vehicles in the bottleneck.
+    lane_counts : np.ndarray
+        Number of vehicles in every lane of the edges in EDGE_LIST (see
+        lane_aggregator), updated at every step.
     cars_waiting_for_toll : {veh_id: {lane_change_mode: int, color: (int)}}
         A dict mapping vehicle ids to a dict tracking the color and lane change
         mode of vehicles before they entered the toll area. When vehicles exit
@@ -231,6 +238,18 @@ class BottleneckEnv(Env):
         self.smoothed_num = np.zeros(10)  # averaged number of vehs in '4'
         self.outflow_index = 0
 
+        # a single segment per edge, i.e. one cell per lane
+        self.lane_aggregator = SegmentAggregator(
+            EDGE_LIST,
+            [[0, self.k.network.edge_length(edge)] for edge in EDGE_LIST],
+            [self.k.network.num_lanes(edge) for edge in EDGE_LIST])
+        self.lane_counts = np.zeros(self.lane_aggregator.num_cells)
+        # cell of every lane of the bottleneck, by "edge_lane" name
+        self.bottleneck_lane_cells = {
+            "{}_{}".format(edge, lane): self.lane_aggregator.cell(edge, 0, lane)
+            for edge in ['3', '4']
+            for lane in range(self.k.network.num_lanes(edge))}
+
     def additional_command(self):
         """Build a dict with vehicle information.
 
@@ -241,19 +260,33 @@ class BottleneckEnv(Env):
 
         # build a dict containing the list of vehicles and their position for
         # each edge and for each lane within the edge
-        empty_edge = [[] for _ in range(MAX_LANES * self.scaling)]
-
-        self.edge_dict = {k: deepcopy(empty_edge) for k in EDGE_LIST}
-        for veh_id in self.k.vehicle.get_ids():
-            try:
-                edge = self.k.vehicle.get_edge(veh_id)
-                if edge not in self.edge_dict:
-                    self.edge_dict[edge] = deepcopy(empty_edge)
-                lane = self.k.vehicle.get_lane(veh_id)  # integer
-                pos = self.k.vehicle.get_position(veh_id)
-                self.edge_dict[edge][lane].append((veh_id, pos))
-            except Exception:
-                pass
+        max_lanes = MAX_LANES * self.scaling
+        veh_ids = self.k.vehicle.get_ids()
+        edges = self.k.vehicle.get_edge(veh_ids)
+        lanes = self.k.vehicle.get_lane(veh_ids)  # integer
+        positions = self.k.vehicle.get_position(veh_ids)
+
+        cells = self.lane_aggregator.cells(edges, lanes, positions)
+        self.lane_counts = self.lane_aggregator.aggregate(cells)
+        order, bounds = self.lane_aggregator.members(cells)
+
+        self.edge_dict = {}
+        for i, edge in enumerate(EDGE_LIST):
+            self.edge_dict[edge] = [[] for _ in range(max_lanes)]
+            for lane in range(min(self.lane_aggregator.num_lanes[i],
+                                  max_lanes)):
+                cell = self.lane_aggregator.cell(edge, 0, lane)
+                self.edge_dict[edge][lane] = [
+                    (veh_ids[j], positions[j])
+                    for j in order[bounds[cell]:bounds[cell + 1]]]
+
+        # vehicles on other edges (e.g. junctions)
+        for j in np.flatnonzero(cells < 0):
+            edge, lane = edges[j], lanes[j]
+            if edge not in self.edge_dict:
+                self.edge_dict[edge] = [[] for _ in range(max_lanes)]
+            if 0 <= lane < max_lanes:
+                self.edge_dict[edge][lane].append((veh_ids[j], positions[j]))
 
         if not self.env_params.additional_params['disable_tb']:
             self.apply_toll_bridge_control()
@@ -262,8 +295,8 @@ class BottleneckEnv(Env):
             self.alinea()
 
         # compute the outflow
-        veh_ids = self.k.vehicle.get_ids_by_edge('4')
-        self.smoothed_num[self.outflow_index] = len(veh_ids)
+        self.smoothed_num[self.outflow_index] = self.lane_counts[
+            self.lane_aggregator.edge_cells('4')].sum()
         self.outflow_index = \
             (self.outflow_index + 1) % self.smoothed_num.shape[0]
 
@@ -444,15 +477,18 @@ class BottleneckEnv(Env):
         density of all vehicles on all lanes of the bottleneck edges.
         """
         bottleneck_ids = self.k.vehicle.get_ids_by_edge(['3', '4'])
+        cells = self.lane_aggregator.cells(
+            self.k.vehicle.get_edge(bottleneck_ids),
+            self.k.vehicle.get_lane(bottleneck_ids),
+            self.k.vehicle.get_position(bottleneck_ids))
+        counts = self.lane_aggregator.aggregate(cells)
         if lanes:
-            veh_ids = [
-                veh_id for veh_id in bottleneck_ids
-                if str(self.k.vehicle.get_edge(veh_id)) + "_" +
-                str(self.k.vehicle.get_lane(veh_id)) in lanes
-            ]
+            num_vehicles = sum(
+                counts[self.bottleneck_lane_cells[lane]] for lane in set(lanes)
+                if lane in self.bottleneck_lane_cells)
         else:
-            veh_ids = self.k.vehicle.get_ids_by_edge(['3', '4'])
-        return len(veh_ids) / BOTTLE_NECK_LEN
+            num_vehicles = len(bottleneck_ids)
+        return num_vehicles / BOTTLE_NECK_LEN
 
     # Dummy action and observation spaces
     @property
@@ -807,6 +843,11 @@ class BottleneckDesiredVelocityEnv(BottleneckEnv):
             self.obs_slices[edge] = np.linspace(0, edge_length,
                                                 num_segments + 1)
 
+        # aggregates the vehicles of every lane-segment, see get_state
+        self.obs_aggregator = SegmentAggregator(
+            EDGE_LIST, [self.obs_slices[edge] for edge in EDGE_LIST],
+            [self.k.network.num_lanes(edge) for edge in EDGE_LIST])
+
         # self.symmetric is True if all lanes in a segment
         # have same action, else False
         self.symmetric = additional_params.get("symmetric")
@@ -892,55 +933,36 @@ class BottleneckDesiredVelocityEnv(BottleneckEnv):
         Finally, we also append the total outflow of the bottleneck over the
         last 20 * self.sim_step seconds.
         """
-        num_vehicles_list = []
-        num_rl_vehicles_list = []
-        vehicle_speeds_list = []
-        rl_speeds_list = []
-        for i, edge in enumerate(EDGE_LIST):
-            num_lanes = self.k.network.num_lanes(edge)
-            num_vehicles = np.zeros((self.num_obs_segments[i], num_lanes))
-            num_rl_vehicles = np.zeros((self.num_obs_segments[i], num_lanes))
-            vehicle_speeds = np.zeros((self.num_obs_segments[i], num_lanes))
-            rl_vehicle_speeds = np.zeros((self.num_obs_segments[i], num_lanes))
-            ids = self.k.vehicle.get_ids_by_edge(edge)
-            lane_list = self.k.vehicle.get_lane(ids)
-            pos_list = self.k.vehicle.get_position(ids)
-            for i, id in enumerate(ids):
-                segment = np.searchsorted(self.obs_slices[edge],
-                                          pos_list[i]) - 1
-                if id in self.k.vehicle.get_rl_ids():
-                    rl_vehicle_speeds[segment, lane_list[i]] \
-                        += self.k.vehicle.get_speed(id)
-                    num_rl_vehicles[segment, lane_list[i]] += 1
-                else:
-                    vehicle_speeds[segment, lane_list[i]] \
-                        += self.k.vehicle.get_speed(id)
-                    num_vehicles[segment, lane_list[i]] += 1
-
-            # normalize
-
-            num_vehicles /= NUM_VEHICLE_NORM
-            num_rl_vehicles /= NUM_VEHICLE_NORM
-            num_vehicles_list += num_vehicles.flatten().tolist()
-            num_rl_vehicles_list += num_rl_vehicles.flatten().tolist()
-            vehicle_speeds_list += vehicle_speeds.flatten().tolist()
-            rl_speeds_list += rl_vehicle_speeds.flatten().tolist()
-
-        unnorm_veh_list = np.asarray(num_vehicles_list) * NUM_VEHICLE_NORM
-        unnorm_rl_list = np.asarray(num_rl_vehicles_list) * NUM_VEHICLE_NORM
+        # assign every vehicle to its lane-segment
+        ids = self.k.vehicle.get_ids_by_edge(EDGE_LIST)
+        cells = self.obs_aggregator.cells(
+            self.k.vehicle.get_edge(ids), self.k.vehicle.get_lane(ids),
+            self.k.vehicle.get_position(ids))
+        rl_ids = set(self.k.vehicle.get_rl_ids())
+        is_rl = np.fromiter((veh_id in rl_ids for veh_id in ids),
+                            dtype=bool, count=len(ids))
+        speeds = self.k.vehicle.get_speed_array(ids)
+
+        # number of vehicles and sum of their speeds in every lane-segment
+        num_vehicles = self.obs_aggregator.aggregate(cells, mask=~is_rl)
+        num_rl_vehicles = self.obs_aggregator.aggregate(cells, mask=is_rl)
+        vehicle_speeds = self.obs_aggregator.aggregate(
+            cells, weights=speeds, mask=~is_rl)
+        rl_speeds = self.obs_aggregator.aggregate(
+            cells, weights=speeds, mask=is_rl)
+
+        # normalize
+        num_vehicles_list = num_vehicles / NUM_VEHICLE_NORM
+        num_rl_vehicles_list = num_rl_vehicles / NUM_VEHICLE_NORM
 
         # compute the mean speed if the speed isn't zero
-        num_rl = len(num_rl_vehicles_list)
-        num_veh = len(num_vehicles_list)
-        mean_speed = np.nan_to_num([
-            vehicle_speeds_list[i] / unnorm_veh_list[i]
-            if int(unnorm_veh_list[i]) else 0 for i in range(num_veh)
-        ])
+        mean_speed = np.divide(vehicle_speeds, num_vehicles,
+                               out=np.zeros_like(vehicle_speeds),
+                               where=num_vehicles > 0)
         mean_speed_norm = mean_speed / 50
-        mean_rl_speed = np.nan_to_num([
-            rl_speeds_list[i] / unnorm_rl_list[i]
-            if int(unnorm_rl_list[i]) else 0 for i in range(num_rl)
-        ]) / 50
+        mean_rl_speed = np.divide(rl_speeds, num_rl_vehicles,
+                                  out=np.zeros_like(rl_speeds),
+                                  where=num_rl_vehicles > 0) / 50
         #outflow = np.asarray([0.99]) # Bibek: For test
         outflow = np.asarray(
             # Bibek: This used to be normalized by 2000.0 and cause errors. Normalized by 6000 
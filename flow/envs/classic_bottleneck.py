@@ -10,6 +10,7 @@ from flow.controllers import BCMController, LACController, IDMController
 from flow.controllers.controllers_for_daware import ModifiedIDMController
 from flow.controllers.velocity_controllers import FollowerStopper, PISaturation
 from flow.envs.base import Env
+from flow.core.shock_scheduler import ShockScheduler
 from flow.density_aware_util import get_shock_model, get_time_steps, get_time_steps_stability
 from copy import deepcopy
 
@@ -133,18 +134,17 @@ class classicBottleneckEnv(BottleneneckAccelEnv):
         else: 
             self.sm = get_shock_model(self.shock_params['shock_model'], network_scaler=2, bidirectional=True, high_speed=False) 
         
-         # count how many times, shock has been applies
-        self.shock_counter = 0
-
-        # Count duration of current shock (in timesteps)
-        self.current_duration_counter = 0
-
         # Precise shock times
         if self.stability:
             self.shock_times = get_time_steps_stability(self.sm[1], self.sm[2], self.shock_start_time, self.shock_end_time)
         else:
             self.shock_times = get_time_steps(self.sm[1], self.sm[2], self.shock_start_time, self.shock_end_time)
 
+        # Start and stop events of the shocks, advanced every time-step (the log of shocks applied is kept here as well)
+        # Since the sim step here is 0.5, a shock of 1 second lasts 2 timesteps
+        self.shock_scheduler = ShockScheduler(self.shock_times, self.sm[1], self.sm[0], self.sim_step)
+        self.shock_ids = []
+
         self.density_collector = []
         # Dont allow '5' to avoid vehicles exiting from the network cause a NoneType error
         self.edges_allowed_list = ['3', '4_0', '4_1', '4_2', '4_3', '4_4', '4_5', '4_6', '4_7',  '4'] # 5_0, 5_1, and 5_2 are not allowed
@@ -227,15 +227,23 @@ class classicBottleneckEnv(BottleneneckAccelEnv):
             plt.close()
 
         # Shock 
-        if self.shock and self.step_counter >= self.shock_start_time and self.step_counter <= self.shock_end_time:
+        if self.shock:
             if self.stability:
-                self.perform_shock_stability(self.shock_times)
+                self.perform_shock_stability()
             else: 
-                self.perform_shock(self.shock_times)
+                self.perform_shock()
         
         return super().step(rl_actions)
 
-    def perform_shock(self, shock_times):
+    def get_warmup_state(self):
+        """
+        Density is collected during warmup as well
+        """
+        state = super().get_warmup_state()
+        state['density_collector'] = self.density_collector
+        return state
+
+    def perform_shock(self):
         """
         The flow of vehicles (3600 veh/hr) is higher than in the ring.
         The density here is 3x higher than the ring, the effective number of lanes is also about 6x higher
@@ -249,59 +257,38 @@ class classicBottleneckEnv(BottleneneckAccelEnv):
             - Vehicles must be selected from the current list of available vehicles
             - Vehicle must be moving at a speed greater than 1 m/s
         """
-
-        all_ids = self.k.vehicle.get_ids()
-
-        # if vehicle IDs have a 'classic_00' in it, then its a classic vehicle
-        if self.step_counter == shock_times[0][0]: # This occurs only once
-            #current_shockable_vehicle_ids = [i for i in all_ids if 'classic_00' not in i and self.k.vehicle.get_edge(i) in self.edges_allowed_list and self.k.vehicle.get_speed(i) > self.threshold_speed] 
-            current_shockable_vehicle_ids = [i for i in all_ids if 'classic_00' not in i and self.k.vehicle.get_edge(i) in self.edges_allowed_list and self.k.vehicle.get_speed(i) < self.threshold_speed] # and self.k.vehicle.get_leader(i) is not None]
-            
-            self.shock_ids = np.random.choice(current_shockable_vehicle_ids, self.sample_vehicles)
-            print(f"\n\nShock ids: {self.shock_ids}\n\n")
-        
-        if len(self.shock_ids) > 0:
-            controllers = [self.k.vehicle.get_acc_controller(i) for i in self.shock_ids]
-            for controller in controllers:
-                controller.set_shock_time(False)
-
-        # Reset duration counter and increase shock counter, after completion of shock duration
-        # Since the sim step here is 0.5, applying shock for 2 timesteps means 1 second
-        # The durations can be anywhere between 0.1 to 2.5 at intervals of 0.1 but the current duration counter does not increment that way (make it >=)
-        if self.shock_counter < len(self.sm[1]) and self.current_duration_counter >= self.sm[1][self.shock_counter]: 
-            self.shock_counter += 1
-            self.current_duration_counter = 0
-
+        stopped, started = self.shock_scheduler.advance(self.step_counter)
+
+        if len(stopped) > 0:
+            # Vehicles may have exited the network during the shock
+            all_ids = set(self.k.vehicle.get_ids())
+            for shock, veh_ids in stopped:
+                for veh_id in veh_ids:
+                    if veh_id in all_ids:
+                        self.k.vehicle.get_acc_controller(veh_id).set_shock_time(False)
+            self.shock_ids = self.shock_scheduler.get_active_ids()
+
+        for shock in started:
+            # if vehicle IDs have a 'classic_00' in it, then its a classic vehicle
+            all_ids = self.k.vehicle.get_ids()
             #current_shockable_vehicle_ids = [i for i in all_ids if 'classic_00' not in i and self.k.vehicle.get_edge(i) in self.edges_allowed_list and self.k.vehicle.get_speed(i) > self.threshold_speed]
-            current_shockable_vehicle_ids = [i for i in all_ids if 'classic_00' not in i and self.k.vehicle.get_edge(i) in self.edges_allowed_list and self.k.vehicle.get_speed(i) < self.threshold_speed ]# and self.k.vehicle.get_leader(i) is not None]
-            self.shock_ids = np.random.choice(current_shockable_vehicle_ids, self.sample_vehicles)
-            print(f"\n\nShock ids: {self.shock_ids}\n\n")
-
-        if self.shock_counter < self.sm[2]: # '<' because shock counter starts from zero
-            if self.step_counter == shock_times[self.shock_counter][0]:
-                current_shockable_vehicle_ids = [i for i in all_ids if 'classic_00' not in i and self.k.vehicle.get_edge(i) in self.edges_allowed_list and self.k.vehicle.get_speed(i) < self.threshold_speed] # and self.k.vehicle.get_leader(i) is not None]
-                for controller in controllers:
-                    controller.set_shock_accel(self.sm[0][self.shock_counter])
-                    controller.set_shock_time(True)
-
-            if self.step_counter >= shock_times[self.shock_counter][0] and \
-                self.step_counter <= shock_times[self.shock_counter][1]:
-                print(f"Step = {self.step_counter}, Shock params: {self.sm[0][self.shock_counter], self.sm[1][self.shock_counter], self.sm[2]} applied to vehicle {self.shock_ids}\n")
-                
-                for controller in controllers:
-                    controller.set_shock_accel(self.sm[0][self.shock_counter])
-                    controller.set_shock_time(True)
+            current_shockable_vehicle_ids = [i for i in all_ids if 'classic_00' not in i and self.k.vehicle.get_edge(i) in self.edges_allowed_list and self.k.vehicle.get_speed(i) < self.threshold_speed] # and self.k.vehicle.get_leader(i) is not None]
 
-                # Change color to magenta
-                for i in self.shock_ids:
-                    self.k.vehicle.set_color(i, (255,0,255))
+            shock_ids = np.random.choice(current_shockable_vehicle_ids, self.sample_vehicles)
+            print(f"\n\nShock ids: {shock_ids}\n\n")
+            self.shock_scheduler.start(shock, shock_ids)
+            self.shock_ids = self.shock_scheduler.get_active_ids()
+            print(f"Step = {self.step_counter}, Shock params: {self.sm[0][shock], self.sm[1][shock], self.sm[2]} applied to vehicle {shock_ids}\n")
 
-                self.current_duration_counter += 0.5 # increment current duration counter by one timestep seconds # sim_step = 0.5
+            for i in shock_ids:
+                controller = self.k.vehicle.get_acc_controller(i)
+                controller.set_shock_accel(self.shock_scheduler.values[shock])
+                controller.set_shock_time(True)
 
-            if self.step_counter == shock_times[self.shock_counter][1]:
-                self.shock_ids = []
+                # Change color to magenta
+                self.k.vehicle.set_color(i, (255,0,255))
 
-    def perform_shock_stability(self, shock_times):
+    def perform_shock_stability(self):
         pass
 
 
@@ -10,6 +10,7 @@ from flow.controllers import BCMController, LACController, IDMController
 from flow.controllers.controllers_for_daware import ModifiedIDMController
 from flow.controllers.velocity_controllers import FollowerStopper, PISaturation
 from flow.envs.base import Env
+from flow.core.shock_scheduler import ShockScheduler
 from flow.density_aware_util import get_shock_model, get_time_steps, get_time_steps_stability
 from copy import deepcopy
 
@@ -123,18 +124,15 @@ class classicIntersectionEnv(IntersectionAccelEnv):
         else: 
             self.sm = get_shock_model(self.shock_params['shock_model'], network_scaler=3, bidirectional=False, high_speed=False) # high_speed = True for intersection
             #print(f"Shock model: {self.sm}")
-         # count how many times, shock has been applies
-        self.shock_counter = 0
-
-        # Count duration of current shock (in timesteps)
-        self.current_duration_counter = 0
-
         # Precise shock times
         if self.stability:
             self.shock_times = get_time_steps_stability(self.sm[1], self.sm[2], self.shock_start_time, self.shock_end_time)
         else:
             self.shock_times = get_time_steps(self.sm[1], self.sm[2], self.shock_start_time, self.shock_end_time)
 
+        # Start and stop events of the shocks, advanced every time-step (the log of shocks applied is kept here as well)
+        self.shock_scheduler = ShockScheduler(self.shock_times, self.sm[1], self.sm[0], self.sim_step)
+
         self.density_collector = []
         self.sample_vehicles = 4 # How many vehicles to shock at a time
         self.shock_ids = [] 
@@ -184,11 +182,11 @@ class classicIntersectionEnv(IntersectionAccelEnv):
                             self.k.vehicle.set_vehicle_type(veh_id, veh_type, controller)
 
             # Shock is also only after warmup
-            if self.shock and self.step_counter >= self.shock_start_time and self.step_counter <= self.shock_end_time:
+            if self.shock:
                 if self.stability:
-                    self.perform_shock_stability(self.shock_times)
+                    self.perform_shock_stability()
                 else: 
-                    self.perform_shock(self.shock_times)
+                    self.perform_shock()
 
         return super().step(rl_actions)
 
@@ -224,7 +222,7 @@ class classicIntersectionEnv(IntersectionAccelEnv):
         #print(f"Shock ids: {shock_ids}")
         return shock_ids
     
-    def perform_shock(self, shock_times):
+    def perform_shock(self):
         """
         Human driven vehicles north, southbound perform shock.
         Can differentiate human driven vehicles from id. flow_20. and flow_00. are human driven vehicles north/ southbound
@@ -232,86 +230,59 @@ class classicIntersectionEnv(IntersectionAccelEnv):
         Shock modality: shock XX vehicles at a time
 
         """
-
-        # if vehicle IDs have a 'classic_00' in it, then its a classic vehicle
-        if self.step_counter == shock_times[0][0]: # This occurs only once
-            self.shock_ids = self.get_fresh_shock_ids()
-
-        # Get controllers and set shock time to False for selected vehicles (default behavior)
-        controllers = [self.k.vehicle.get_acc_controller(i) for i in self.shock_ids]
-        for controller in controllers:
-            controller.set_shock_time(False)
-
-        # Increment shock counter only after shock for the duration was complete
-        if self.shock_counter < len(self.sm[1]) and self.current_duration_counter >= self.sm[1][self.shock_counter]:
-            self.shock_counter += 1
-
-            # reset 
-            self.current_duration_counter = 0
-            self.shock_ids = self.get_fresh_shock_ids()
-
-        # sm[1] is a list of intensities, sm[2] is a list of durations and sm[3] is frequency
-        # if the shock counter is less than the frequency 
-        if self.shock_counter < self.sm[2]: # '<' because shock counter starts from zero
-            # if the we are in the precomputed shock times 
-            if self.step_counter >= shock_times[self.shock_counter][0] and \
-                self.step_counter <= shock_times[self.shock_counter][1]:
-                print(f"Step = {self.step_counter}, Shock params: {self.sm[0][self.shock_counter], self.sm[1][self.shock_counter], self.sm[2]} applied to vehicle {self.shock_ids}\n")
-                
-                # Set shock time to True for selected vehicles
-                for controller in controllers:
-                    controller.set_shock_accel(self.sm[0][self.shock_counter])
-                    controller.set_shock_time(True)
+        stopped, started = self.shock_scheduler.advance(self.step_counter)
+
+        if len(stopped) > 0:
+            # Set shock time to False for vehicles whose shock is over (default behavior), if they are still in the network
+            all_ids = set(self.k.vehicle.get_ids())
+            for shock, veh_ids in stopped:
+                for veh_id in veh_ids:
+                    if veh_id in all_ids:
+                        self.k.vehicle.get_acc_controller(veh_id).set_shock_time(False)
+            self.shock_ids = self.shock_scheduler.get_active_ids()
+
+        # sm[0] is a list of intensities, sm[1] is a list of durations and sm[2] is frequency
+        for shock in started:
+            shock_ids = self.get_fresh_shock_ids()
+            self.shock_scheduler.start(shock, shock_ids)
+            self.shock_ids = self.shock_scheduler.get_active_ids()
+            print(f"Step = {self.step_counter}, Shock params: {self.sm[0][shock], self.sm[1][shock], self.sm[2]} applied to vehicle {shock_ids}\n")
+
+            # Set shock time to True for selected vehicles
+            for i in shock_ids:
+                controller = self.k.vehicle.get_acc_controller(i)
+                controller.set_shock_accel(self.shock_scheduler.values[shock])
+                controller.set_shock_time(True)
 
                 # Change color to magenta
-                for i in self.shock_ids:
-                    self.k.vehicle.set_color(i, (255,0,255))
-                
-                self.current_duration_counter += 0.1 # increment current duration counter by one timestep seconds
-
+                self.k.vehicle.set_color(i, (255,0,255))
 
-    def perform_shock_stability(self, shock_times):
+    def perform_shock_stability(self):
         """
         Just check the steps and shock the first one after initial population
-        This is only called when the shock time starts anyway.
         """
+        stopped, started = self.shock_scheduler.advance(self.step_counter)
+
+        for shock, veh_ids in stopped:
+            for veh_id in veh_ids:
+                # Some things missing here because we only apply shocks once 
+                self.k.vehicle.get_acc_controller(veh_id).set_shock_time(False)
+                self.k.vehicle.set_max_speed(veh_id, 8) #V_enter
+            self.shock_ids = self.shock_scheduler.get_active_ids()
 
         # if the vehicle id is flow_10.1 then shock it i.e., have its leader perform a velocity perturbation
         # Leader is flow_00.4 and follower is flow_00.5
-        if self.step_counter == shock_times[0][0]: # This occurs only once
-            self.shock_ids = ['flow_00.4']
-
-        # Get controllers and set shock time to False for selected vehicles (default behavior)
-        controllers = [self.k.vehicle.get_acc_controller(i) for i in self.shock_ids]
-        for controller in controllers:
-            controller.set_shock_time(False)
+        for shock in started:
+            self.shock_scheduler.start(shock, ['flow_00.4'])
+            self.shock_ids = self.shock_scheduler.get_active_ids()
+            print(f"Step = {self.step_counter}, Shock params: {self.sm[0][shock], self.sm[1][shock], self.sm[2]} applied to vehicle {self.shock_ids}\n")
 
-        # Increment shock counter only after shock for the duration was complete
-        if self.shock_counter < len(self.sm[1]) and self.current_duration_counter >= self.sm[1][self.shock_counter]:
-            self.shock_counter += 1
+            # The stability shock is a velocity perturbation
+            self.k.vehicle.set_max_speed('flow_00.4', self.shock_scheduler.values[shock])
+            self.k.vehicle.get_acc_controller('flow_00.4').set_shock_time(True)
 
-            # reset
-            # Some things missing here because we only apply shocks once 
-            self.k.vehicle.set_max_speed(self.shock_ids[0], 8) #V_enter
-            
-        if self.shock_counter < self.sm[2]: # '<' because shock counter starts from zero
-            # if the we are in the precomputed shock times 
-            if self.step_counter >= shock_times[self.shock_counter][0] and \
-                self.step_counter <= shock_times[self.shock_counter][1]:
-
-                print(f"Step = {self.step_counter}, Shock params: {self.sm[0][self.shock_counter], self.sm[1][self.shock_counter], self.sm[2]} applied to vehicle {self.shock_ids}\n")
-                
-                # Set shock time to True for selected vehicles
-                for controller in controllers:
-                    # The stability shock is a velocity perturbation
-                    self.k.vehicle.set_max_speed(self.shock_ids[0], self.sm[0][0])
-                    controller.set_shock_time(True)
-
-                # Change color to magenta
-                for i in self.shock_ids:
-                    self.k.vehicle.set_color(i, (255,0,255))
-                
-                self.current_duration_counter += 0.1 # increment current duration counter by one timestep seconds
+            # Change color to magenta
+            self.k.vehicle.set_color('flow_00.4', (255,0,255))
 
 
     def additional_command(self):
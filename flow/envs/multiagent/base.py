@@ -11,6 +11,7 @@ from traci.exceptions import TraCIException
 
 from ray.rllib.env import MultiAgentEnv
 
+from flow.controllers.batched import get_batched_actions
 from flow.envs.base import Env
 from flow.utils.exceptions import FatalFlowError
 
@@ -54,11 +55,15 @@ class MultiEnv(MultiAgentEnv, Env):
 
             # perform acceleration actions for controlled human-driven vehicles
             if len(self.k.vehicle.get_controlled_ids()) > 0:
-                accel = []
-                for veh_id in self.k.vehicle.get_controlled_ids():
-                    accel_contr = self.k.vehicle.get_acc_controller(veh_id)
-                    action = accel_contr.get_action(self)
-                    accel.append(action)
+                if getattr(self.env_params, "batch_controllers", False):
+                    accel = get_batched_actions(
+                        self, self.k.vehicle.get_controlled_ids())
+                else:
+                    accel = []
+                    for veh_id in self.k.vehicle.get_controlled_ids():
+                        accel_contr = self.k.vehicle.get_acc_controller(veh_id)
+                        action = accel_contr.get_action(self)
+                        accel.append(action)
                 self.k.vehicle.apply_acceleration(
                     self.k.vehicle.get_controlled_ids(), accel)
 
@@ -173,8 +178,11 @@ class MultiEnv(MultiAgentEnv, Env):
         if self.sim_params.restart_instance or \
                 (self.step_counter > 2e6 and self.simulator != 'aimsun'):
             self.step_counter = 0
-            # issue a random seed to induce randomness into the next rollout
-            self.sim_params.seed = random.randint(0, 1e5)
+            # issue a random seed to induce randomness into the next rollout,
+            # unless the state after warmup is cached: it is keyed by the
+            # seed, so that a new seed would never hit the cache
+            if getattr(self.sim_params, "warmup_cache", None) is None:
+                self.sim_params.seed = random.randint(0, 1e5)
 
             self.k.vehicle = deepcopy(self.initial_vehicles)
             self.k.vehicle.master_kernel = self.k
@@ -256,8 +264,7 @@ class MultiEnv(MultiAgentEnv, Env):
             raise FatalFlowError(msg=msg)
 
         # perform (optional) warm-up steps before training
-        for _ in range(self.env_params.warmup_steps):
-            observation, _, _, _ = self.step(rl_actions=None)
+        self.warmup()
 
         # render a frame
         self.render(reset=True)
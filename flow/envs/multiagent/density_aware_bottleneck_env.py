@@ -8,6 +8,7 @@ import numpy as np
 #from flow.envs.base import Env
 #from flow.envs.bottleneck import BottleneckEnv
 from flow.envs.multiagent.base import MultiEnv
+from flow.utils.observation_buffer import ObservationBuffer
 from gym.spaces.box import Box
 
 """
@@ -66,6 +67,9 @@ class DensityAwareBottleneckEnv(MultiEnv):
         self.MAX_SPEED = 10 # This is just a normalizer for csc observations
         self.VEHICLE_LENGTH = 5 #m
         self.csc_model = self.load_csc_model()
+        # Preallocated CSC inputs (num_rl x 10 x 2) and observations (num_rl x 9) of all RL vehicles in a step, grown when there are more RL vehicles
+        self.csc_inputs = ObservationBuffer((10, 2), fill_value=-1.0)
+        self.observations = ObservationBuffer(9, fill_value=0.0, dtype=np.float64)
         self.label_meanings = ['Leaving', 'Forming', 'Free Flow', 'Congested', 'Undefined', 'No vehicle in front']
         # Create a dictionary to store the id, csc output and action of each RL vehicle
         self.rl_storedict = {}
@@ -202,10 +206,22 @@ class DensityAwareBottleneckEnv(MultiEnv):
         """
         Get the output of Traffic State Estimator Neural Network
         """
-        current_obs = torch.from_numpy(current_obs).flatten()
+        return self.get_csc_outputs(np.asarray(current_obs, dtype=np.float32)[None])[0:1]
+
+    def get_csc_outputs(self, current_obs):
+        """
+        Get the output of Traffic State Estimator Neural Network for many RL vehicles at once
+        current_obs: (num_rl x 10 x 2) float32 array, returns one label per RL vehicle
+        A single batched forward pass, instead of one per RL vehicle
+        """
+        if len(current_obs) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Shares memory with current_obs, no copy
+        current_obs = torch.from_numpy(current_obs).reshape(len(current_obs), -1)
 
         with torch.no_grad():
-            outputs = self.csc_model(current_obs.unsqueeze(0))
+            outputs = self.csc_model(current_obs)
 
         # print("csc output: ", outputs)
         # return outputs.numpy() # Logits
@@ -251,10 +267,13 @@ class DensityAwareBottleneckEnv(MultiEnv):
 
         return saved_best_net
     
-    def get_default_observations(self, rl_id, new_positions):
+    def get_default_observations(self, rl_id, new_positions, out=None):
         """
         We need to supply the position dict for the immediate leader
+        out: optional array of size 3 the observations are written into, instead of a new array
         """
+        if out is None:
+            out = np.zeros(3)
 
         lead_id = self.k.vehicle.get_leader_bottleneck(rl_id, self.lane_mapping_dict_outside, self.lane_mapping_dict_inside, new_positions, 100) # Leader itself maybe hard to get in the bottleneck. In zipper lanes
         if lead_id is not None:
@@ -263,25 +282,22 @@ class DensityAwareBottleneckEnv(MultiEnv):
             # Use similar normalizers,  arbitrary high values should suffice
             max_length = 270
 
-            observation = np.array([
-                self.k.vehicle.get_speed(rl_id) / self.MAX_SPEED,
-
-                (self.k.vehicle.get_speed(lead_id) - self.k.vehicle.get_speed(rl_id)) / self.MAX_SPEED,
-
-                # Distance vs new_position 3
-                # TODO: Use new_positions instead of distacnce?
-                # Lets say a vehicle just became leader by moving from lane 7 to lane 6. It will have more distance because of curvature.
-                # But its new_position will be less affected by curvature. 
-                #(self.k.vehicle.get_distance(lead_id) - self.k.vehicle.get_distance(rl_id)) / max_length # x is bad. Use distance here. This problem should be fixed
-                (new_positions[lead_id] - new_positions[rl_id]) / max_length
+            speeds = self.k.vehicle.get_speed_array([rl_id, lead_id])
+            out[0] = speeds[0] / self.MAX_SPEED
+            out[1] = (speeds[1] - speeds[0]) / self.MAX_SPEED
 
-                ])
+            # Distance vs new_position 3
+            # TODO: Use new_positions instead of distacnce?
+            # Lets say a vehicle just became leader by moving from lane 7 to lane 6. It will have more distance because of curvature.
+            # But its new_position will be less affected by curvature. 
+            #(self.k.vehicle.get_distance(lead_id) - self.k.vehicle.get_distance(rl_id)) / max_length # x is bad. Use distance here. This problem should be fixed
+            out[2] = (new_positions[lead_id] - new_positions[rl_id]) / max_length
         
         else: # Current solution. In zipper lanes, if there is no leader, then we are not observing the leader
             #print(f"RL id: {rl_id} No leader")
-            observation = np.array([-1, -1, -1])
+            out[:] = -1
         
-        return observation
+        return out
     
     def get_state(self):
         """
@@ -361,8 +377,15 @@ class DensityAwareBottleneckEnv(MultiEnv):
 
         ########## FOR REGULAR TRAINING ##########
         new_positions = self.k.vehicle.corrected_position_zipper()
-        observation = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
+        rl_ids = self.k.vehicle.get_rl_ids()
+
+        # The default input to csc is set to -1, the one hot encoded csc outputs to 0
+        csc_inputs = self.csc_inputs.rows(len(rl_ids))
+        observations = self.observations.rows(len(rl_ids))
+
+        # First fill the CSC observations of all RL vehicles, then get all CSC outputs in a single forward pass
+        all_sorted_veh_ids = []
+        for index, rl_id in enumerate(rl_ids):
 
             # Get the CSC observations for each RL vehicle 
             # The order of vehicles should be increasing in the order of distance to the RL vehicle (include RL vehicle itself at 0th index)
@@ -372,40 +395,35 @@ class DensityAwareBottleneckEnv(MultiEnv):
             # In that case, we will only consider the first 10 vehicles in the local zone.
             sorted_veh_ids = sorted_veh_ids[:10] # Only truncates if there are more than 10
             # print(f"RL id: {rl_id} Sorted veh ids: {sorted_veh_ids}") #TODO: Verify this. Verified.
-            
-            if len(sorted_veh_ids) == 0:
-                csc_output_encoded = np.zeros(6) # i.e., nothing
-            
-            else:
+            all_sorted_veh_ids.append(sorted_veh_ids)
+
+            if len(sorted_veh_ids) > 0:
                 # For csc, both relative position and relative velocity to the leaders in the zone are required. 
-                # The default input to csc is set to -1
-                observation_csc = np.full((10, 2), -1.0) # Max 10 vehicles, with 2 properties each. Make this LOCAL_ZONE dependent?
+                # Max 10 vehicles, with 2 properties each. Make this LOCAL_ZONE dependent?
                 # Distance vs new_position 1
                 #rl_pos = self.k.vehicle.get_distance(rl_id) # get_x_by distance may be misleading so using this. #TODO: Verify this. Verified.
                 rl_pos = new_positions[rl_id] 
-                
-
-                for i in range(len(sorted_veh_ids)):
-                    # Distance vs new_position 2
-                    #distance = self.k.vehicle.get_distance(sorted_veh_ids[i])
-                    #rel_pos = (distance - rl_pos)
 
-                    veh_position = new_positions[sorted_veh_ids[i]]
-                    rel_pos = (veh_position - rl_pos)
-                    # print(f"RL id: {rl_id} Sorted veh id: {sorted_veh_ids[i]} New position: {veh_position}")
-                    norm_pos = rel_pos / self.LOCAL_ZONE
+                # Distance vs new_position 2
+                #distance = self.k.vehicle.get_distance(sorted_veh_ids[i])
+                #rel_pos = (distance - rl_pos)
+                veh_positions = np.fromiter((new_positions[veh_id] for veh_id in sorted_veh_ids), dtype=np.float64, count=len(sorted_veh_ids))
+                csc_inputs[index, :len(sorted_veh_ids), 0] = (veh_positions - rl_pos) / self.LOCAL_ZONE
+                csc_inputs[index, :len(sorted_veh_ids), 1] = self.k.vehicle.get_speed_array(sorted_veh_ids) / self.MAX_SPEED
 
-                    vel = self.k.vehicle.get_speed(sorted_veh_ids[i])
-                    norm_vel = vel / self.MAX_SPEED
+        csc_outputs = self.get_csc_outputs(csc_inputs)
 
-                    observation_csc[i] = [norm_pos, norm_vel]
+        for index, rl_id in enumerate(rl_ids):
+            sorted_veh_ids = all_sorted_veh_ids[index]
+            # First three are the default observations, last six the encoded csc output
+            obs_for_this_vehicle = observations[index]
 
-                observation_csc = np.array(observation_csc, dtype=np.float32)
-                csc_output = self.get_csc_output(observation_csc)
+            if len(sorted_veh_ids) == 0:
+                csc_output = np.array([5]) # i.e., nothing (No vehicle in front)
+            else:
+                csc_output = csc_outputs[index:index + 1]
                 #print(f"RL id: {rl_id} CSC output: {self.label_meanings[csc_output[0]]}\n")
-
-                csc_output_encoded = np.zeros(6)
-                csc_output_encoded[csc_output] = 1 # i.e. something
+                obs_for_this_vehicle[3 + csc_output[0]] = 1 # i.e. something
 
             #print("\n")
             # Add items to the dict
@@ -417,7 +435,7 @@ class DensityAwareBottleneckEnv(MultiEnv):
             # csc output is free flow 
             if csc_output[0] == 2: 
                 # Get an estimate of the free flow speed 
-                estimate = 0.40 * np.mean([self.k.vehicle.get_speed(veh_id) for veh_id in sorted_veh_ids]) 
+                estimate = 0.40 * np.mean(self.k.vehicle.get_speed_array(sorted_veh_ids)) 
                 # May need to change the scalar based on penetration rate. 
                 # 0.40 for penetration rates of 0.05
                 # 0.40 for penetration rates of 0.20
@@ -427,15 +445,14 @@ class DensityAwareBottleneckEnv(MultiEnv):
                 if estimate > self.free_flow_speed:
                     self.free_flow_speed = estimate
             
-            # Concatenate observations and return 
-            default_obs = self.get_default_observations(rl_id, new_positions)
-            obs_for_this_vehicle = np.concatenate((default_obs, csc_output_encoded), axis=None)
+            # Write the default observations in place and return 
+            self.get_default_observations(rl_id, new_positions, out=obs_for_this_vehicle[:3])
             # TODO: Make sure this is good. 
-            observation[rl_id] = obs_for_this_vehicle
             #print(f"RL id: {rl_id} Observation: {obs_for_this_vehicle}")
             
         #print(f"Free flow speed: {self.free_flow_speed}")
-        return observation
+        # One array for all RL vehicles, a view of it for each
+        return ObservationBuffer.as_dict(rl_ids, observations)
 
     def compute_reward(self, rl_actions, **kwargs):
         """
@@ -630,4 +647,13 @@ class DensityAwareBottleneckEnv(MultiEnv):
         """
         self.rl_storedict = {}
         return super().reset()
+
+    def get_warmup_state(self):
+        """
+        The free flow speed estimate and CSC outputs are updated during warmup as well
+        """
+        state = super().get_warmup_state()
+        state['rl_storedict'] = self.rl_storedict
+        state['free_flow_speed'] = self.free_flow_speed
+        return state
     
\ No newline at end of file
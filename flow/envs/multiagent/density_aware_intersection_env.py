@@ -5,6 +5,7 @@ import numpy as np
 from gym.spaces.box import Box
 from time import strftime
 from flow.envs.multiagent.base import MultiEnv
+from flow.utils.observation_buffer import ObservationBuffer
 
 ADDITIONAL_ENV_PARAMS = {
     # minimum switch time for each traffic light (in seconds)
@@ -43,6 +44,10 @@ class DensityAwareIntersectionEnv(MultiEnv):
         self.CSC_model = self.load_csc_model()
         self.rl_storedict = {}
 
+        # Preallocated CSC inputs (num_rl x 10 x 2) and observations (num_rl x 9) of all RL vehicles in a step, grown when there are more RL vehicles
+        self.CSC_inputs = ObservationBuffer((self.LOCAL_ZONE // self.VEHICLE_LENGTH, 2), fill_value=-1.0)
+        self.observations = ObservationBuffer(9, fill_value=0.0, dtype=np.float64)
+
     @property
     def observation_space(self):
                    
@@ -67,10 +72,13 @@ class DensityAwareIntersectionEnv(MultiEnv):
                 shape=(1,),
                 dtype=np.float32)
         
-    def get_default_observations(self, rl_id):
+    def get_default_observations(self, rl_id, out=None):
         """
         Get the default 3 observations for each RL vehicle.
+        out: optional array of size 3 the observations are written into, instead of a new array
         """
+        if out is None:
+            out = np.zeros(3)
 
         if self.k.vehicle.get_leader(rl_id) is not None:
             lead_id = self.k.vehicle.get_leader(rl_id)
@@ -79,32 +87,42 @@ class DensityAwareIntersectionEnv(MultiEnv):
             # Normalizers,  arbitrary high values should suffice
             max_length = 270
 
-            observation = np.array([
-                self.k.vehicle.get_speed(rl_id) / self.MAX_SPEED,
-
-                (self.k.vehicle.get_speed(lead_id) - self.k.vehicle.get_speed(rl_id)) / self.MAX_SPEED,
+            speeds = self.k.vehicle.get_speed_array([rl_id, lead_id])
+            distances = self.k.vehicle.get_state_array("distance", [rl_id, lead_id])
+            out[0] = speeds[0] / self.MAX_SPEED
+            out[1] = (speeds[1] - speeds[0]) / self.MAX_SPEED
 
-                # But  the x value is not reliable and can be randomly very large. So replace it with distance travelled so far
-                # Since we are taking the difference, it represents the same thing.
-                #(self.k.vehicle.get_x_by_id(lead_id) - self.k.vehicle.get_x_by_id(rl_id)) / max_length
-                (self.k.vehicle.get_distance(lead_id) - self.k.vehicle.get_distance(rl_id)) / max_length
+            # But  the x value is not reliable and can be randomly very large. So replace it with distance travelled so far
+            # Since we are taking the difference, it represents the same thing.
+            #(self.k.vehicle.get_x_by_id(lead_id) - self.k.vehicle.get_x_by_id(rl_id)) / max_length
+            out[2] = (distances[1] - distances[0]) / max_length
 
-                ])
         # If there is no leader, then we are not observing the leader
         else:
-            observation = np.array([-1, -1, -1])
+            out[:] = -1
         
-        #print(f"RL id: {rl_id} Observation: {observation}")
-        return observation
+        #print(f"RL id: {rl_id} Observation: {out}")
+        return out
     
     def get_CSC_output(self, current_obs):
         """
         Get the output of Traffic State Estimator Neural Network
         """
-        current_obs = torch.from_numpy(current_obs).flatten()
+        return self.get_CSC_outputs(np.asarray(current_obs, dtype=np.float32)[None])[0:1]
+
+    def get_CSC_outputs(self, current_obs):
+        """
+        Get the output of Traffic State Estimator Neural Network for many RL vehicles at once
+        current_obs: (num_rl x 10 x 2) float32 array, returns one label per RL vehicle
+        """
+        if len(current_obs) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Shares memory with current_obs, no copy
+        current_obs = torch.from_numpy(current_obs).reshape(len(current_obs), -1)
 
         with torch.no_grad():
-            outputs = self.CSC_model(current_obs.unsqueeze(0))
+            outputs = self.CSC_model(current_obs)
 
         # print("CSC output: ", outputs)
         # return outputs.numpy() # Logits
@@ -341,30 +359,26 @@ class DensityAwareIntersectionEnv(MultiEnv):
         rl_dist = self.k.vehicle.get_distance(rl_id) # get x is broken, get distance is used.
 
         print(f"\n\n selected RL id: {rl_id}\n\n")
-        observation_CSC = np.full((self.LOCAL_ZONE // self.VEHICLE_LENGTH, 2), -1.0) # (10, 2)
+        observation_CSC = self.CSC_inputs.rows(1)[0] # (10, 2)
 
         timestep = self.step_counter
-        # distances of vehicles in the local zone
-        distances = []
 
         # This is sorted from closest to farthest and includes RL
         sorted_veh_ids = self.k.vehicle.get_veh_list_local_zone_intersection(rl_id, self.LOCAL_ZONE)
         self.rl_storedict[rl_id] = {'veh_in_zone': sorted_veh_ids }
         # This is sorted from RL vehicle at index 0 to farthest at index n
 
-        for i in range(len(sorted_veh_ids)):
-            # Get the distance of the vehicle from the RL vehicle
-            rel_pos = self.k.vehicle.get_distance(sorted_veh_ids[i]) - rl_dist
-            norm_pos = rel_pos / self.LOCAL_ZONE # Normalize it
-            distances.append(norm_pos)
-
-            vel = self.k.vehicle.get_speed(sorted_veh_ids[i])
-            norm_vel = vel / self.MAX_SPEED # Normalize it
-
-            observation_CSC[i] = [norm_pos, norm_vel]
+        # Get the distance of the vehicles from the RL vehicle, and normalize it
+        # distances of vehicles in the local zone
+        distances = (self.k.vehicle.get_state_array("distance", sorted_veh_ids) - rl_dist) / self.LOCAL_ZONE
+        observation_CSC[:len(sorted_veh_ids), 0] = distances
+        observation_CSC[:len(sorted_veh_ids), 1] = self.k.vehicle.get_speed_array(sorted_veh_ids) / self.MAX_SPEED # Normalize it
 
+        # Copied, so that the stored data is not overwritten at the next step
+        observation = ObservationBuffer.as_dict([rl_id], observation_CSC[None])
+        observation_CSC = observation[rl_id]
 
-        label = self.get_monotonicity_label(distances)
+        label = self.get_monotonicity_label(distances.tolist())
         print(f"Writing data: {timestep}, {label}, {observation_CSC}")
         
         self.data_storage.append([timestep, label, observation_CSC])
@@ -374,52 +388,52 @@ class DensityAwareIntersectionEnv(MultiEnv):
                 os.makedirs("./csc_data")
             np.save("./csc_data/csc_data_{}.npy".format(strftime("%Y-%m-%d-%H:%M:%S")), np.array(self.data_storage))
 
-        return {self.selected_rl_id: observation_CSC}
+        return observation
 
         ########## FOR REGULAR TRAINING ##########
         # self.rl_storedict = {}
-        # observation = {}
-        # for rl_id in self.k.vehicle.get_rl_ids():
+        # rl_ids = self.k.vehicle.get_rl_ids()
+
+        # # For CSC, both relative position and relative velocity to the leaders in zone are required
+        # # The default input to CSC is set to -1. One row per RL vehicle, all evaluated in a single forward pass
+        # observation_CSC = self.CSC_inputs.rows(len(rl_ids))
+        # # The one hot encoded CSC outputs are set to 0
+        # observations = self.observations.rows(len(rl_ids))
+        # all_sorted_veh_ids = []
+        # for index, rl_id in enumerate(rl_ids):
 
         #     # Get the CSC observations for each RL vehicle
         #     # Increasing in the order of distance to the RL vehicle (including RL as well)
         #     # Get vehicle list in the local zone for intersection.
         #     sorted_veh_ids = self.k.vehicle.get_veh_list_local_zone_intersection(rl_id, self.LOCAL_ZONE)
+        #     all_sorted_veh_ids.append(sorted_veh_ids)
 
-        #     if len(sorted_veh_ids) == 0:
-        #             CSC_output_encoded = np.zeros(6) # i.e., nothing
-
-        #     else:
-        #         # For CSC, both relative position and relative velocity to the leaders in zone are required
-        #         # The default input to CSC is set to -1
-        #         observation_CSC = np.full((10, 2), -1.0) # Max 2 vehicles with 2 properties
+        #     if len(sorted_veh_ids) > 0:
         #         rl_pos = self.k.vehicle.get_distance(rl_id) #self.k.vehicle.get_x_by_id(rl_id) 
 
-        #         # Go through each sorted vehicle to get CSC output
-        #         for i in range(len(sorted_veh_ids)):
-
-        #             # Lets not use x to get relative positions, lets use total distance travelled
-        #             # Since these vehicles are always ahead of RL, rel_pos will be a positive value
-        #             rel_pos = self.k.vehicle.get_distance(sorted_veh_ids[i]) - rl_pos
-        #             norm_pos = rel_pos / self.LOCAL_ZONE # Normalize it
-
-        #             vel = self.k.vehicle.get_speed(sorted_veh_ids[i])
-        #             norm_vel = vel / self.MAX_SPEED # Normalize it
-        #             observation_CSC[i] = [norm_pos, norm_vel]
-
-        #         observation_CSC = np.array(observation_CSC, dtype = np.float32)
-
-        #         # For using CSC model: add CSC output to appropriate observation
-        #         CSC_output = self.get_CSC_output(observation_CSC)
-        #         CSC_output_encoded = np.zeros(6) 
-        #         CSC_output_encoded[CSC_output] = 1 # i.e. something
-
+        #         # Lets not use x to get relative positions, lets use total distance travelled
+        #         # Since these vehicles are always ahead of RL, rel_pos will be a positive value
+        #         rel_pos = self.k.vehicle.get_state_array("distance", sorted_veh_ids) - rl_pos
+        #         observation_CSC[index, :len(sorted_veh_ids), 0] = rel_pos / self.LOCAL_ZONE # Normalize it
+        #         observation_CSC[index, :len(sorted_veh_ids), 1] = self.k.vehicle.get_speed_array(sorted_veh_ids) / self.MAX_SPEED # Normalize it
+
+        # # For using CSC model: add CSC output to appropriate observation
+        # CSC_outputs = self.get_CSC_outputs(observation_CSC)
+
+        # for index, rl_id in enumerate(rl_ids):
+        #     sorted_veh_ids = all_sorted_veh_ids[index]
+        #     # First three are the default observations, last six the encoded CSC output (all 0 i.e., nothing)
+        #     obs_for_this_vehicle = observations[index]
+        #     if len(sorted_veh_ids) > 0:
+        #         CSC_output = CSC_outputs[index:index + 1]
+        #         obs_for_this_vehicle[3 + CSC_output[0]] = 1 # i.e. something
         #         self.rl_storedict[rl_id] = {'veh_in_zone': sorted_veh_ids , 'CSC_output': CSC_output, 'action': 0}
 
-        #     # Concatenate them and return
-        #     default_observation = self.get_default_observations(rl_id)
-        #     obs_for_this_vehicle = np.concatenate((default_observation, CSC_output_encoded), axis=None)
-        #     observation[rl_id] = obs_for_this_vehicle
+        #     # Write the default observations in place
+        #     self.get_default_observations(rl_id, out=obs_for_this_vehicle[:3])
+
+        # # One array for all RL vehicles, a view of it for each
+        # observation = ObservationBuffer.as_dict(rl_ids, observations)
 
         # #print(f"\n\nObservation: {observation}\n\n")
         # # print observation keys
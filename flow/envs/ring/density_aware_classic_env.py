@@ -7,6 +7,7 @@ from gym.spaces.box import Box
 from flow.controllers import BCMController, LACController, IDMController
 from flow.controllers.velocity_controllers import FollowerStopper, PISaturation
 from flow.envs.ring.accel import AccelEnv
+from flow.core.shock_scheduler import ShockScheduler
 
 from flow.density_aware_util import get_shock_model, get_time_steps, get_time_steps_stability
 
@@ -67,12 +68,6 @@ class classicEnv(AccelEnv):
         else: 
             self.sm = get_shock_model(self.shock_params['shock_model'], bidirectional=True)
             
-        # count how many times, shock has been applies
-        self.shock_counter = 0
-
-        # Count duration of current shock (in timesteps)
-        self.current_duration_counter = 0
-
         # Get the shock id of a single vehicle, randomly shuffled every time a shock is applied (not every time-step)
         self.single_shock_id = [] 
 
@@ -82,6 +77,9 @@ class classicEnv(AccelEnv):
         else:
             self.shock_times = get_time_steps(self.sm[1], self.sm[2], self.shock_start_time, self.shock_end_time)
 
+        # Start and stop events of the shocks, advanced every time-step (the log of shocks applied is kept here as well)
+        self.shock_scheduler = ShockScheduler(self.shock_times, self.sm[1], self.sm[0], self.sim_step)
+
     @property
     def action_space(self):
         """See class definition."""
@@ -104,19 +102,17 @@ class classicEnv(AccelEnv):
                 # All vehicles that are not controller vehicles have the ability to shock
                 self.shock_veh_ids = [veh_id for veh_id in self.other_ids \
                     if self.k.vehicle.get_acc_controller(veh_id).shock_vehicle == True]
-                
-                # Randomly choose one to perform shock, for a start
-                self.single_shock_id = np.random.choice(self.shock_veh_ids, 1 )[0]
+
 
                 if self.shock_veh_ids == []:
                     raise ValueError("No shock vehicles found")
         
-        # Between shock start and end times, perform shock
-        if self.shock and self.step_counter >= self.shock_start_time and self.step_counter <= self.shock_end_time: #<= is fine, handeled in perform_shock
+        # Start and stop the shocks due at this time-step
+        if self.shock:
             if self.stability:
-                self.perform_shock_stability(self.shock_times)
+                self.perform_shock_stability()
             else: 
-                self.perform_shock(self.shock_times)
+                self.perform_shock()
 
         # At warmup, change vehicle type from all IDM to (method types)
         if self.step_counter == self.warmup_steps:
@@ -147,73 +143,60 @@ class classicEnv(AccelEnv):
             
         return super().step(rl_actions)
 
-    def perform_shock(self, shock_times):
+    def perform_shock(self):
         # Facts: We can only set intended acceleration, actual (realized) acceleration is computed by the simulator
-        #print(f"Step: {self.step_counter}, Shock counter: {self.shock_counter}")
+        stopped, started = self.shock_scheduler.advance(self.step_counter)
 
-        # This is instantiated for every veh_id, we get for just the vehicle we selected as the shock vehicle
-        controller = self.k.vehicle.get_acc_controller(self.single_shock_id) 
-        # change color to white
-        self.k.vehicle.set_color(self.single_shock_id, (255, 255, 255))
-        
-        # Default: at times when shock is not applied, get acceleration from IDM
-        controller.set_shock_time(False) 
+        for shock, veh_ids in stopped:
+            for veh_id in veh_ids:
+                # Default: at times when shock is not applied, get acceleration from IDM
+                self.k.vehicle.get_acc_controller(veh_id).set_shock_time(False)
+                # change color to white
+                self.k.vehicle.set_color(veh_id, (255, 255, 255))
 
-        # Reset duration counter and increase shock counter, after completion of a shock duration
-        if self.current_duration_counter == self.sm[1][self.shock_counter]*10:
-            self.shock_counter += 1
-            self.current_duration_counter = 0
+        for shock in started:
+            # Random selection of the vehicle for this shock
+            # Incase we want to set probabilities in the future, the line below can provide that as well
+            self.single_shock_id = np.random.choice(self.shock_veh_ids, 1 )[0]
+            self.shock_scheduler.start(shock, [self.single_shock_id])
+            print(f"Step = {self.step_counter}, Shock params: {self.sm[0][shock], self.sm[1][shock], self.sm[2]} applied to vehicle {self.single_shock_id}\n")
 
-            #print("\n\nRESET COUNTER\n\n")
+            # This is instantiated for every veh_id, we get for just the vehicle we selected as the shock vehicle
+            controller = self.k.vehicle.get_acc_controller(self.single_shock_id)
+            controller.set_shock_accel(self.shock_scheduler.values[shock])
+            controller.set_shock_time(True)
 
-            # Random selection for next duration
-            # Incase we want to set probabilities in the future, the line below can provide that as well
-            self.single_shock_id = np.random.choice(self.shock_veh_ids, 1 )[0] 
-            
-        if self.shock_counter < self.sm[2]: # '<' because Shock counter starts counting from 0, sm[2] is the number of shocks
-            if self.step_counter >= shock_times[self.shock_counter][0] and \
-                self.step_counter <= shock_times[self.shock_counter][1]:
-                print(f"Step = {self.step_counter}, Shock params: {self.sm[0][self.shock_counter], self.sm[1][self.shock_counter], self.sm[2]} applied to vehicle {self.single_shock_id}\n")
-                
-                controller.set_shock_accel(self.sm[0][self.shock_counter])
-                controller.set_shock_time(True)
-
-                # change color to magenta
-                self.k.vehicle.set_color(self.single_shock_id, (255, 0, 255))
-                self.current_duration_counter += 1
+            # change color to magenta
+            self.k.vehicle.set_color(self.single_shock_id, (255, 0, 255))
         
     # For stability
-    def perform_shock_stability(self, shock_times):
+    def perform_shock_stability(self):
         # Shock_time for each ModifiedIDM controller is set to False by default 
         # We manipulate the speed of the vehicle instead
         # Since we only want to vary the speed of the leader (human_0), no need to make use of random choice in single_shock_id
         if self.method_name =='idm':
             self.single_shock_id = 'idm_0'
-            speed_limit = self.k.vehicle.get_max_speed('idm_1')
+            reference_id = 'idm_1'
 
         else: 
             self.single_shock_id = 'human_0'
-            
+            reference_id = 'human_1' # Hacky, get the speed limit of other vehicles instead
+
+        stopped, started = self.shock_scheduler.advance(self.step_counter)
+
+        for shock, veh_ids in stopped:
+            # When the velocity is not being dip, the max speed is set to speed limit (get from net_params, additional_params).
+            speed_limit = self.k.vehicle.get_max_speed(reference_id)
+            for veh_id in veh_ids:
+                self.k.vehicle.set_max_speed(veh_id, speed_limit)
+
+        for shock in started:
             # velocity shock model 
             # dip_velocity, duration, frequency = self.sm
-            speed_limit = self.k.vehicle.get_max_speed('human_1')# Hacky, get the speed limit of other vehicles instead
-
-        # When the velocity is not being dip, the max speed is set to speed limit (get from net_params, additional_params).
-        self.k.vehicle.set_max_speed(self.single_shock_id, speed_limit) 
+            self.shock_scheduler.start(shock, [self.single_shock_id])
+            print(f"Step = {self.step_counter}, Shock params: {self.sm[0], self.sm[1], self.sm[2]} applied to vehicle {self.single_shock_id}\n")
 
-        # Reset duration counter and increase shock counter, after completion of a shock duration
-        if self.current_duration_counter == self.sm[1]*10:
-            self.shock_counter += 1
-            self.current_duration_counter = 0
-        
-        if self.shock_counter < self.sm[2]: # '<' because Shock counter starts counting from 0, sm[2] is the number of shocks
-            if self.step_counter >= shock_times[self.shock_counter][0] and \
-                self.step_counter <= shock_times[self.shock_counter][1]:
-                print(f"Step = {self.step_counter}, Shock params: {self.sm[0], self.sm[1], self.sm[2]} applied to vehicle {self.single_shock_id}\n")
-                
-                self.k.vehicle.set_max_speed(self.single_shock_id, self.sm[0])
-
-                self.current_duration_counter += 1
+            self.k.vehicle.set_max_speed(self.single_shock_id, self.shock_scheduler.values[shock])
 
     def additional_command(self):
         # Dont set observed for classic methods
@@ -29,6 +29,9 @@ ADDITIONAL_ENV_PARAMS = {
     'ring_length': [220, 270],
 }
 
+# the CSC model, loaded once per process and shared by all environments
+_CSC_MODEL = None
+
 class DensityAwareRLEnv(Env):
     """
     Docs here
@@ -58,6 +61,15 @@ class DensityAwareRLEnv(Env):
         self.csc_output_encoded = None
         self.estimated_free_speed = 0
 
+        # CSC output computed outside of the environment, and the CSC observation it was computed from (see set_csc_output)
+        self._pending_csc_output = None
+        self._pending_csc_observation = None
+
+        # Preallocated CSC input and observation, filled in place at every step instead of allocating new arrays
+        # The observation is copied by the base environment before being returned
+        self._csc_observation = np.full((10, 2), -1.0, dtype=np.float32)
+        self._observation = np.zeros(9)
+
     @property
     def action_space(self):
         """ 
@@ -275,10 +287,20 @@ class DensityAwareRLEnv(Env):
         """
         Get the output of Traffic State Estimator Neural Network
         """
-        current_obs = torch.from_numpy(current_obs).flatten()
+        return self.get_csc_outputs([current_obs])[:1]
+
+    @classmethod
+    def get_csc_outputs(cls, observations):
+        """
+        Get the outputs of the Traffic State Estimator Neural Network for a batch of CSC observations
+        (e.g. of all the environments of a vectorized environment), in a single forward pass.
+        Returns one predicted label per observation
+        """
+        current_obs = torch.from_numpy(np.stack([
+            np.asarray(obs, dtype=np.float32).flatten() for obs in observations]))
 
         with torch.no_grad():
-            outputs = self.csc_model(current_obs.unsqueeze(0))
+            outputs = cls.load_csc_model()(current_obs)
 
         # print("csc output: ", outputs)
         # return outputs.numpy() # Logits
@@ -286,13 +308,28 @@ class DensityAwareRLEnv(Env):
         _, predicted_label = torch.max(outputs, 1)
         predicted_label = predicted_label.numpy()
         return predicted_label
+
+    def set_csc_output(self, label, csc_observation=None):
+        """
+        Set the CSC output used by the next call to get_state, when it was computed outside of the environment
+        (e.g. batched over several environments, see flow.utils.vector_env)
+        csc_observation is what get_csc_observation returned for this step, reused by get_state instead of being built again
+        """
+        self._pending_csc_output = np.array([label])
+        self._pending_csc_observation = csc_observation
         
 
     # Helper 4: Load csc model 
-    def load_csc_model(self, ):
+    @staticmethod
+    def load_csc_model():
         """
         Load the Traffic State Estimator Neural Network and its trained weights
+        The model is loaded once per process, and shared by all environments
         """
+        global _CSC_MODEL
+        if _CSC_MODEL is not None:
+            return _CSC_MODEL
+
         class csc_Net(nn.Module):
             def __init__(self, input_size, num_classes):
                 super(csc_Net, self).__init__() 
@@ -319,9 +356,40 @@ class DensityAwareRLEnv(Env):
         saved_best_net.load_state_dict(state_dict)
         saved_best_net.eval()
 
+        _CSC_MODEL = saved_best_net
         return saved_best_net
 
 
+    def get_csc_observation(self):
+        """
+        Observation of the CSC model: relative position difference (normalized by the local zone) and
+        absolute velocity (normalized by the max speed) of the vehicles in the local zone, RL at index 0.
+        Returns the vehicles in the local zone as well
+        """
+        rl_id = self.k.vehicle.get_rl_ids()[0]
+        rl_pos = self.k.vehicle.get_x_by_id(rl_id)
+        current_length = self.k.network.length()
+
+        # This is sorted as ['human_0', 'human_1', 'human_2', 'human_3', 'rl_0'], with human_3 as furthest
+        sorted_veh_ids = self.k.vehicle.get_veh_list_local_zone(rl_id, self.k.network.length(), self.LOCAL_ZONE)
+        # sorting needs to be RL at index 0 with furthest vehicle at index n
+        sorted_veh_ids.remove('rl_0')  
+        sorted_veh_ids.insert(0, 'rl_0')
+
+        # float32 required for torch. The default input to csc is set to -1
+        # The buffer is overwritten at the next call
+        observation_csc = self._csc_observation
+        observation_csc.fill(-1.0)
+        num_veh = len(sorted_veh_ids)
+
+        # Get the distance of the vehicles from the RL vehicle. This is actually the normalized distance
+        rel_pos = (self.k.vehicle.get_x_array(sorted_veh_ids) - rl_pos) % current_length
+        observation_csc[:num_veh, 0] = rel_pos / self.LOCAL_ZONE
+        observation_csc[:num_veh, 1] = self.k.vehicle.get_speed_array(sorted_veh_ids) / self.MAX_SPEED
+
+        #label = self.get_monotonicity_label(rel_pos / self.LOCAL_ZONE)
+        return sorted_veh_ids, observation_csc
+
     def get_state(self):
         """ 
         Relative position difference (normalized by the ring length)
@@ -377,33 +445,22 @@ class DensityAwareRLEnv(Env):
     
         ########## FOR REGULAR TRAINING ##########
         rl_id = self.k.vehicle.get_rl_ids()[0]
-        rl_pos = self.k.vehicle.get_x_by_id(rl_id)
-        current_length = self.k.network.length()
-
-        # This is sorted as ['human_0', 'human_1', 'human_2', 'human_3', 'rl_0'], with human_3 as furthest
-        sorted_veh_ids = self.k.vehicle.get_veh_list_local_zone(rl_id, self.k.network.length(), self.LOCAL_ZONE)
-        # sorting needs to be RL at index 0 with furthest vehicle at index n
-        sorted_veh_ids.remove('rl_0')  
-        sorted_veh_ids.insert(0, 'rl_0')
-
-        #distances = []
-        observation_csc = np.full((10, 2), -1.0)
-        for i in range(len(sorted_veh_ids)):
-            # Get the distance of the vehicle from the RL vehicle
-            rel_pos = (self.k.vehicle.get_x_by_id(sorted_veh_ids[i]) - rl_pos) % current_length
-            norm_pos = rel_pos / self.LOCAL_ZONE # This is actually the normalized distance
-            #distances.append(norm_pos)
-
-            vel = self.k.vehicle.get_speed(sorted_veh_ids[i])
-            norm_vel = vel / self.MAX_SPEED
-            observation_csc[i] = [norm_pos, norm_vel]
-
-        #label = self.get_monotonicity_label(distances)
-        observation_csc = np.array(observation_csc, dtype = np.float32) # required for torch
+        if self._pending_csc_observation is not None:
+            sorted_veh_ids, observation_csc = self._pending_csc_observation
+        else:
+            sorted_veh_ids, observation_csc = self.get_csc_observation()
+        self._pending_csc_observation = None
 
         # For using csc model: add csc output to appropriate observation
-        self.csc_output = self.get_csc_output(observation_csc)
-        self.csc_output_encoded = np.zeros(6) 
+        if self._pending_csc_output is not None:
+            self.csc_output = self._pending_csc_output
+            self._pending_csc_output = None
+        else:
+            self.csc_output = self.get_csc_output(observation_csc)
+        # The last 6 entries of the observation are the one hot encoded csc output
+        observation = self._observation
+        self.csc_output_encoded = observation[3:]
+        self.csc_output_encoded.fill(0)
         self.csc_output_encoded[self.csc_output] = 1 
 
         #print(f"csc output: {self.csc_output}, one hot encoded: {self.csc_output_encoded}, meaning: {self.label_meaning[self.csc_output[0]]}")
@@ -417,30 +474,26 @@ class DensityAwareRLEnv(Env):
             max_speed = 15.
             max_length = self.env_params.additional_params['ring_length'][1]
 
-            observation = np.array([
-            self.k.vehicle.get_speed(rl_id) / max_speed,
-            (self.k.vehicle.get_speed(lead_id) -
-            self.k.vehicle.get_speed(rl_id)) / max_speed,
-            (self.k.vehicle.get_x_by_id(lead_id) -
-            self.k.vehicle.get_x_by_id(rl_id)) % self.k.network.length()
-            / max_length
-            ])
+            speeds = self.k.vehicle.get_speed_array([rl_id, lead_id])
+            xs = self.k.vehicle.get_x_array([rl_id, lead_id])
+            observation[0] = speeds[0] / max_speed
+            observation[1] = (speeds[1] - speeds[0]) / max_speed
+            observation[2] = (xs[1] - xs[0]) % self.k.network.length() / max_length
         
         # Dont observe the leader
         else:
-            observation = np.array([-1, -1, -1]) # the second -1 could be plausible above but unlikely
+            observation[:3] = -1 # the second -1 could be plausible above but unlikely
 
         # If time steps are less than warmup + 300 then estimate the free speed
         if (self.step_counter > self.env_params.warmup_steps and self.step_counter < self.env_params.warmup_steps + 300):
             # csc output is free flow
             if self.csc_output[0] == 2:
-                estimate = 0.70*np.mean([self.k.vehicle.get_speed(veh_id) for veh_id in sorted_veh_ids])
+                estimate = 0.70*np.mean(self.k.vehicle.get_speed_array(sorted_veh_ids))
                 if estimate > self.estimated_free_speed:
                     self.estimated_free_speed = estimate
         
         #print(f"Estimated free speed: {self.estimated_free_speed}")
 
-        observation = np.append(observation, self.csc_output_encoded)
         #print(f"Observation: {observation, observation.shape}\n")
         return observation
 
@@ -489,6 +542,8 @@ class DensityAwareRLEnv(Env):
         
         self.step_counter = 0
         self.data_storage = []
+        self._pending_csc_output = None
+        self._pending_csc_observation = None
         
         # perform the generic reset function
         return super().reset()
@@ -0,0 +1,90 @@
+"""Preallocated observation buffers of the RL vehicles of an environment.
+
+Environments with a variable number of RL vehicles build the observations of
+all of them in a single buffer with one row per RL vehicle, instead of
+allocating new arrays for every RL vehicle at every step. The buffer is grown
+(doubled) when there are more RL vehicles than rows, and reused otherwise.
+"""
+import numpy as np
+
+
+class ObservationBuffer(object):
+    """Preallocated buffer with one row per RL vehicle.
+
+    Attributes
+    ----------
+    shape : tuple of int
+        shape of the observation of a single RL vehicle
+    fill_value : float
+        value of the rows before they are filled
+    dtype : type
+        data type of the buffer
+    buffer : numpy.ndarray
+        the buffer, of shape (capacity,) + shape
+    """
+
+    def __init__(self, shape, fill_value=-1.0, capacity=32, dtype=np.float32):
+        """Instantiate the buffer.
+
+        Parameters
+        ----------
+        shape : int or tuple of int
+            shape of the observation of a single RL vehicle
+        fill_value : float, optional
+            value of the rows before they are filled
+        capacity : int, optional
+            initial number of rows
+        dtype : type, optional
+            data type of the buffer
+        """
+        self.shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        self.fill_value = fill_value
+        self.dtype = dtype
+        self.buffer = np.full((max(1, capacity),) + self.shape, fill_value,
+                              dtype=dtype)
+
+    def rows(self, num_rows):
+        """Return the first rows of the buffer, reset to the fill value.
+
+        Parameters
+        ----------
+        num_rows : int
+            number of rows, grown if the buffer is too small
+
+        Returns
+        -------
+        numpy.ndarray
+            a view of the rows, of shape (num_rows,) + shape. It is
+            overwritten by the next call
+        """
+        if num_rows > len(self.buffer):
+            self.buffer = np.full((2 * num_rows,) + self.shape,
+                                  self.fill_value, dtype=self.dtype)
+        rows = self.buffer[:num_rows]
+        rows.fill(self.fill_value)
+        return rows
+
+    @staticmethod
+    def as_dict(ids, rows):
+        """Return the observation of every RL vehicle, by vehicle id.
+
+        The observations are views of a single copy of the rows: samplers
+        (e.g. RLlib's) keep references to the observations they are given, so
+        these must not be overwritten at the next step, but a single array is
+        allocated for all RL vehicles.
+
+        Parameters
+        ----------
+        ids : list of str
+            ids of the RL vehicles, in the order of the rows
+        rows : numpy.ndarray
+            the observations of the RL vehicles (see rows)
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            Key = id of an RL vehicle
+            Element = its observation
+        """
+        block = rows.copy()
+        return {veh_id: block[i] for i, veh_id in enumerate(ids)}
@@ -0,0 +1,370 @@
+"""Process-wide registry of trained policies used by vehicle controllers.
+
+Controllers that act with a trained RLlib policy (e.g. the
+TrainedAgentController) used to restore a full RLlib trainer per vehicle,
+which multiplied startup time and memory by the number of controlled
+vehicles. Policies are now loaded once per process for every (directory,
+policy_name, checkpoint_num), and shared by all vehicles that use them.
+
+Policies can also be exported to a NumPy archive (see export_policy), which is
+then loaded instead of the RLlib checkpoint, without any dependency on ray.
+"""
+import os
+import re
+
+import numpy as np
+
+# loaded policies, by (directory, policy_name, checkpoint_num)
+_POLICIES = {}
+
+# name of the exported policy, in the checkpoint directory
+EXPORTED_POLICY_NAME = "policy.npz"
+
+
+def _checkpoint_dir(directory, policy_name, checkpoint_num):
+    """Return the directory of a checkpoint of a trained policy."""
+    result_dir = (directory + policy_name).rstrip('/')
+    return result_dir + '/checkpoint_' + str(checkpoint_num)
+
+
+def _restore_agent(directory, policy_name, checkpoint_num, num_cpus):
+    """Restore the RLlib trainer of a checkpoint."""
+    import ray
+    try:
+        from ray.rllib.agents.agent import get_agent_class
+    except ImportError:
+        from ray.rllib.agents.registry import get_agent_class
+    from flow.utils.registry import make_create_env
+    from flow.utils.rllib import get_flow_params, get_rllib_config
+    from ray.tune.registry import register_env
+
+    ray.init(num_cpus=num_cpus, ignore_reinit_error=True)
+
+    result_dir = (directory + policy_name).rstrip('/')
+    checkpoint = _checkpoint_dir(directory, policy_name, checkpoint_num)
+    checkpoint = checkpoint + '/checkpoint-' + str(checkpoint_num)
+
+    config = get_rllib_config(result_dir)
+    config['num_workers'] = 0
+
+    flow_params = get_flow_params(config)
+    sim_params = flow_params['sim']
+    setattr(sim_params, 'num_clients', 1)
+
+    config_run = config['env_config']['run'] \
+        if 'run' in config['env_config'] else None
+    agent_cls = get_agent_class(config_run)
+
+    create_env, env_name = make_create_env(params=flow_params, version=0)
+    register_env(env_name, create_env)
+
+    agent = agent_cls(env=env_name, config=config)
+    agent.restore(checkpoint)
+    print("\n\nLeader agent restored\n{}".format(agent.get_policy()))
+    return agent
+
+
+def get_policy(directory, policy_name, checkpoint_num, num_cpus=1):
+    """Return the shared policy of a checkpoint, loading it if needed.
+
+    If the policy was exported with export_policy, the exported NumPy policy
+    is loaded instead of the RLlib checkpoint.
+
+    Parameters
+    ----------
+    directory : str
+        directory containing the results of the training
+    policy_name : str
+        name of the result directory of the training, in directory
+    checkpoint_num : str
+        number of the checkpoint
+    num_cpus : int, optional
+        number of cpus ray is initialized with, if it was not already
+
+    Returns
+    -------
+    SharedPolicy or NumpyPolicy
+        the policy, shared with all other callers in this process
+    """
+    key = (directory, policy_name, str(checkpoint_num))
+    if key not in _POLICIES:
+        exported = os.path.join(
+            _checkpoint_dir(*key), EXPORTED_POLICY_NAME)
+        if os.path.exists(exported):
+            policy = NumpyPolicy(exported)
+        else:
+            policy = SharedPolicy(_restore_agent(*key, num_cpus))
+        policy.key = key + (num_cpus,)
+        _POLICIES[key] = policy
+    return _POLICIES[key]
+
+
+def _shared_policy(directory, policy_name, checkpoint_num, num_cpus):
+    """Return a shared policy when unpickled (see SharedPolicy.__reduce__)."""
+    return get_policy(directory, policy_name, checkpoint_num, num_cpus)
+
+
+class _Policy(object):
+    """Base class of the policies in the registry.
+
+    Policies are never copied: copies (e.g. of the vehicle kernel, which holds
+    the controllers) and unpickled instances refer to the same policy.
+
+    Actions of all vehicles sharing the policy can be computed in a single
+    batch per step, see compute_batch.
+    """
+
+    def __init__(self):
+        self.key = None
+        self._batch_key = None
+        self._batch = {}
+
+    def compute_actions(self, observations):
+        """Compute the actions of a batch of observations.
+
+        Parameters
+        ----------
+        observations : list of array_like
+            one observation per vehicle
+
+        Returns
+        -------
+        list of array_like
+            one action per vehicle
+        """
+        raise NotImplementedError
+
+    def compute_action(self, observation):
+        """Compute the action of a single observation."""
+        return self.compute_actions([observation])[0]
+
+    def compute_batch(self, batch_key, observations_fn, veh_id):
+        """Return the action of a vehicle, computed in a batch.
+
+        The first vehicle to request an action for a batch key (e.g. a
+        simulation step) computes the observations and actions of all
+        vehicles, and the others read their action from the batch.
+
+        Parameters
+        ----------
+        batch_key : hashable
+            identifier of the batch. Policies are shared by all environments
+            of a process, and step counters repeat across rollouts, so the
+            key should identify both the environment and its step, e.g.
+            ``(id(env), env.step_counter)``. The actions of a previous batch
+            that were not consumed are discarded when the key changes
+        observations_fn : callable
+            function returning a dict of observations of all vehicles that
+            use this policy, by vehicle id
+        veh_id : str
+            the vehicle requesting its action
+
+        Returns
+        -------
+        array_like
+            the action of the vehicle
+        """
+        if batch_key != self._batch_key:
+            # never serve the stale actions of another batch
+            self._batch = {}
+            self._batch_key = None
+        if veh_id not in self._batch:
+            observations = observations_fn()
+            veh_ids = list(observations.keys())
+            actions = self.compute_actions(
+                [observations[i] for i in veh_ids])
+            self._batch = dict(zip(veh_ids, actions))
+            self._batch_key = batch_key
+        return self._batch.pop(veh_id)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return _shared_policy, self.key
+
+
+class SharedPolicy(_Policy):
+    """A policy restored from an RLlib checkpoint.
+
+    Observations are preprocessed and filtered like in the compute_action
+    method of the trainer, and the actions of a batch are computed with a
+    single call to the policy.
+    """
+
+    def __init__(self, agent, policy_id="default_policy"):
+        """Instantiate the policy.
+
+        Parameters
+        ----------
+        agent : ray.rllib.agents.Trainer
+            the restored trainer
+        policy_id : str, optional
+            id of the policy in the trainer
+        """
+        super().__init__()
+        self.agent = agent
+        self.policy_id = policy_id
+        self.policy = agent.get_policy(policy_id)
+
+    def _filter(self, observation):
+        """Preprocess and filter an observation, as done by the trainer."""
+        worker = self.agent.workers.local_worker()
+        preprocessed = worker.preprocessors[self.policy_id].transform(
+            observation)
+        return worker.filters[self.policy_id](preprocessed, update=False)
+
+    def compute_actions(self, observations):
+        """See parent class."""
+        if len(observations) == 0:
+            return []
+        obs_batch = np.stack([self._filter(obs) for obs in observations])
+        actions = self.policy.compute_actions(obs_batch)[0]
+        if self.agent.config.get("clip_actions", False) and \
+                hasattr(self.policy.action_space, "low"):
+            actions = np.clip(actions, self.policy.action_space.low,
+                              self.policy.action_space.high)
+        return list(actions)
+
+    def export(self, path):
+        """Export the policy to a NumPy archive, see export_policy."""
+        weights = self.policy.get_weights()
+        layers = {}
+        for name, value in weights.items():
+            # hidden layers are "fc_<i>", and the output layer is "fc_out"
+            # (the value function layers are "fc_value_<i>" and "value_out")
+            match = re.search(r"/fc_(\d+|out)/(kernel|bias)", name)
+            if match is not None:
+                layer = match.group(1)
+                index = int(layer) if layer != "out" else float('inf')
+                layers.setdefault(index, {})[match.group(2)] = value
+
+        arrays = {}
+        for i, index in enumerate(sorted(layers)):
+            arrays["kernel_{}".format(i)] = layers[index]["kernel"]
+            arrays["bias_{}".format(i)] = layers[index]["bias"]
+
+        model_config = self.agent.config.get("model", {})
+        arrays["activation"] = np.array(
+            model_config.get("fcnet_activation", "tanh"))
+        arrays["action_dim"] = np.array(
+            int(np.prod(self.policy.action_space.shape)))
+        arrays["free_log_std"] = np.array(
+            bool(model_config.get("free_log_std", False)))
+        if hasattr(self.policy.action_space, "low"):
+            arrays["action_low"] = self.policy.action_space.low
+            arrays["action_high"] = self.policy.action_space.high
+
+        # observation filter (the MeanStdFilter, if any)
+        obs_filter = self.agent.workers.local_worker().filters[self.policy_id]
+        if hasattr(obs_filter, "rs"):
+            arrays["filter_mean"] = np.asarray(obs_filter.rs.mean)
+            arrays["filter_std"] = np.asarray(obs_filter.rs.std)
+            arrays["filter_demean"] = np.array(obs_filter.demean)
+            arrays["filter_destd"] = np.array(obs_filter.destd)
+            arrays["filter_clip"] = np.array(
+                obs_filter.clip if obs_filter.clip is not None else np.inf)
+
+        np.savez(path, **arrays)
+
+
+class NumpyPolicy(_Policy):
+    """A fully connected policy exported to a NumPy archive.
+
+    The forward pass is done with NumPy only, without ray or tensorflow. The
+    action is the mean of the action distribution of the policy, i.e. the
+    deterministic version of the RLlib policy, which samples its actions.
+    """
+
+    ACTIVATIONS = {
+        "tanh": np.tanh,
+        "relu": lambda x: np.maximum(x, 0.0),
+        "linear": lambda x: x,
+    }
+
+    def __init__(self, path):
+        """Load the policy.
+
+        Parameters
+        ----------
+        path : str
+            path to the archive created by export_policy
+        """
+        super().__init__()
+        with np.load(path) as data:
+            arrays = dict(data)
+        num_layers = len([name for name in arrays if name.startswith("kernel_")])
+        self.kernels = [arrays["kernel_{}".format(i)]
+                        for i in range(num_layers)]
+        self.biases = [arrays["bias_{}".format(i)]
+                       for i in range(num_layers)]
+        self.activation = self.ACTIVATIONS[str(arrays["activation"])]
+        self.action_dim = int(arrays["action_dim"])
+        self.free_log_std = bool(arrays["free_log_std"])
+        self.action_low = arrays.get("action_low")
+        self.action_high = arrays.get("action_high")
+        self.filter = None
+        if "filter_mean" in arrays:
+            self.filter = (arrays["filter_mean"], arrays["filter_std"],
+                           bool(arrays["filter_demean"]),
+                           bool(arrays["filter_destd"]),
+                           float(arrays["filter_clip"]))
+
+    def compute_actions(self, observations):
+        """See parent class."""
+        if len(observations) == 0:
+            return []
+        x = np.stack([np.asarray(obs, dtype=np.float64).flatten()
+                      for obs in observations])
+
+        if self.filter is not None:
+            mean, std, demean, destd, clip = self.filter
+            if demean:
+                x = x - mean
+            if destd:
+                x = x / (std + 1e-8)
+            x = np.clip(x, -clip, clip)
+
+        for kernel, bias in zip(self.kernels[:-1], self.biases[:-1]):
+            x = self.activation(x @ kernel + bias)
+        x = x @ self.kernels[-1] + self.biases[-1]
+
+        # the mean of the (diagonal gaussian) action distribution
+        actions = x[:, :self.action_dim]
+        if self.action_low is not None:
+            actions = np.clip(actions, self.action_low, self.action_high)
+        return list(actions)
+
+
+def export_policy(directory, policy_name, checkpoint_num, num_cpus=1):
+    """Export the policy of an RLlib checkpoint to a NumPy archive.
+
+    The archive is stored in the checkpoint directory, and is loaded by
+    get_policy instead of the checkpoint from then on. Only fully connected
+    models (the default RLlib model) are supported.
+
+    Parameters
+    ----------
+    directory : str
+        directory containing the results of the training
+    policy_name : str
+        name of the result directory of the training, in directory
+    checkpoint_num : str
+        number of the checkpoint
+    num_cpus : int, optional
+        number of cpus ray is initialized with
+
+    Returns
+    -------
+    str
+        path to the exported policy
+    """
+    path = os.path.join(_checkpoint_dir(directory, policy_name,
+                                        checkpoint_num), EXPORTED_POLICY_NAME)
+    policy = SharedPolicy(
+        _restore_agent(directory, policy_name, checkpoint_num, num_cpus))
+    policy.export(path)
+    return path
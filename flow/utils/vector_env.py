@@ -0,0 +1,432 @@
+"""Vectorized flow environments, compatible with RLlib's VectorEnv.
+
+A vectorized environment steps several copies of a flow environment together,
+so that RLlib computes the actions of all of them with a single forward pass
+of the policy. The environments are either:
+
+- in the current process (see LocalVectorEnv), which suits simulators that
+  are not separate processes, e.g. the "numpy" simulator, whose rings are
+  then stored in a shared ring array and advanced in lock-step with a single
+  vectorized update (see
+  flow.core.kernel.simulation.numpy_ring.lockstep_simulation_step), or
+- in one subprocess each (see SubprocVectorEnv), which suits sumo: all
+  subprocesses advance their simulations in parallel, and environments are
+  reset in the background as soon as their episode ends.
+
+Environments that classify the congestion stage of their local zone with a
+CSC model (e.g. flow.envs.DensityAwareRLEnv) are supported as well: the CSC
+observations of all environments are classified with a single batched call of
+the model at every step, instead of one call per environment.
+"""
+import multiprocessing
+from copy import deepcopy
+
+from ray.rllib.env import MultiAgentEnv, VectorEnv
+
+import flow.envs
+from flow.core.kernel.simulation.numpy_ring import NumpyRingSimulation, \
+    RingArray, lockstep_simulation_step
+from flow.utils.registry import make_create_env
+
+
+def _env_class(params):
+    """Return the environment class of flow-specific parameters."""
+    if isinstance(params["env_name"], str):
+        if hasattr(flow.envs, params["env_name"]):
+            return getattr(flow.envs, params["env_name"])
+        import flow.envs.multiagent
+        return getattr(flow.envs.multiagent, params["env_name"])
+    return params["env_name"]
+
+
+def _uses_csc(env_class):
+    """Return whether the environments of a class use a CSC model."""
+    return hasattr(env_class, "get_csc_outputs")
+
+
+def simulation_step(simulations):
+    """Advance the simulations of several environments by one step.
+
+    The rings of "numpy" simulations are advanced in lock-step, and the other
+    simulations one at a time.
+
+    Parameters
+    ----------
+    simulations : list of flow.core.kernel.simulation.KernelSimulation
+        the simulation kernels
+    """
+    rings = [sim for sim in simulations
+             if isinstance(sim, NumpyRingSimulation)]
+    if len(rings) > 0:
+        lockstep_simulation_step(rings)
+    for sim in simulations:
+        if not isinstance(sim, NumpyRingSimulation):
+            sim.simulation_step()
+
+
+class FlowVectorEnv(VectorEnv):
+    """Base class of the vectorized flow environments.
+
+    Every step is performed in two phases: the simulations of all
+    environments are advanced first (see _simulate), and the results of the
+    step are then collected (see _get_step_results). In between, the CSC
+    observations of all environments are classified with a single call of the
+    CSC model, if the environments use one.
+
+    Attributes
+    ----------
+    num_envs : int
+        number of environments
+    observation_space : gym.spaces.Space
+        observation space of every environment
+    action_space : gym.spaces.Space
+        action space of every environment
+    env_class : type
+        class of the environments
+    """
+
+    def __init__(self, num_envs, observation_space, action_space, env_class):
+        """Instantiate the vectorized environment."""
+        self.num_envs = num_envs
+        self.observation_space = observation_space
+        self.action_space = action_space
+        self.env_class = env_class
+
+    def _simulate(self, actions):
+        """Advance the simulations of all environments by one step.
+
+        Parameters
+        ----------
+        actions : list of array_like
+            the action of every environment
+
+        Returns
+        -------
+        list of array_like or None
+            the CSC observation of every environment, or None if the
+            environments do not use a CSC model
+        """
+        raise NotImplementedError
+
+    def _get_step_results(self, csc_outputs):
+        """Collect the results of the step of all environments.
+
+        Parameters
+        ----------
+        csc_outputs : list of int or None
+            the CSC output of every environment, or None if the environments
+            do not use a CSC model
+
+        Returns
+        -------
+        list of tuple
+            the (observation, reward, done, info) of every environment
+        """
+        raise NotImplementedError
+
+    def vector_step(self, actions):
+        """See parent class."""
+        csc_observations = self._simulate(actions)
+        if csc_observations is None:
+            csc_outputs = None
+        else:
+            csc_outputs = list(self.env_class.get_csc_outputs(
+                csc_observations))
+        results = self._get_step_results(csc_outputs)
+        obs, rewards, dones, infos = [list(x) for x in zip(*results)]
+        return obs, rewards, dones, infos
+
+    def close(self):
+        """Terminate all environments."""
+        raise NotImplementedError
+
+
+class LocalVectorEnv(FlowVectorEnv):
+    """Vectorized environment whose environments are in this process.
+
+    Attributes
+    ----------
+    envs : list of flow.envs.Env
+        the environments
+    """
+
+    def __init__(self, envs):
+        """Instantiate the vectorized environment.
+
+        Parameters
+        ----------
+        envs : list of flow.envs.Env
+            the environments
+        """
+        super().__init__(len(envs), envs[0].observation_space,
+                         envs[0].action_space, type(envs[0]))
+        self.envs = envs
+        self._actions = None
+        self._crashes = None
+        self._csc_observations = None
+
+    def vector_reset(self):
+        """See parent class."""
+        return [env.reset() for env in self.envs]
+
+    def reset_at(self, index):
+        """See parent class."""
+        return self.envs[index].reset()
+
+    def _simulate(self, actions):
+        """See parent class.
+
+        The simulations of all environments are advanced together, one
+        simulation step at a time, until every environment has performed its
+        simulation steps per environment step or experienced a collision.
+        """
+        envs = self.envs
+        crashes = [False] * len(envs)
+        num_steps = [0] * len(envs)
+        active = list(range(len(envs)))
+        while len(active) > 0:
+            for i in active:
+                envs[i].prepare_simulation_step(actions[i])
+            simulation_step([envs[i].k.simulation for i in active])
+            for i in active:
+                num_steps[i] += 1
+                crashes[i] = envs[i].process_simulation_step()
+            active = [i for i in active if not crashes[i] and
+                      num_steps[i] < envs[i].env_params.sims_per_step]
+
+        self._actions = actions
+        self._crashes = crashes
+
+        if not _uses_csc(self.env_class):
+            return None
+        # kept to be reused by the environments when getting their state
+        self._csc_observations = [env.get_csc_observation() for env in envs]
+        return [observation for _, observation in self._csc_observations]
+
+    def _get_step_results(self, csc_outputs):
+        """See parent class."""
+        results = []
+        for i, env in enumerate(self.envs):
+            if csc_outputs is not None:
+                env.set_csc_output(csc_outputs[i], self._csc_observations[i])
+            results.append(
+                env.get_step_result(self._actions[i], self._crashes[i]))
+        return results
+
+    def get_unwrapped(self):
+        """See parent class."""
+        return self.envs
+
+    def close(self):
+        """See parent class."""
+        for env in self.envs:
+            env.terminate()
+
+
+def _worker(remote, parent_remote, params, version):
+    """Run an environment in a subprocess, see SubprocVectorEnv.
+
+    Commands are received from the pipe as (command, data) tuples:
+
+    - "spaces": return the observation and action spaces
+    - "simulate": advance the simulation by one step with the action in data,
+      and return the CSC observation of the environment, if it uses a CSC
+      model
+    - "result": return the result of the step, with the CSC output in data,
+      if the environment uses a CSC model
+    - "reset": reset the environment and return its observation
+    - "close": terminate the environment and exit
+    """
+    parent_remote.close()
+    create_env, _ = make_create_env(params, version)
+    env = create_env()
+    uses_csc = _uses_csc(type(env))
+    action, crash, csc_observation = None, False, None
+    try:
+        while True:
+            command, data = remote.recv()
+            if command == "simulate":
+                action = data
+                crash = env.simulate(action)
+                csc_observation = env.get_csc_observation() if uses_csc \
+                    else None
+                remote.send(csc_observation[1] if uses_csc else None)
+            elif command == "result":
+                if data is not None:
+                    env.set_csc_output(data, csc_observation)
+                remote.send(env.get_step_result(action, crash))
+            elif command == "reset":
+                remote.send(env.reset())
+            elif command == "spaces":
+                remote.send((env.observation_space, env.action_space))
+            elif command == "close":
+                env.terminate()
+                break
+    finally:
+        remote.close()
+
+
+class SubprocVectorEnv(FlowVectorEnv):
+    """Vectorized environment whose environments are in subprocesses.
+
+    Every environment runs in its own subprocess (with its own sumo
+    instance), and all subprocesses perform their steps in parallel. When the
+    episode of an environment ends, the environment is reset in the
+    background right away, so that the reset is already done (or under way)
+    when the reset observation is requested (see reset_at).
+    """
+
+    def __init__(self, params, num_envs, version=0, start_method=None):
+        """Start the environments.
+
+        Parameters
+        ----------
+        params : dict
+            flow-related parameters of the environments (see
+            flow.utils.registry.make_create_env)
+        num_envs : int
+            number of environments
+        version : int, optional
+            environment version number
+        start_method : str, optional
+            start method of the subprocesses (see multiprocessing). Defaults
+            to "forkserver" if available, and "spawn" otherwise
+        """
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in \
+                multiprocessing.get_all_start_methods() else "spawn"
+        ctx = multiprocessing.get_context(start_method)
+
+        self.remotes, self.processes = [], []
+        for _ in range(num_envs):
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(
+                target=_worker, args=(work_remote, remote, params, version),
+                daemon=True)
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        self.remotes[0].send(("spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        super().__init__(num_envs, observation_space, action_space,
+                         _env_class(params))
+
+        # whether the reset of every environment was requested in the
+        # background, and its observation not received yet
+        self._resetting = [False] * num_envs
+
+    def vector_reset(self):
+        """See parent class."""
+        for i, remote in enumerate(self.remotes):
+            if not self._resetting[i]:
+                remote.send(("reset", None))
+        self._resetting = [False] * self.num_envs
+        return [remote.recv() for remote in self.remotes]
+
+    def reset_at(self, index):
+        """See parent class."""
+        if not self._resetting[index]:
+            self.remotes[index].send(("reset", None))
+        self._resetting[index] = False
+        return self.remotes[index].recv()
+
+    def _simulate(self, actions):
+        """See parent class."""
+        for remote, action in zip(self.remotes, actions):
+            remote.send(("simulate", action))
+        csc_observations = [remote.recv() for remote in self.remotes]
+        if not _uses_csc(self.env_class):
+            return None
+        return csc_observations
+
+    def _get_step_results(self, csc_outputs):
+        """See parent class.
+
+        Environments whose episode ended are reset in the background.
+        """
+        for i, remote in enumerate(self.remotes):
+            remote.send(("result", None if csc_outputs is None
+                         else csc_outputs[i]))
+        results = [remote.recv() for remote in self.remotes]
+        for i, (_, _, done, _) in enumerate(results):
+            if done:
+                self.remotes[i].send(("reset", None))
+                self._resetting[i] = True
+        return results
+
+    def get_unwrapped(self):
+        """See parent class (the environments are in other processes)."""
+        return []
+
+    def close(self):
+        """See parent class."""
+        for i, remote in enumerate(self.remotes):
+            if self._resetting[i]:
+                remote.recv()
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+
+
+def make_create_vector_env(params, num_envs, version=0, remote=None):
+    """Create a vectorized flow environment, compatible with RLlib.
+
+    Parameters
+    ----------
+    params : dict
+        flow-related parameters (see flow.utils.registry.make_create_env)
+    num_envs : int
+        number of environments stepped together
+    version : int, optional
+        environment version number
+    remote : bool, optional
+        whether every environment is run in a subprocess (see
+        SubprocVectorEnv), or all environments in the current process (see
+        LocalVectorEnv). Defaults to subprocesses for sumo, and to the current
+        process otherwise. When in the current process, environments using
+        the "numpy" simulator share a ring array, so that their rings are
+        advanced in lock-step.
+
+    Returns
+    -------
+    function
+        method that creates the vectorized environment
+    str
+        name of the gym environment of every environment
+
+    Raises
+    ------
+    ValueError
+        if the environment is a multi-agent environment
+    """
+    if issubclass(_env_class(params), MultiAgentEnv):
+        raise ValueError("Multi-agent environments cannot be vectorized.")
+
+    create_env, env_name = make_create_env(params, version)
+    if remote is None:
+        remote = params["simulator"] == "traci"
+
+    def create_vector_env(*_):
+        if remote:
+            return SubprocVectorEnv(params, num_envs, version)
+
+        local_params = params
+        sim_params = params["sim"]
+        if params["simulator"] == "numpy" and \
+                getattr(sim_params, "ring_array", None) is None:
+            local_params = dict(params)
+            local_params["sim"] = deepcopy(sim_params)
+            local_params["sim"].ring_array = RingArray(
+                sim_params.sim_step, use_ballistic=sim_params.use_ballistic,
+                seed=sim_params.seed)
+
+        # every environment is registered with gym under its own version
+        envs = []
+        for _ in range(num_envs):
+            create_local_env, _ = make_create_env(local_params, version)
+            envs.append(create_local_env())
+        return LocalVectorEnv(envs)
+
+    return create_vector_env, env_name
@@ -55,6 +55,11 @@ def parse_args(args):
     parser.add_argument(
         '--checkpoint_path', type=str, default=None,
         help='Directory with checkpoint to restore training from.')
+    parser.add_argument(
+        '--num_envs', type=int, default=1,
+        help='How many environments every RLlib worker steps together (see '
+             'flow/utils/vector_env.py). With sumo, every environment runs '
+             'in its own subprocess.')
 
     return parser.parse_known_args(args)[0]
 
@@ -103,7 +108,8 @@ def setup_exps_rllib(flow_params,
                      n_rollouts,
                      policy_graphs=None,
                      policy_mapping_fn=None,
-                     policies_to_train=None):
+                     policies_to_train=None,
+                     num_envs=1):
     """Return the relevant components of an RLlib experiment.
 
     Parameters
@@ -120,6 +126,10 @@ def setup_exps_rllib(flow_params,
         TODO
     policies_to_train : list of str, optional
         TODO
+    num_envs : int, optional
+        number of environments stepped together by every worker. If greater
+        than one, every worker samples from a vectorized environment (see
+        flow.utils.vector_env.make_create_vector_env)
 
     Returns
     -------
@@ -211,7 +221,12 @@ def setup_exps_rllib(flow_params,
     if policies_to_train is not None:
         config['multiagent'].update({'policies_to_train': policies_to_train})
 
-    create_env, gym_name = make_create_env(params=flow_params)
+    if num_envs > 1:
+        from flow.utils.vector_env import make_create_vector_env
+        create_env, gym_name = make_create_vector_env(
+            params=flow_params, num_envs=num_envs)
+    else:
+        create_env, gym_name = make_create_env(params=flow_params)
 
     # Register as rllib env
     register_env(gym_name, create_env)
@@ -232,7 +247,8 @@ def train_rllib(submodule, flags):
 
     alg_run, gym_name, config = setup_exps_rllib(
         flow_params, n_cpus, n_rollouts,
-        policy_graphs, policy_mapping_fn, policies_to_train)
+        policy_graphs, policy_mapping_fn, policies_to_train,
+        flags.num_envs)
 
     ray.init(num_cpus=n_cpus + 1, object_store_memory=200 * 1024 * 1024, ignore_reinit_error=True) # Bibek: added the last arg to avoid error
     exp_config = {
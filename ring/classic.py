@@ -1,6 +1,8 @@
 import random 
 import argparse
+from functools import partial
 from flow.core.experiment import Experiment
+from flow.core.rollouts import run_rollouts, apply_rollout_params
 
 from Config.bcm_config import config_bcm
 from Config.lacc_config import config_lacc
@@ -10,13 +12,32 @@ from Config.piws_config import config_piws
 
 from common_args import update_arguments
 
+config_dict = {'bcm': config_bcm, 
+                'lacc': config_lacc, 
+                'idm': config_idm,
+                'fs': config_fs,
+                'piws': config_piws}
+
+def get_flow_params(args, kwargs):
+    """
+    Flow params of the method, with the simulator selected on the command line
+    ("numpy" runs the ring without sumo)
+    """
+    flow_params = config_dict.get(kwargs['method_name'])(args, **kwargs)
+    flow_params['simulator'] = args.simulator
+    return flow_params
+
+def rollout(args, kwargs, index, seed=None, port=None, emission_path=None):
+    """
+    A single rollout, run in a worker process by the parallel executor
+    Each rollout has its own port, seed and emission directory
+    """
+    flow_params = apply_rollout_params(get_flow_params(args, kwargs), seed=seed, port=port, emission_path=emission_path)
+    exp = Experiment(flow_params)
+    return exp.run(1, convert_to_csv=False)
+
 def run(args, **kwargs):
    
-    config_dict = {'bcm': config_bcm, 
-                    'lacc': config_lacc, 
-                    'idm': config_idm,
-                    'fs': config_fs,
-                    'piws': config_piws}
 
     # args.method should be one from the keys list, if not throw error
     methods = list(config_dict.keys())
@@ -44,9 +65,16 @@ def run(args, **kwargs):
     config_func = config_dict.get(kwargs['method_name'])
 
     if config_func: 
+        if args.num_workers != 1 or args.seed is not None or args.base_port is not None:
+            # Rollouts in parallel (or one after the other in this process with 1 worker, each with its own seed and port)
+            # Emission files of all rollouts end up in the same directory as before
+            emission_path = get_flow_params(args, kwargs)['sim'].emission_path
+            return run_rollouts(partial(rollout, args, kwargs), args.num_rollouts, num_workers=args.num_workers,
+                                seed=args.seed, base_port=args.base_port, emission_path=emission_path)
+
         # To make random selection of ring length
         for i in range(args.num_rollouts):
-            exp = Experiment(config_func(args, **kwargs))
+            exp = Experiment(get_flow_params(args, kwargs))
             _ = exp.run(1, convert_to_csv=False)
 
     else:
@@ -66,7 +94,16 @@ if __name__ == '__main__':
     # 0.2 is small enough?
 
     
+    # Parallel rollouts: 0 uses all cpus, 1 runs the rollouts one after the other in this process
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None, help='Rollout i uses seed + i')
+    parser.add_argument('--base_port', type=int, default=None, help='Rollout i uses base_port + i, finds a free port if not set')
+    # numpy: simulate the ring without sumo (see flow/core/kernel/simulation/numpy_ring.py)
+    parser.add_argument('--simulator', type=str, default='traci', choices=['traci', 'numpy'])
+
     parser = update_arguments(parser)
     args = parser.parse_args()
+    if args.num_workers == 0:
+        args.num_workers = None
     run(args)
 
@@ -0,0 +1,198 @@
+"""
+Vectorized metrics engine for the ring evaluation.
+
+The emission data of a rollout is pivoted once into (time x vehicle) arrays, after which the safety,
+efficiency and stability metrics of EvalMetrics are computed with array operations instead of
+per-vehicle dataframe filters. The results of each rollout are a single row of a results table.
+
+On the ring all vehicles are present for the entire rollout, so the row index of the arrays is the
+same as the position in each vehicle's data that EvalMetrics slices with start_time:end_time.
+"""
+
+import numpy as np
+import pandas as pd
+
+from flow.core.kernel.simulation.emission import load_emission
+
+# Columns of the results table, in order
+METRICS = [
+    'ttc_worst', 'ttc_best', 'ttc_avg', 'ttc_std', 'drac_worst',
+    'mpg_avg', 'mpg_std', 'speed_avg', 'speed_std', 'flow',
+    'tts', 'time_headway_worst', 'time_headway_avg', 'time_headway_std', 'cav',
+]
+
+# Columns of the emission data that are pivoted
+PIVOT_COLUMNS = ['x', 'speed', 'space_headway', 'realized_accel', 'distance_traveled', 'fuel_consumption', 'shock_time']
+
+# Fuel consumption is stored in gallons/s converted from ml/s by Flow, but sumo returns mg/s.
+# Undo the conversion, go from mg/s to ml/s (737 mg of petrol in 1 ml) and back to gallons/s
+FUEL_CORRECTION = (1/0.000264172) * (1/737) * 0.000264172
+
+
+class EmissionArrays():
+    """
+    Emission data of one rollout as (time x vehicle) arrays.
+    Values of vehicles that are not in the network at a time are NaN, and leader is -1.
+    """
+    def __init__(self, df):
+        self.times, time_index = np.unique(df['time'].values, return_inverse=True)
+        vehicle_index, ids = pd.factorize(df['id'], sort=False)
+        self.ids = [str(veh_id) for veh_id in ids]
+
+        shape = (len(self.times), len(self.ids))
+        self.fields = {}
+        for name in PIVOT_COLUMNS:
+            values = np.full(shape, np.nan)
+            values[time_index, vehicle_index] = df[name].values.astype(float)
+            self.fields[name] = values
+
+        # Column of the leader of each vehicle at each time
+        self.leader = np.full(shape, -1, dtype=int)
+        leader_ids = df['leader_id'].astype(object).where(df['leader_id'].notnull(), '')
+        self.leader[time_index, vehicle_index] = pd.Index(self.ids).get_indexer(leader_ids.values)
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def leader_values(self, name):
+        """
+        Value of a field for the leader of each vehicle (NaN without a leader)
+        """
+        values = self.fields[name]
+        rows = np.arange(values.shape[0])[:, None]
+        leader_values = values[rows, np.maximum(self.leader, 0)]
+        return np.where(self.leader >= 0, leader_values, np.nan)
+
+
+def controlled_columns(ids, method):
+    """
+    Columns of the vehicles that act as controllers.
+    For IDM, idm_0 acts as the controller. Otherwise, all vehicles that are not human.
+    """
+    if method == 'idm':
+        return np.array([i for i, veh_id in enumerate(ids) if veh_id == 'idm_0'], dtype=int)
+    return np.array([i for i, veh_id in enumerate(ids) if 'human' not in veh_id], dtype=int)
+
+
+def time_to_stabilize(speeds, idm_noise, sim_step, horizon, window=100):
+    """
+    First time (after warmup) at which the standard deviation of speeds across vehicles goes below the
+    IDM noise and stays below it for the next window steps.
+    speeds: (time x vehicle) array starting at the end of warmup
+    """
+    # Standard deviation across vehicles with bessel's correction
+    speeds_std = np.std(speeds, axis=1, ddof=1)
+
+    below = speeds_std <= idm_noise
+    # Number of steps that are not strictly below the noise, up to each step
+    not_strictly_below = np.concatenate([[0], np.cumsum(~(speeds_std < idm_noise))])
+    ends = np.minimum(np.arange(len(speeds_std)) + window, len(speeds_std))
+    stable = below & (not_strictly_below[ends] - not_strictly_below[:-1] == 0)
+
+    indices = np.flatnonzero(stable)
+    if len(indices) == 0:
+        print(f"Could not stabilize within this time, set shock start time further right")
+        return horizon*sim_step
+    return indices[0]*sim_step
+
+
+def compute_metrics(arrays, method, start_time, end_time, warmup, horizon, idm_noise, sim_step=0.1):
+    """
+    Compute all metrics of a single rollout.
+    start_time, end_time and warmup are in steps.
+    Returns a dict with one value per metric in METRICS
+    """
+    window = slice(start_time, end_time)
+    controlled = controlled_columns(arrays.ids, method)
+
+    speed = arrays['speed']
+    gap = arrays['space_headway']
+    leader_speed = arrays.leader_values('speed')
+
+    results = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        #############################
+        # Safety: Time to collision, only negative values (follower faster than leader) can collide
+        ttc = gap[window, controlled] / (leader_speed[window, controlled] - speed[window, controlled])
+        ttc = np.where(ttc < 0.0, ttc, np.nan)
+        results['ttc_worst'] = np.nanmax(np.nanmax(ttc, axis=0))
+        results['ttc_best'] = np.nanmin(np.nanmin(ttc, axis=0))
+        results['ttc_avg'] = np.nanmean(np.nanmean(ttc, axis=0))
+        results['ttc_std'] = np.nanmean(np.nanstd(ttc, axis=0))
+
+        # Deceleration rate to avoid a crash, only when follower faster than leader
+        relative_velocities = speed[window, controlled] - leader_speed[window, controlled]
+        drac = np.where(relative_velocities > 0.0, np.square(relative_velocities) / gap[window, controlled], np.nan)
+        results['drac_worst'] = np.nanmax(np.nanmax(drac, axis=0))
+
+        #############################
+        # Efficiency: Fuel economy and speed of all vehicles, excluding shock times
+        shock = arrays['shock_time'][window] == 1
+        not_shock = arrays['shock_time'][window] == 0
+
+        fuel = arrays['fuel_consumption'][window] * FUEL_CORRECTION * sim_step
+        fuel_total = np.sum(np.where(not_shock, fuel, 0.0), axis=0)
+
+        # Distance travelled during the shocks: last minus first distance among the shock times
+        distance = arrays['distance_traveled']
+        any_shock = shock.any(axis=0)
+        first_shock = np.argmax(shock, axis=0)
+        last_shock = shock.shape[0] - 1 - np.argmax(shock[::-1], axis=0)
+        columns = np.arange(distance.shape[1])
+        distance_shock = np.where(any_shock,
+                                  distance[window][last_shock, columns] - distance[window][first_shock, columns], 0.0)
+
+        distances_travelled = (distance[end_time] - distance[start_time]) - distance_shock
+        vmt = distances_travelled * 0.000621371  # Meters to miles
+        mpgs = vmt / fuel_total
+        results['mpg_avg'] = np.mean(mpgs)
+        results['mpg_std'] = np.std(mpgs)
+
+        speed_no_shock = np.where(not_shock, speed[window], np.nan)
+        results['speed_avg'] = np.mean(np.nanmean(speed_no_shock, axis=0))
+        results['speed_std'] = np.mean(np.nanstd(speed_no_shock, axis=0))
+
+        # Throughput: number of times vehicles pass the zero point of the ring (position wraps around)
+        position = arrays['x'][window]
+        zero_crossings = np.sum(position[:-1] > position[1:])
+        interest_time = (end_time - start_time) * sim_step  # seconds
+        results['flow'] = (zero_crossings / interest_time) * 3600  # vehicles/hr
+
+        #############################
+        # Stability: Time to stabilize
+        if method == 'fs':  # For unstable percentages put names here
+            results['tts'] = -1
+        else:
+            results['tts'] = time_to_stabilize(speed[warmup:], idm_noise, sim_step, horizon)
+
+        # Time headway of the controllers, low velocities are clipped to avoid very high time headways
+        velocity = np.where(speed[window, controlled] < 0.01, 0.01, speed[window, controlled])
+        time_headway = gap[window, controlled] / velocity
+        results['time_headway_worst'] = np.nanmin(np.nanmin(time_headway, axis=0))
+        results['time_headway_avg'] = np.nanmean(np.nanmean(time_headway, axis=0))
+        results['time_headway_std'] = np.nanmean(np.nanstd(time_headway, axis=0))
+
+        # Worst case controller acceleration variation, empty values omitted
+        acceleration = arrays['realized_accel'][window, controlled]
+        counts = np.sum(~np.isnan(acceleration), axis=0)
+        cav = np.sqrt(np.nanvar(acceleration, axis=0) * counts / (counts - 1))
+        results['cav'] = np.nanmax(cav)
+
+    return results
+
+
+def evaluate_file(file, method, start_time, end_time, warmup, horizon, idm_noise, sim_step=0.1):
+    """
+    Load a single emission file and compute all of its metrics
+    """
+    df = load_emission(file, columns=['time', 'id', 'leader_id'] + PIVOT_COLUMNS)
+    return compute_metrics(EmissionArrays(df), method, start_time, end_time, warmup, horizon, idm_noise, sim_step)
+
+
+def evaluate_files(files, method, start_time, end_time, warmup, horizon, idm_noise, sim_step=0.1):
+    """
+    Results table with one row per emission file and one column per metric
+    """
+    rows = [evaluate_file(file, method, start_time, end_time, warmup, horizon, idm_noise, sim_step) for file in files]
+    return pd.DataFrame(rows, index=pd.Index(files, name='file'), columns=METRICS)
@@ -8,7 +8,10 @@ import argparse
 import numpy as np
 import pandas as pd
 
+from flow.core.kernel.simulation.emission import load_emission, find_emission_files
+from flow.core.shock_scheduler import load_shock_log, shock_log_path
 from eval_plots import Plotter
+from eval_engine import evaluate_files
 
 class EvalMetrics():
     def __init__(self, args, **kwargs):
@@ -23,8 +26,12 @@ class EvalMetrics():
         self.start_time = self.args.start_time
         self.end_time = self.args.end_time
 
+        # The emission file being evaluated, parsed once and shared by safety, efficiency and stability while it is the current file (see evaluate)
+        # Only one file is kept at a time, so that memory does not grow with the number of files evaluated
+        self.emissions = {}
+
         self.file = self.kwargs['files'][0]
-        self.dataframe = pd.read_csv(self.file)
+        self.dataframe = self.load(self.file)
         self.vehicle_ids = self.dataframe['id'].unique()
         print(f"Vehicle ids: {self.vehicle_ids}\n")
 
@@ -36,7 +43,66 @@ class EvalMetrics():
         #     os.makedirs(self.save_dir)
 
 
-    def safety(self, ):
+    def load(self, file):
+        """
+        Load an emission file (csv, npz or columnar), only parsing it again if another file was loaded since
+        """
+        if file not in self.emissions:
+            # Drop the previous file before parsing the next one
+            self.emissions.clear()
+            self.emissions[file] = load_emission(file)
+        return self.emissions[file]
+
+    def shocks(self, file):
+        """
+        The shocks applied during the rollout of an emission file, read from the shock log stored next to it (None if there is none)
+        Returns the ids of the shocked vehicles, and one row per shocked vehicle: shock index, start step, stop step (exclusive, -1 if in progress at the end), value
+        """
+        return load_shock_log(shock_log_path(file))
+
+    def print_shocks(self, file):
+        """
+        Summary of the shock log of an emission file
+        """
+        shock_log = self.shocks(file)
+        if shock_log is None:
+            return
+        shock_ids, shocks = shock_log
+        stopped = shocks[:, 2] >= 0
+        shocked_steps = int(np.sum(shocks[stopped, 2] - shocks[stopped, 1]))
+        print(f"Shocks applied: {len(np.unique(shocks[:, 0]))}, to {len(set(shock_ids))} vehicles, for {shocked_steps} vehicle-steps\n")
+
+    def results_table(self, sim_step=0.1):
+        """
+        All metrics of every file, computed with the vectorized engine (see eval_engine.py)
+        Returns a dataframe with one row per file and one column per metric
+        """
+        return evaluate_files(self.kwargs['files'], self.args.method, self.start_time, self.end_time,
+                              self.warmup, self.horizon, self.args.idm_noise, sim_step)
+
+    def evaluate(self, ):
+        """
+        Safety, efficiency and stability metrics of every file
+        Each file is parsed once and evaluated for all three families before the next file is loaded
+        Returns the results of safety, efficiency and stability (see each), one value per file in each list
+        """
+        safety = [[] for _ in range(5)]
+        efficiency = [[] for _ in range(5)]
+        stability = [[] for _ in range(3)]
+
+        for file in self.kwargs['files']:
+            for collectors, family in [(safety, self.safety), (efficiency, self.efficiency), (stability, self.stability)]:
+                for collector, values in zip(collectors, family([file])):
+                    collector.extend(values)
+
+        if self.args.save_plots:
+            mpgs_avg_mother, mpgs_std_mother = efficiency[0], efficiency[1]
+            self.plotter.plot_speeds() # Speeds are plotted over entire horizon
+            self.plotter.plot_fuel_consumption(np.asarray(mpgs_avg_mother), np.asarray(mpgs_std_mother)) # Fuel is plotted between start and end times
+
+        return tuple(safety), tuple(efficiency), tuple(stability)
+
+    def safety(self, files):
         """
         1. Time to Collision: 
         Only measured for controlled vehicles, if the leader happens to apply shock, that data is discarded? NO, its controllers responsibility
@@ -51,8 +117,8 @@ class EvalMetrics():
         
         drac_worst_mother = []
 
-        for file in self.kwargs['files']:
-            self.dataframe = pd.read_csv(file)
+        for file in files:
+            self.dataframe = self.load(file)
             
             #filter for each vehicle
             self.vehicle_ids = self.dataframe['id'].unique()
@@ -317,7 +383,7 @@ class EvalMetrics():
 
         return ttc_worst_mother, ttc_best_mother, ttc_avg_mother, ttc_std_mother, drac_worst_mother
 
-    def efficiency(self, ):
+    def efficiency(self, files):
         """
         1. Fuel Economy during shocks: Average fuel consumption by the 22 vehicles (Miles per gallon).
         2. Average Speed/Velocity during shocks: After the warmup period, average speed of the 22 vehicles during the shocks.
@@ -331,8 +397,9 @@ class EvalMetrics():
         speeds_std_mother = []
         flows_mother = []
 
-        for file in self.kwargs['files']:
-            self.dataframe = pd.read_csv(file)
+        for file in files:
+            self.dataframe = self.load(file)
+            self.print_shocks(file)
             
             #filter for each vehicle
             self.vehicle_ids = self.dataframe['id'].unique()
@@ -477,14 +544,10 @@ class EvalMetrics():
             print(f"Flow (veh/hour): {round(flow,2)}\n")
             flows_mother.append(flow)
 
-        if self.args.save_plots:
-            self.plotter.plot_speeds() # Speeds are plotted over entire horizon
-            self.plotter.plot_fuel_consumption(np.asarray(mpgs_avg_mother), np.asarray(mpgs_std_mother)) # Fuel is plotted between start and end times
-
         return mpgs_avg_mother, mpgs_std_mother, speeds_avg_mother, speeds_std_mother, flows_mother
 
 
-    def stability(self, ):
+    def stability(self, files):
         """
         1. Time to stabilize : Time interval between the controller activation and the vehicles stabilizing.
                                 If the average velocity standard deviation is less than the IDM noise, system = Stable
@@ -504,9 +567,9 @@ class EvalMetrics():
         tts_mother = []
         cav_mother = []
 
-        for file in self.kwargs['files']:
+        for file in files:
             print(f"File: {file}")
-            self.dataframe = pd.read_csv(file)
+            self.dataframe = self.load(file)
             
             #filter for each vehicle
             self.vehicle_ids = self.dataframe['id'].unique()
@@ -707,7 +770,7 @@ class EvalMetrics():
 
             # Worst from those standard deviations so that we have a single value
             cav_worst = np.max(cav_total)
-            print(f"Acceleration variation (m/s^2): {cav_mother}\n")
+            print(f"Acceleration variation (m/s^2): {cav_worst}\n")
 
             cav_mother.append(np.max(cav_worst))
             
@@ -738,6 +801,9 @@ if __name__ == '__main__':
     # The value of IDM noise that was added to the vehicles, typically 0.2
     parser.add_argument('--idm_noise', type=float, default=0.2)
 
+    # Compute all metrics with the vectorized engine and print a results table instead
+    parser.add_argument('--vectorized', action='store_true', default=False)
+
     args = parser.parse_args()
 
     if args.method is None or args.method not in ['bcm', 'idm', 'fs', 'pi', 'lacc', 'wu', 'ours', 'ours4x', 'ours9x', 'ours13x']:
@@ -746,8 +812,7 @@ if __name__ == '__main__':
     #if args.metric is None:
         #raise ValueError("Please specify the metric to evaluate\n Metric can be [Stability, safety, efficiency]")
 
-    files = [f"{args.emissions_file_path}/{args.method}/{item}" for item in os.listdir(f"{args.emissions_file_path}/{args.method}") \
-        if item.endswith('.csv')]
+    files = find_emission_files(f"{args.emissions_file_path}/{args.method}")
     
     # Add more upon necessity
     kwargs = {'files': files,
@@ -755,12 +820,25 @@ if __name__ == '__main__':
     }
     print(f"Calculating metrics for {args.num_rollouts} rollouts on files: \n{files}\n")
     metrics = EvalMetrics(args, **kwargs)
-    ttc_worst_mother, ttc_best_mother, ttc_avg_mother, ttc_std_mother, drac_worst_mother = metrics.safety()
 
-    mpgs_avg_mother, mpgs_std_mother, speeds_avg_mother, speeds_std_mother, flows_mother = metrics.efficiency()
+    if args.vectorized:
+        results = metrics.results_table()
+        print(f"Metrics of each rollout:\n{results.to_string()}\n")
+        summary = pd.DataFrame({'mean': results.mean(), 'std': results.std(ddof=0)}).round(2)
+        print(f"Across rollouts:\n{summary.to_string()}\n")
+        a, x, e, g, c = [round(results[name].mean(), 2) for name in ['ttc_worst', 'drac_worst', 'mpg_avg', 'flow', 'cav']]
+        print(f"${-1*a}$ & ${x}$ & ${e}$ & ${int(g)}$ & ${c}$ ")
+        raise SystemExit
+
+    # Each file is parsed once, and evaluated for safety, efficiency and stability
+    safety, efficiency, stability = metrics.evaluate()
+
+    ttc_worst_mother, ttc_best_mother, ttc_avg_mother, ttc_std_mother, drac_worst_mother = safety
+
+    mpgs_avg_mother, mpgs_std_mother, speeds_avg_mother, speeds_std_mother, flows_mother = efficiency
 
     #tts_mother, time_headways_worst_mother, time_headways_avg_mother, time_headways_std_mother = metrics.stability()
-    tts_mother, time_headways_worst_mother, cav_mother  = metrics.stability()
+    tts_mother, time_headways_worst_mother, cav_mother  = stability
 
     print("####################")
     print("####################")
@@ -15,6 +15,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 
 import seaborn as sns
+
+from flow.core.kernel.simulation.emission import load_emission, find_emission_files
 #sns.set_palette(palette='magma', n_colors = 15)
 sns.set_style('darkgrid')
 
@@ -25,7 +27,7 @@ class Plotter:
         self.kwargs = kwargs
 
         self.file = self.kwargs['files'][0]
-        self.dataframe = pd.read_csv(self.file)
+        self.dataframe = load_emission(self.file)
         self.vehicle_ids = self.dataframe['id'].unique()
         self.num_rollouts = len(self.kwargs['files'])
 
@@ -49,7 +51,7 @@ class Plotter:
         for file in self.kwargs['files']:
             
 
-            self.dataframe = pd.read_csv(file)
+            self.dataframe = load_emission(file)
             self.vehicle_ids = self.dataframe['id'].unique()
 
             # Speed of all vehicles across time, for one file
@@ -135,7 +137,7 @@ class Plotter:
         # Generate for each rollout file that was found  
         for file in self.kwargs['files']:
             print(f"File: {file}")
-            self.dataframe = pd.read_csv(file)
+            self.dataframe = load_emission(file)
             self.vehicle_ids = self.dataframe['id'].unique()
             print(f"Vehicles: {self.vehicle_ids}")
 
@@ -289,7 +291,7 @@ if __name__ == "__main__":
     if args.method is None or args.method not in ['bcm', 'idm', 'fs', 'pi', 'lacc', 'wu', 'ours', 'ours4x', 'ours9x']:
         raise ValueError("Please specify the method to evaluate metrics for\n Method can be [bcm, idm, fs, piws, lacc, wu, ours, ours4x, ours9x]")
 
-    files = [f"{args.emissions_file_path}/{args.method}_stability/{item}" for item in os.listdir(f"{args.emissions_file_path}/{args.method}_stability") if item.endswith('.csv')]
+    files = find_emission_files(f"{args.emissions_file_path}/{args.method}_stability")
     
     # Add more upon necessity
     kwargs = {'files': files,
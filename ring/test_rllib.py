@@ -37,9 +37,13 @@ from flow.utils.rllib import get_rllib_pkl
 import json 
 from common_args import update_arguments
 from flow.density_aware_util import get_shock_model, get_time_steps, get_time_steps_stability
+from flow.core.shock_scheduler import ShockScheduler, shock_log_path
 import random 
+import copy
+from functools import partial
 
 from ray.cloudpickle import cloudpickle
+from flow.core.rollouts import run_rollouts, apply_rollout_params
 
 EXAMPLE_USAGE = """
 example usage:
@@ -196,6 +200,9 @@ def visualizer_rllib(args):
     emission_path = f"{dir_path}/test_time_rollout/{rl_folder_name}" #'{0}/test_time_rollout/'.format(dir_path)
 
     sim_params.emission_path = emission_path if args.gen_emission else None
+    # Seed, port and emission directory of a single rollout, set when rollouts run in parallel (see rollout below)
+    apply_rollout_params(flow_params, seed=getattr(args, 'rollout_seed', None), port=getattr(args, 'rollout_port', None),
+                         emission_path=getattr(args, 'rollout_emission_path', None))
 
     # Create and register a gym+rllib env
     create_env, env_name = make_create_env(params=flow_params, version=0)
@@ -291,11 +298,9 @@ def visualizer_rllib(args):
         else:
             shock_times = get_time_steps(durations, frequency, shock_start_time, shock_end_time)
 
-        shock_counter = 0
-        current_duration_counter = 0
+        # Start and stop events of the shocks (the log of shocks applied is kept here as well)
+        shock_scheduler = ShockScheduler(shock_times, durations, intensities, sim_params.sim_step)
         vehicles = env.unwrapped.k.vehicle
-        total_rl_ids = vehicles.get_rl_ids() if args.num_controlled ==1 else vehicles.get_rl_ids() + ["rl_leader_0"]
-        single_shock_id = random.choice([item for item in vehicles.get_ids() if item not in total_rl_ids])
 
         # This program counts for warmup or not? 
         # This will start running only after warmup ends 
@@ -305,12 +310,11 @@ def visualizer_rllib(args):
 
              # TODO: update for stability
             # perform_shock function RL version
-            if args.shock and step >= shock_start_time and step <= shock_end_time:
+            if args.shock:
                 if args.stability:
-                    single_shock_id, shock_counter, current_duration_counter = perform_shock_stability(env, shock_times, shock_counter, current_duration_counter, step, intensities, durations, frequency, num_automated = args.num_controlled) # For stability the values are single values
+                    perform_shock_stability(env, shock_scheduler, step, intensities, durations, frequency, num_automated = args.num_controlled) # For stability the values are single values
                 else:
-                    single_shock_id, shock_counter, current_duration_counter = perform_shock(env, vehicles, single_shock_id, \
-                        shock_times, shock_counter, current_duration_counter, step, intensities, durations, frequency, args.num_controlled)
+                    perform_shock(env, vehicles, shock_scheduler, step, intensities, durations, frequency, args.num_controlled)
 
                 
 
@@ -347,6 +351,12 @@ def visualizer_rllib(args):
                 rets[key].append(ret[key])
         else:
             rets.append(ret)
+
+        # Save the emission data of the rollout, and the log of the shocks applied next to it (for the evaluators)
+        emission_file = env.unwrapped.k.simulation.save_emission(run_id=i)
+        if emission_file is not None:
+            shock_scheduler.save_log(shock_log_path(emission_file))
+
         outflow = vehicles.get_outflow_rate(500)
         final_outflows.append(outflow)
         inflow = vehicles.get_inflow_rate(500)
@@ -407,7 +417,24 @@ def visualizer_rllib(args):
     # terminate the environment
     env.unwrapped.terminate()
 
-def perform_shock_stability(env, shock_times, shock_counter, current_duration_counter, step, intensity, duration, frequency, num_automated):
+def rollout(args, index, seed=None, port=None, emission_path=None):
+    """
+    A single rollout, run in a worker process by the parallel executor
+    Each worker restores its own agent, and has its own port, seed and emission directory
+    """
+    args = copy.copy(args)
+    args.num_rollouts = 1
+    args.rollout_seed = seed
+    args.rollout_port = port
+    args.rollout_emission_path = emission_path
+
+    ray.init(num_cpus=1, ignore_reinit_error=True)
+    try:
+        visualizer_rllib(args)
+    finally:
+        ray.shutdown()
+
+def perform_shock_stability(env, shock_scheduler, step, intensity, duration, frequency, num_automated):
 
     if num_automated == 4:
         single_shock_id = 'human_2_0'
@@ -425,53 +452,44 @@ def perform_shock_stability(env, shock_times, shock_counter, current_duration_co
         single_shock_id = 'human_0'
         reference_speed_limit_id = 'human_1'
 
-    speed_limit = env.unwrapped.k.vehicle.get_max_speed(reference_speed_limit_id)
+    stopped, started = shock_scheduler.advance(step)
 
     # Be default, shock is not applied
-    env.unwrapped.k.vehicle.set_max_speed(single_shock_id, speed_limit)
-
-    if current_duration_counter == duration*10:
-        shock_counter += 1
-        current_duration_counter = 0
-        
-    if shock_counter< frequency:
-        if step >= shock_times[shock_counter][0] and step <= shock_times[shock_counter][1]:
-            print(f"Step = {step}, Shock params: {intensity}, {duration}, {frequency} applied to vehicle {single_shock_id}\n")
-            env.unwrapped.k.vehicle.set_max_speed(single_shock_id, intensity)
-            current_duration_counter+=1
-
-    return single_shock_id, shock_counter, current_duration_counter
+    for shock, veh_ids in stopped:
+        speed_limit = env.unwrapped.k.vehicle.get_max_speed(reference_speed_limit_id)
+        for veh_id in veh_ids:
+            env.unwrapped.k.vehicle.set_max_speed(veh_id, speed_limit)
+
+    for shock in started:
+        shock_scheduler.start(shock, [single_shock_id])
+        print(f"Step = {step}, Shock params: {intensity}, {duration}, {frequency} applied to vehicle {single_shock_id}\n")
+        env.unwrapped.k.vehicle.set_max_speed(single_shock_id, shock_scheduler.values[shock])
     
-def perform_shock(env, vehicles, single_shock_id, shock_times, shock_counter, current_duration_counter, step, intensities, durations, frequency, num_automated):
+def perform_shock(env, vehicles, shock_scheduler, step, intensities, durations, frequency, num_automated):
 
-    controller = env.unwrapped.k.vehicle.get_acc_controller(single_shock_id)
-    #print(f"\n\nController: {controller}\n\n")
+    stopped, started = shock_scheduler.advance(step)
 
-    # change color to white
-    # env.unwrapped.k.vehicle.set_color(single_shock_id, (255, 255, 255))
-    
     # Default: at times when shock is not applied, get acceleration from IDM
-    controller.set_shock_time(False)
+    for shock, veh_ids in stopped:
+        for veh_id in veh_ids:
+            env.unwrapped.k.vehicle.get_acc_controller(veh_id).set_shock_time(False)
 
-    if current_duration_counter == durations[shock_counter]*10:
-        shock_counter += 1
-        current_duration_counter = 0
+            # change color to white
+            # env.unwrapped.k.vehicle.set_color(veh_id, (255, 255, 255))
+
+    for shock in started:
         total_rl_ids = vehicles.get_rl_ids() if num_automated ==1 else vehicles.get_rl_ids() + ["rl_leader_0"]
         single_shock_id = random.choice([item for item in vehicles.get_ids() if item not in total_rl_ids])
-        
-    if shock_counter< frequency:
-        if step >= shock_times[shock_counter][0] and step <= shock_times[shock_counter][1]:
-            
-            print(f"Step = {step}, Shock params: {intensities[shock_counter]}, {durations[shock_counter]}, {frequency} applied to vehicle {single_shock_id}\n")
-            
-            controller.set_shock_time(True) 
-            controller.set_shock_accel(intensities[shock_counter])
+        shock_scheduler.start(shock, [single_shock_id])
+
+        print(f"Step = {step}, Shock params: {intensities[shock]}, {durations[shock]}, {frequency} applied to vehicle {single_shock_id}\n")
 
-            # change color to magenta (exclude the observed vehicles?)
-            env.unwrapped.k.vehicle.set_color(single_shock_id, (255, 0, 255))
+        controller = env.unwrapped.k.vehicle.get_acc_controller(single_shock_id)
+        controller.set_shock_time(True) 
+        controller.set_shock_accel(shock_scheduler.values[shock])
 
-            current_duration_counter+= 1
-    return single_shock_id, shock_counter, current_duration_counter
+        # change color to magenta (exclude the observed vehicles?)
+        env.unwrapped.k.vehicle.set_color(single_shock_id, (255, 0, 255))
 
 def create_parser():
     """Create the parser to capture CLI arguments."""
@@ -517,6 +535,10 @@ if __name__ == '__main__':
 
     parser = create_parser()
     parser.add_argument('--num_controlled', type=int, default=1)
+    # Parallel rollouts: 0 uses all cpus, 1 runs the rollouts one after the other in this process
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=None, help='Rollout i uses seed + i')
+    parser.add_argument('--base_port', type=int, default=None, help='Rollout i uses base_port + i, finds a free port if not set')
     parser = update_arguments(parser)
     args = parser.parse_args()
 
@@ -533,5 +555,14 @@ if __name__ == '__main__':
         else: 
             return 'av'
 
-    ray.init(num_cpus=1)
-    visualizer_rllib(args)
+    if args.num_workers != 1 or args.seed is not None or args.base_port is not None:
+        # Rollouts in parallel (or one after the other in this process with 1 worker, each with its own seed and port)
+        # Emission files of all rollouts end up in the same directory as before
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        rl_folder_name = f"{args.method}_stability" if args.stability else args.method
+        emission_path = f"{dir_path}/test_time_rollout/{rl_folder_name}" if args.gen_emission else None
+        run_rollouts(partial(rollout, args), args.num_rollouts, num_workers=args.num_workers or None,
+                     seed=args.seed, base_port=args.base_port, emission_path=emission_path)
+    else:
+        ray.init(num_cpus=1)
+        visualizer_rllib(args)